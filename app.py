@@ -1,17 +1,24 @@
 import os
 import json
+import re
 import hashlib
 import sqlite3
 import secrets
 import asyncio
-from datetime import datetime, timedelta
+import threading
+import time
+import traceback
+import weakref
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import List, Dict, Any, Optional, Iterable
-from urllib.parse import urlparse
+from urllib.parse import quote, unquote, urlencode, urlparse
 
-from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi import FastAPI, Request, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse, RedirectResponse, HTMLResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import httpx
@@ -21,12 +28,25 @@ import google.generativeai as genai
 # PostgreSQL 支援
 try:
     import psycopg2
+    import psycopg2.pool
+    import psycopg2.errors
+    import psycopg2.extras
     from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
     PSYCOPG2_AVAILABLE = True
 except ImportError:
     PSYCOPG2_AVAILABLE = False
     print("WARNING: psycopg2 未安裝，將使用 SQLite")
 
+# orjson 支援（較快的 JSON 序列化，未安裝時退回標準庫 json）
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
 
 # 導入新的記憶系統模組
 from memory import stm
@@ -132,6 +152,17 @@ if not JWT_SECRET:
 # 安全認證
 security = HTTPBearer()
 
+# 台灣時區（UTC+8），用於格式化顯示時間
+TAIWAN_TZ = timezone(timedelta(hours=8))
+
+# 資料庫設定：啟動時判斷一次，之後各請求直接引用
+DATABASE_URL = os.getenv("DATABASE_URL") or ""
+USE_POSTGRESQL = "postgresql://" in DATABASE_URL and PSYCOPG2_AVAILABLE
+SQLITE_DB_PATH = os.path.join(
+    os.getenv("DATABASE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")),
+    "chatbot.db",
+)
+
 
 # SQL 語法轉換輔助函數
 def convert_sql_for_postgresql(sql: str) -> str:
@@ -152,25 +183,31 @@ def convert_sql_for_postgresql(sql: str) -> str:
     return sql
 
 
+# SQL 佔位符：SQLite 用 ?，PostgreSQL 用 %s
+PH = "%s" if USE_POSTGRESQL else "?"
+
+
+@lru_cache(maxsize=512)
+def adapt_sql(sql: str) -> str:
+    """將以 ? 撰寫的 SQL 佔位符轉換為目前資料庫使用的格式（結果快取）"""
+    if USE_POSTGRESQL:
+        return sql.replace("?", "%s")
+    return sql
+
+
 # 數據庫初始化
 def init_database():
     """初始化資料庫（支援 PostgreSQL 和 SQLite）"""
-    database_url = os.getenv("DATABASE_URL")
-    
-    # 判斷使用哪種資料庫
-    use_postgresql = False
     conn = None
     
-    if database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE:
-        use_postgresql = True
+    if USE_POSTGRESQL:
         print(f"INFO: 初始化 PostgreSQL 資料庫")
-        conn = psycopg2.connect(database_url)
+        conn = psycopg2.connect(DATABASE_URL)
         conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
         cursor = conn.cursor()
     else:
         # 使用 SQLite
-        db_dir = os.getenv("DATABASE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
-        db_path = os.path.join(db_dir, "chatbot.db")
+        db_path = SQLITE_DB_PATH
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         print(f"INFO: 初始化 SQLite 資料庫: {db_path}")
         conn = sqlite3.connect(db_path)
@@ -178,7 +215,7 @@ def init_database():
     
     # 輔助函數：執行 SQL 並自動轉換語法
     def execute_sql(sql: str):
-        if use_postgresql:
+        if USE_POSTGRESQL:
             sql = convert_sql_for_postgresql(sql)
         cursor.execute(sql)
     
@@ -437,46 +474,493 @@ def init_database():
         )
     """)
     
+    # 建立索引：各用戶資料表皆以 user_id 篩選並依 created_at 倒序排列
+    for index_name, table in (
+        ("idx_positioning_records_user_created", "positioning_records"),
+        ("idx_user_scripts_user_created", "user_scripts"),
+        ("idx_generations_user_created", "generations"),
+        ("idx_conversation_summaries_user_created", "conversation_summaries"),
+        ("idx_user_preferences_user_created", "user_preferences"),
+        ("idx_user_behaviors_user_created", "user_behaviors"),
+        ("idx_orders_user_created", "orders"),
+    ):
+        execute_sql(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} (user_id, created_at DESC)")
+    # 行為統計依 behavior_type 分組
+    execute_sql("CREATE INDEX IF NOT EXISTS idx_user_behaviors_user_type ON user_behaviors (user_id, behavior_type)")
+    # 授權查詢取用戶最新一筆 active 授權
+    execute_sql("CREATE INDEX IF NOT EXISTS idx_licenses_user_status_created ON licenses (user_id, status, created_at DESC)")
+    # 管理後台列表依 created_at 倒序分頁，並以 created_at 範圍篩選近期資料
+    # PostgreSQL 以 CONCURRENTLY 建立，部署時不鎖住寫入（需在 AUTOCOMMIT 下執行）
+    concurrently = "CONCURRENTLY " if USE_POSTGRESQL else ""
+    for index_name, table in (
+        ("idx_conversation_summaries_created", "conversation_summaries"),
+        ("idx_user_scripts_created", "user_scripts"),
+        ("idx_generations_created", "generations"),
+        ("idx_user_auth_created", "user_auth"),
+        ("idx_orders_created", "orders"),
+    ):
+        execute_sql(f"CREATE INDEX {concurrently}IF NOT EXISTS {index_name} ON {table} (created_at DESC)")
+    
+    # 腳本每日彙總（分析頁面讀彙總列，不必每次掃描 user_scripts）
+    # platform / topic 以空字串代替 NULL，讓唯一鍵可用
+    if USE_POSTGRESQL:
+        cursor.execute("""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS user_scripts_daily_stats AS
+            SELECT DATE(created_at) AS day, COALESCE(platform, '') AS platform, COALESCE(topic, '') AS topic,
+                   user_id, COUNT(*) AS script_count
+            FROM user_scripts
+            GROUP BY 1, 2, 3, 4
+        """)
+    else:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_scripts_daily_stats (
+                day TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                script_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+    # 唯一索引同時供 REFRESH MATERIALIZED VIEW CONCURRENTLY 與 SQLite UPSERT 使用
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_scripts_daily_stats_key
+        ON user_scripts_daily_stats (day, platform, topic, user_id)
+    """)
+    if not USE_POSTGRESQL:
+        # SQLite 以觸發器即時維護彙總表
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_user_scripts_daily_stats_insert
+            AFTER INSERT ON user_scripts
+            BEGIN
+                INSERT INTO user_scripts_daily_stats (day, platform, topic, user_id, script_count)
+                VALUES (DATE(NEW.created_at), COALESCE(NEW.platform, ''), COALESCE(NEW.topic, ''), NEW.user_id, 1)
+                ON CONFLICT (day, platform, topic, user_id) DO UPDATE SET script_count = script_count + 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_user_scripts_daily_stats_delete
+            AFTER DELETE ON user_scripts
+            BEGIN
+                UPDATE user_scripts_daily_stats SET script_count = script_count - 1
+                WHERE day = DATE(OLD.created_at) AND platform = COALESCE(OLD.platform, '')
+                  AND topic = COALESCE(OLD.topic, '') AND user_id = OLD.user_id;
+                DELETE FROM user_scripts_daily_stats WHERE script_count <= 0;
+            END
+        """)
+        # 首次建立時以既有資料回填
+        cursor.execute("SELECT COUNT(*) FROM user_scripts_daily_stats")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("""
+                INSERT INTO user_scripts_daily_stats (day, platform, topic, user_id, script_count)
+                SELECT DATE(created_at), COALESCE(platform, ''), COALESCE(topic, ''), user_id, COUNT(*)
+                FROM user_scripts
+                GROUP BY 1, 2, 3, 4
+            """)
+    
+    # 更新統計資訊，讓查詢規劃器在 JOIN user_auth（主鍵 user_id）時選用索引
+    try:
+        if USE_POSTGRESQL:
+            cursor.execute("ANALYZE user_auth, conversation_summaries, generations, user_scripts")
+        else:
+            cursor.execute("PRAGMA optimize")
+    except Exception as e:
+        print(f"WARNING: 更新資料庫統計資訊失敗: {e}")
+    
     # PostgreSQL 使用 AUTOCOMMIT，不需要 commit
     # SQLite 需要 commit
-    if not use_postgresql:
+    if not USE_POSTGRESQL:
         conn.commit()
         conn.close()
     
-    if use_postgresql:
+    if USE_POSTGRESQL:
         conn.close()
         return "PostgreSQL"
     else:
         return db_path
 
 
+# PostgreSQL 連線池設定（常駐 20 條 + 尖峰額外 10 條，與 QueuePool 的 pool_size/max_overflow 對應）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+_pg_pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW)
+# 以連線物件本身為鍵（弱參照）：連線被關閉回收後自動移除，不會因 id() 重複使用而沿用舊的建立時間／已 PREPARE 的語句
+_pg_conn_born = weakref.WeakKeyDictionary()
+_pg_prepared = weakref.WeakKeyDictionary()
+
+
+def _get_pg_pool():
+    """延遲建立行程內共用的 PostgreSQL 連線池"""
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                print(f"INFO: 建立 PostgreSQL 連線池 (size={DB_POOL_SIZE}, overflow={DB_POOL_MAX_OVERFLOW})")
+                # minconn 即常駐連線數：psycopg2 會關閉歸還時超出 minconn 的連線（即 overflow）
+                # TCP keepalive 讓閒置連線被中間設備（PgBouncer / 負載平衡器）切斷時能及早發現
+                _pg_pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_SIZE, DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW, DATABASE_URL,
+                    keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5
+                )
+    return _pg_pool
+
+
+def _is_connection_usable(conn) -> bool:
+    """pre-ping：取出連線時確認未斷線且未超過回收時間"""
+    if conn.closed:
+        return False
+    born = _pg_conn_born.setdefault(conn, time.monotonic())
+    if time.monotonic() - born > DB_POOL_RECYCLE:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+
+class PooledConnection:
+    """連線池中的連線：close() 會把連線歸還連線池，而不是真的斷線"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            _pg_pool_slots.release()
+
+    def __del__(self):
+        # 早退路徑若漏掉 close()，物件回收時仍會把連線還給連線池
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _checkout_pg_connection() -> PooledConnection:
+    """從連線池取得可用連線（池滿時最多等待 DB_POOL_TIMEOUT 秒）"""
+    pool = _get_pg_pool()
+    if not _pg_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError("PostgreSQL 連線池已滿，等待逾時")
+    try:
+        conn = pool.getconn()
+        if not _is_connection_usable(conn):
+            _pg_conn_born.pop(conn, None)
+            _pg_prepared.pop(conn, None)
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+            _pg_conn_born[conn] = time.monotonic()
+        if not conn.autocommit:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    except Exception:
+        _pg_pool_slots.release()
+        raise
+    return PooledConnection(pool, conn)
+
+
 def get_db_connection():
     """獲取數據庫連接（支援 PostgreSQL 和 SQLite）"""
-    database_url = os.getenv("DATABASE_URL")
-    
-    # 如果有 DATABASE_URL 且包含 postgresql://，使用 PostgreSQL
-    if database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE:
+    # 如果有 DATABASE_URL 且包含 postgresql://，從連線池取得 PostgreSQL 連線
+    if USE_POSTGRESQL:
         try:
-            print(f"INFO: 連接到 PostgreSQL 資料庫")
-            conn = psycopg2.connect(database_url)
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            return conn
+            return _checkout_pg_connection()
         except Exception as e:
             print(f"ERROR: PostgreSQL 連接失敗: {e}")
             raise
     
-    # 預設使用 SQLite
-    db_dir = os.getenv("DATABASE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
-    db_path = os.path.join(db_dir, "chatbot.db")
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    
-    print(f"INFO: 連接到 SQLite 資料庫: {db_path}")
-    conn = sqlite3.connect(db_path, timeout=30.0)
+    # 預設使用 SQLite（目錄已於 init_database 建立）
+    conn = sqlite3.connect(SQLITE_DB_PATH, timeout=30.0)
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
 
+ADMIN_PAGE_SIZE_MAX = 200
+
+
+def resolve_pagination(page: int, page_size: int) -> tuple:
+    """正規化分頁參數，回傳 (page, page_size, offset)；page_size 上限為 ADMIN_PAGE_SIZE_MAX"""
+    page = max(1, page)
+    page_size = max(1, min(page_size, ADMIN_PAGE_SIZE_MAX))
+    return page, page_size, (page - 1) * page_size
+
+
+def parse_keyset_cursor(cursor: str) -> Optional[tuple]:
+    """解析 keyset 分頁 cursor（"created_at|id"），格式錯誤時回傳 None"""
+    created_at_str, _, id_str = cursor.rpartition("|")
+    if not created_at_str or not id_str.isdigit():
+        return None
+    return created_at_str, int(id_str)
+
+
+def build_keyset_cursor(created_at: Any, row_id: Any) -> str:
+    """以最後一筆的 (created_at, id) 產生下一頁的 cursor"""
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    return f"{created_at}|{row_id}"
+
+
+def fetch_all(sql: str, params: tuple = ()) -> list:
+    """以獨立連線執行查詢並回傳所有結果（可搭配 asyncio.to_thread 併發執行）"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+# 高頻語句：PostgreSQL 每條連線 PREPARE 一次，之後以 EXECUTE 重用執行計畫
+PREPARED_STATEMENTS = {
+    "profile_exists": "SELECT user_id FROM user_profiles WHERE user_id = ?",
+    "auth_user_exists": "SELECT 1 FROM user_auth WHERE user_id = ?",
+    "preference_lookup": """
+        SELECT id, confidence_score FROM user_preferences 
+        WHERE user_id = ? AND preference_type = ?
+    """,
+    "preference_update": """
+        UPDATE user_preferences 
+        SET preference_value = ?, confidence_score = ?, updated_at = ?
+        WHERE id = ?
+    """,
+    "preference_insert": """
+        INSERT INTO user_preferences (user_id, preference_type, preference_value, confidence_score)
+        VALUES (?, ?, ?, ?)
+    """,
+    "behavior_insert": """
+        INSERT INTO user_behaviors (user_id, behavior_type, behavior_data)
+        VALUES (?, ?, ?)
+    """,
+    "platform_stats": """
+        SELECT platform, CAST(SUM(script_count) AS INTEGER) as count
+        FROM user_scripts_daily_stats
+        WHERE platform <> ''
+        GROUP BY platform
+        ORDER BY count DESC
+    """,
+    "recent_activities": """
+        SELECT kind, user_id, name, detail, created_at FROM (
+            SELECT * FROM (
+                SELECT 'user' AS kind, user_id, name, NULL AS detail, created_at
+                FROM user_auth
+                ORDER BY created_at DESC
+                LIMIT 3
+            ) recent_users
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'script' AS kind, user_id, NULL AS name, title AS detail, created_at
+                FROM user_scripts
+                ORDER BY created_at DESC
+                LIMIT 3
+            ) recent_scripts
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'conversation' AS kind, user_id, NULL AS name, conversation_type AS detail, created_at
+                FROM conversation_summaries
+                ORDER BY created_at DESC
+                LIMIT 3
+            ) recent_conversations
+        ) recent
+        ORDER BY created_at DESC
+        LIMIT 10
+    """,
+    "subscription_update": """
+        UPDATE user_auth 
+        SET is_subscribed = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = ?
+    """,
+    "auth_me_lookup": """
+        SELECT google_id, email, name, picture, is_subscribed, created_at 
+        FROM user_auth 
+        WHERE user_id = ?
+    """,
+    "generation_dedup_lookup": "SELECT id FROM generations WHERE dedup_hash = ?",
+    "generation_insert": """
+        INSERT INTO generations (id, user_id, content, platform, topic, dedup_hash)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    "user_generations": """
+        SELECT id, content, platform, topic, created_at 
+        FROM generations 
+        WHERE user_id = ? 
+        ORDER BY created_at DESC 
+        LIMIT ?
+    """,
+}
+
+
+_PLACEHOLDER_RE = re.compile(r"\?")
+
+
+@lru_cache(maxsize=None)
+def _to_positional_sql(sql: str) -> str:
+    """把 ? 佔位符轉成 PREPARE 使用的 $1, $2, ..."""
+    counter = iter(range(1, sql.count("?") + 1))
+    return _PLACEHOLDER_RE.sub(lambda _: f"${next(counter)}", sql)
+
+
+def execute_prepared(cursor, name: str, params: tuple = ()):
+    """執行 PREPARED_STATEMENTS 中的語句；SQLite 直接執行（sqlite3 自帶語句快取）"""
+    sql = PREPARED_STATEMENTS[name]
+    if not USE_POSTGRESQL:
+        cursor.execute(sql, params)
+        return
+    
+    prepared = _pg_prepared.setdefault(cursor.connection, set())
+    execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+    if name not in prepared:
+        try:
+            cursor.execute(f"PREPARE {name} AS {_to_positional_sql(sql)}")
+        except psycopg2.errors.DuplicatePreparedStatement:
+            pass
+        prepared.add(name)
+    try:
+        cursor.execute(execute_sql, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # 伺服器端語句已失效（例如連線經 PgBouncer 換到其他後端），重新 PREPARE 後再執行
+        cursor.execute(f"PREPARE {name} AS {_to_positional_sql(sql)}")
+        cursor.execute(execute_sql, params)
+
+
+def rows_to_dicts(cursor) -> List[Dict[str, Any]]:
+    """依 cursor.description 的欄位名稱把查詢結果轉成 dict 列表（SQLite 與 PostgreSQL 通用）"""
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def fast_json_response(content: Any) -> Response:
+    """以 orjson 序列化大型回應；未安裝 orjson 時沿用 FastAPI 預設編碼"""
+    if ORJSON_AVAILABLE:
+        return ORJSONResponse(content)
+    return JSONResponse(jsonable_encoder(content))
+
+
+def iter_rows(sql: str, params: tuple = (), cursor_name: str = "stream_cursor", itersize: int = 1000):
+    """以獨立連線逐批讀取查詢結果（PostgreSQL 使用伺服器端游標），避免一次載入全部資料"""
+    conn = get_db_connection()
+    try:
+        if USE_POSTGRESQL:
+            # AUTOCOMMIT 連線上的具名游標需要 WITH HOLD
+            cursor = conn.cursor(name=cursor_name, withhold=True)
+            cursor.itersize = itersize
+            cursor.execute(sql, params)
+            try:
+                yield from cursor
+            finally:
+                cursor.close()
+        else:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    break
+                yield from rows
+    finally:
+        conn.close()
+
+
+# 對話類型對應的模式名稱，於 SQL 中以 CASE 直接轉換
+CONVERSATION_MODE_LABELS = {
+    "account_positioning": "帳號定位",
+    "topic_selection": "選題討論",
+    "script_generation": "腳本生成",
+    "general_consultation": "AI顧問",
+    "ip_planning": "IP人設規劃"
+}
+CONVERSATION_MODE_CASE_SQL = (
+    "CASE cs.conversation_type "
+    + " ".join(f"WHEN '{key}' THEN '{label}'" for key, label in CONVERSATION_MODE_LABELS.items())
+    + " ELSE cs.conversation_type END"
+)
+
+
+# 腳本每日彙總（PostgreSQL 物化視圖）的重新整理間隔
+ANALYTICS_REFRESH_INTERVAL = int(os.getenv("ANALYTICS_REFRESH_INTERVAL", "300"))
+_daily_stats_refreshed_at = 0.0
+_daily_stats_lock = threading.Lock()
+
+
+def refresh_daily_stats_if_stale(cursor):
+    """PostgreSQL 物化視圖超過 ANALYTICS_REFRESH_INTERVAL 秒未更新時重新整理（SQLite 由觸發器即時維護）"""
+    global _daily_stats_refreshed_at
+    if not USE_POSTGRESQL:
+        return
+    if time.monotonic() - _daily_stats_refreshed_at < ANALYTICS_REFRESH_INTERVAL:
+        return
+    # 已有其他請求在重新整理時直接讀取現有資料
+    if not _daily_stats_lock.acquire(blocking=False):
+        return
+    try:
+        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY user_scripts_daily_stats")
+        _daily_stats_refreshed_at = time.monotonic()
+    except Exception as e:
+        print(f"WARNING: 重新整理 user_scripts_daily_stats 失敗: {e}")
+    finally:
+        _daily_stats_lock.release()
+
+
+# 管理後台統計快取：儀表板輪詢時不必每次都掃全表
+ADMIN_STATS_CACHE_TTL = int(os.getenv("ADMIN_STATS_CACHE_TTL", "60"))
+_admin_stats_cache: Dict[str, tuple] = {}
+_admin_stats_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def cached_admin_stats(key: str, compute) -> tuple:
+    """在 TTL 內回傳快取的 (統計結果, ETag)；過期時只讓一個請求在執行緒中重新計算，錯誤回應不快取"""
+    entry = _admin_stats_cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1], entry[2]
+
+    lock = _admin_stats_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        entry = _admin_stats_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1], entry[2]
+        result = await asyncio.to_thread(compute)
+        if isinstance(result, Response):
+            return result, None
+        etag = build_etag(key, result)
+        _admin_stats_cache[key] = (time.monotonic() + ADMIN_STATS_CACHE_TTL, result, etag)
+        return result, etag
+
+
+def invalidate_admin_stats():
+    """清空管理後台統計快取（資料寫入或手動清除時呼叫）"""
+    _admin_stats_cache.clear()
+
+
+def build_etag(*parts: Any) -> str:
+    """由版本資訊產生弱 ETag"""
+    return 'W/"' + hashlib.md5(repr(parts).encode("utf-8")).hexdigest() + '"'
+
+
+def apply_etag(request: Request, response: Response, etag: str, cache_control: str) -> Optional[Response]:
+    """設定 ETag / Cache-Control；若 If-None-Match 相符則回傳 304 回應"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 def generate_dedup_hash(content: str, platform: str = None, topic: str = None) -> str:
     """生成去重哈希值"""
     # 清理內容，移除時間相關和隨機元素
@@ -495,11 +979,16 @@ def generate_user_id(email: str) -> str:
     return hashlib.md5(email.encode('utf-8')).hexdigest()[:12]
 
 
+ACCESS_TOKEN_TTL = 3600
+# 新 token 只比現有 token 多出不到這麼多秒時，refresh 直接沿用現有 token，不寫入資料庫
+TOKEN_REFRESH_SKIP_SECONDS = 60
+
+
 def generate_access_token(user_id: str) -> str:
     """生成訪問令牌"""
     payload = {
         "user_id": user_id,
-        "exp": datetime.now().timestamp() + 3600  # 1小時過期
+        "exp": datetime.now().timestamp() + ACCESS_TOKEN_TTL  # 1小時過期
     }
     # 簡單的 JWT 實現（生產環境建議使用 PyJWT）
     import base64
@@ -511,6 +1000,45 @@ def generate_access_token(user_id: str) -> str:
     return f"{encoded_header}.{encoded_payload}.{signature}"
 
 
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", "30"))
+AUTH_USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+AUTH_CACHE_MAXSIZE = 10000
+# token 以 sha256 雜湊為 key（不保存原始 token），值為 (快取到期時間, user_id, exp)
+_token_cache: Dict[str, tuple] = {}
+# /api/auth/me 的用戶資料，key 為 user_id，值為 (快取到期時間, 回應內容)
+_auth_user_cache: Dict[str, tuple] = {}
+
+
+def _cache_put(cache: Dict[str, tuple], key: str, value: tuple):
+    """寫入有上限的快取；滿了先清掉已過期項目，仍滿則淘汰最早寫入的一筆"""
+    if len(cache) >= AUTH_CACHE_MAXSIZE:
+        now = time.monotonic()
+        for stale_key in [k for k, v in cache.items() if v[0] <= now]:
+            cache.pop(stale_key, None)
+        if len(cache) >= AUTH_CACHE_MAXSIZE:
+            cache.pop(next(iter(cache)), None)
+    cache[key] = value
+
+
+def invalidate_auth_user(user_id: Optional[str] = None):
+    """清除 /api/auth/me 的用戶快取；未指定 user_id 時全部清除"""
+    if user_id is None:
+        _auth_user_cache.clear()
+    else:
+        _auth_user_cache.pop(user_id, None)
+
+
+def auth_user_exists(user_id: str) -> bool:
+    """user_auth 是否已有此用戶（主鍵查詢）"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        execute_prepared(cursor, "auth_user_exists", (user_id,))
+        return cursor.fetchone() is not None
+    finally:
+        conn.close()
+
+
 def verify_access_token(token: str, allow_expired: bool = False) -> Optional[str]:
     """
     驗證訪問令牌並返回用戶 ID
@@ -518,30 +1046,38 @@ def verify_access_token(token: str, allow_expired: bool = False) -> Optional[str
     - allow_expired=True：允許過期（給 refresh 用），仍回傳 user_id
     """
     try:
-        import base64
-        import json
-        parts = token.split('.')
-        if len(parts) != 3:
-            print(f"[verify_access_token] format error, allow_expired={allow_expired}")
-            return None
+        # 已驗證過簽名的 token 直接取快取的 payload，過期判斷仍每次進行
+        cache_key = hashlib.sha256(token.encode()).hexdigest()[:32]
+        entry = _token_cache.get(cache_key)
+        if entry and entry[0] > time.monotonic():
+            user_id, exp = entry[1], entry[2]
+        else:
+            import base64
+            import json
+            parts = token.split('.')
+            if len(parts) != 3:
+                print(f"[verify_access_token] format error, allow_expired={allow_expired}")
+                return None
 
-        # 簽名驗證
-        expected_signature = hashlib.sha256(f"{parts[0]}.{parts[1]}.{JWT_SECRET}".encode()).hexdigest()
-        if expected_signature != parts[2]:
-            print(f"[verify_access_token] bad signature, allow_expired={allow_expired}")
-            print(f"[verify_access_token] JWT_SECRET set: {bool(JWT_SECRET)}")
-            return None
+            # 簽名驗證
+            expected_signature = hashlib.sha256(f"{parts[0]}.{parts[1]}.{JWT_SECRET}".encode()).hexdigest()
+            if expected_signature != parts[2]:
+                print(f"[verify_access_token] bad signature, allow_expired={allow_expired}")
+                print(f"[verify_access_token] JWT_SECRET set: {bool(JWT_SECRET)}")
+                return None
 
-        # 解碼 payload（修正 padding）
-        payload_b64 = parts[1]
-        padding = '=' * ((4 - len(payload_b64) % 4) % 4)
-        payload = json.loads(base64.urlsafe_b64decode(payload_b64 + padding).decode())
+            # 解碼 payload（修正 padding）
+            payload_b64 = parts[1]
+            padding = '=' * ((4 - len(payload_b64) % 4) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(payload_b64 + padding).decode())
 
-        user_id = payload.get("user_id")
-        if not user_id:
-            return None
+            user_id = payload.get("user_id")
+            if not user_id:
+                return None
+
+            exp = payload.get("exp", 0)
+            _cache_put(_token_cache, cache_key, (time.monotonic() + AUTH_TOKEN_CACHE_TTL, user_id, exp))
 
-        exp = payload.get("exp", 0)
         now = datetime.now().timestamp()
 
         if not allow_expired:
@@ -560,23 +1096,115 @@ def verify_access_token(token: str, allow_expired: bool = False) -> Optional[str
         return None
 
 
+TOKEN_FLUSH_INTERVAL = int(os.getenv("TOKEN_FLUSH_INTERVAL", "10"))
+# refresh 產生的新 token 先暫存於記憶體（同一用戶只保留最新一筆），由背景任務定期批次寫回 user_auth
+_token_write_buffer: Dict[str, tuple] = {}
+_token_write_lock = threading.Lock()
+
+
+def buffer_token_write(user_id: str, access_token: str, expires_at: datetime):
+    """暫存待寫入的 token"""
+    with _token_write_lock:
+        _token_write_buffer[user_id] = (access_token, expires_at)
+
+
+def flush_token_writes() -> int:
+    """將暫存的 token 批次寫回 user_auth（同一交易），回傳實際寫入筆數"""
+    with _token_write_lock:
+        if not _token_write_buffer:
+            return 0
+        pending = list(_token_write_buffer.items())
+        _token_write_buffer.clear()
+    
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if USE_POSTGRESQL:
+            rows = psycopg2.extras.execute_values(cursor, """
+                UPDATE user_auth AS ua
+                SET access_token = v.access_token, expires_at = v.expires_at, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(user_id, access_token, expires_at)
+                WHERE ua.user_id = v.user_id
+                RETURNING ua.user_id
+            """, [(user_id, token, expires_at) for user_id, (token, expires_at) in pending], fetch=True)
+            updated = {row[0] for row in rows}
+        else:
+            updated = set()
+            for user_id, (token, expires_at) in pending:
+                cursor.execute("""
+                    UPDATE user_auth 
+                    SET access_token = ?, expires_at = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                """, (token, expires_at.isoformat(), user_id))
+                if cursor.rowcount:
+                    updated.add(user_id)
+            conn.commit()
+    except Exception:
+        # 寫入失敗時放回暫存（期間若已有更新的 token 則以新的為準）
+        with _token_write_lock:
+            for user_id, value in pending:
+                _token_write_buffer.setdefault(user_id, value)
+        raise
+    finally:
+        conn.close()
+    
+    # 沒有對應資料列的用戶（已刪除或不存在）：清掉快取，下次 refresh 會以主鍵查詢並回 404
+    for user_id, _ in pending:
+        if user_id not in updated:
+            print(f"WARNING: refresh 的用戶不存在於 user_auth，已略過寫入 user_id={user_id}")
+            invalidate_auth_user(user_id)
+    return len(updated)
+
+
+async def token_flush_loop():
+    """每 TOKEN_FLUSH_INTERVAL 秒將暫存的 token 寫回資料庫"""
+    while True:
+        await asyncio.sleep(TOKEN_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_token_writes)
+        except Exception as e:
+            print(f"ERROR: token 批次寫入失敗: {e}")
+
+
+def access_token_expiry(token: str) -> Optional[float]:
+    """回傳本系統簽發之 token 的 exp 時間戳；驗證失敗時回傳 None"""
+    if not token or not verify_access_token(token, allow_expired=True):
+        return None
+    entry = _token_cache.get(hashlib.sha256(token.encode()).hexdigest()[:32])
+    return entry[2] if entry else None
+
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """取得共用的 httpx.AsyncClient（保留連線池與 TLS 連線，避免每次 OAuth 都重新握手）"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        )
+    return _http_client
+
+
 async def get_google_user_info(access_token: str) -> Optional[GoogleUser]:
     """從 Google 獲取用戶資訊"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://www.googleapis.com/oauth2/v2/userinfo",
-                headers={"Authorization": f"Bearer {access_token}"}
+        client = get_http_client()
+        response = await client.get(
+            "https://www.googleapis.com/oauth2/v2/userinfo",
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        if response.status_code == 200:
+            data = response.json()
+            return GoogleUser(
+                id=data["id"],
+                email=data["email"],
+                name=data["name"],
+                picture=data.get("picture"),
+                verified_email=data.get("verified_email", False)
             )
-            if response.status_code == 200:
-                data = response.json()
-                return GoogleUser(
-                    id=data["id"],
-                    email=data["email"],
-                    name=data["name"],
-                    picture=data.get("picture"),
-                    verified_email=data.get("verified_email", False)
-                )
     except Exception as e:
         print(f"Error getting Google user info: {e}")
     return None
@@ -641,24 +1269,24 @@ def load_kb_text() -> str:
         return ""
 
 
+SUMMARY_ABSENT_CACHE_TTL = int(os.getenv("SUMMARY_ABSENT_CACHE_TTL", "60"))
+# 查無對話摘要的用戶（key 為 user_id，值為 (快取到期時間,)），寫入摘要時移除
+_summary_absent_cache: Dict[str, tuple] = {}
+
+
 def save_conversation_summary(user_id: str, user_message: str, ai_response: str) -> None:
     """保存智能對話摘要"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        database_url = os.getenv("DATABASE_URL")
-        use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
 
         # 確保 user_profiles 存在該 user_id（修復外鍵約束錯誤）
-        if use_postgresql:
-            cursor.execute("SELECT user_id FROM user_profiles WHERE user_id = %s", (user_id,))
-        else:
-            cursor.execute("SELECT user_id FROM user_profiles WHERE user_id = ?", (user_id,))
+        execute_prepared(cursor, "profile_exists", (user_id,))
         
         if not cursor.fetchone():
             # 如果不存在，自動創建
-            if use_postgresql:
+            if USE_POSTGRESQL:
                 cursor.execute("""
                     INSERT INTO user_profiles (user_id, created_at)
                     VALUES (%s, CURRENT_TIMESTAMP)
@@ -674,23 +1302,18 @@ def save_conversation_summary(user_id: str, user_message: str, ai_response: str)
         summary = generate_smart_summary(user_message, ai_response)
         conversation_type = classify_conversation(user_message, ai_response)
 
-        if use_postgresql:
-            cursor.execute("""
-                INSERT INTO conversation_summaries (user_id, summary, conversation_type, created_at)
-                VALUES (%s, %s, %s, %s)
-            """, (user_id, summary, conversation_type, datetime.now()))
-        else:
-            cursor.execute("""
-                INSERT INTO conversation_summaries (user_id, summary, conversation_type, created_at)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, summary, conversation_type, datetime.now()))
+        cursor.execute(adapt_sql("""
+            INSERT INTO conversation_summaries (user_id, summary, conversation_type, created_at)
+            VALUES (?, ?, ?, ?)
+        """), (user_id, summary, conversation_type, datetime.now()))
 
         # 追蹤用戶偏好
         track_user_preferences(user_id, user_message, ai_response, conversation_type)
 
-        if not use_postgresql:
+        if not USE_POSTGRESQL:
             conn.commit()
         conn.close()
+        _summary_absent_cache.pop(user_id, None)
 
     except Exception as e:
         print(f"保存對話摘要時出錯: {e}")
@@ -701,68 +1324,28 @@ def track_user_preferences(user_id: str, user_message: str, ai_response: str, co
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        database_url = os.getenv("DATABASE_URL")
-        use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
         
         # 提取偏好信息
         preferences = extract_user_preferences(user_message, ai_response, conversation_type)
         
         for pref_type, pref_value in preferences.items():
             # 檢查是否已存在
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, confidence_score FROM user_preferences 
-                    WHERE user_id = %s AND preference_type = %s
-                """, (user_id, pref_type))
-            else:
-                cursor.execute("""
-                    SELECT id, confidence_score FROM user_preferences 
-                    WHERE user_id = ? AND preference_type = ?
-                """, (user_id, pref_type))
+            execute_prepared(cursor, "preference_lookup", (user_id, pref_type))
             
             existing = cursor.fetchone()
             
             if existing:
                 # 更新現有偏好，增加信心分數
                 new_confidence = min(existing[1] + 0.1, 1.0)
-                if use_postgresql:
-                    cursor.execute("""
-                        UPDATE user_preferences 
-                        SET preference_value = %s, confidence_score = %s, updated_at = %s
-                        WHERE id = %s
-                    """, (pref_value, new_confidence, datetime.now(), existing[0]))
-                else:
-                    cursor.execute("""
-                        UPDATE user_preferences 
-                        SET preference_value = ?, confidence_score = ?, updated_at = ?
-                        WHERE id = ?
-                    """, (pref_value, new_confidence, datetime.now(), existing[0]))
+                execute_prepared(cursor, "preference_update", (pref_value, new_confidence, datetime.now(), existing[0]))
             else:
                 # 創建新偏好
-                if use_postgresql:
-                    cursor.execute("""
-                        INSERT INTO user_preferences (user_id, preference_type, preference_value, confidence_score)
-                        VALUES (%s, %s, %s, %s)
-                    """, (user_id, pref_type, pref_value, 0.5))
-                else:
-                    cursor.execute("""
-                        INSERT INTO user_preferences (user_id, preference_type, preference_value, confidence_score)
-                        VALUES (?, ?, ?, ?)
-                    """, (user_id, pref_type, pref_value, 0.5))
+                execute_prepared(cursor, "preference_insert", (user_id, pref_type, pref_value, 0.5))
         
         # 記錄行為
-        if use_postgresql:
-            cursor.execute("""
-                INSERT INTO user_behaviors (user_id, behavior_type, behavior_data)
-                VALUES (%s, %s, %s)
-            """, (user_id, conversation_type, f"用戶輸入: {user_message[:100]}"))
-        else:
-            cursor.execute("""
-                INSERT INTO user_behaviors (user_id, behavior_type, behavior_data)
-                VALUES (?, ?, ?)
-            """, (user_id, conversation_type, f"用戶輸入: {user_message[:100]}"))
+        execute_prepared(cursor, "behavior_insert", (user_id, conversation_type, f"用戶輸入: {user_message[:100]}"))
         
-        if not use_postgresql:
+        if not USE_POSTGRESQL:
             conn.commit()
         conn.close()
         
@@ -861,86 +1444,47 @@ def get_user_memory(user_id: Optional[str]) -> str:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        database_url = os.getenv("DATABASE_URL")
-        use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
 
         # 獲取用戶基本資料
-        if use_postgresql:
-            cursor.execute("SELECT * FROM user_profiles WHERE user_id = %s", (user_id,))
-        else:
-            cursor.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
+        cursor.execute(adapt_sql("SELECT * FROM user_profiles WHERE user_id = ?"), (user_id,))
         profile = cursor.fetchone()
 
         # 獲取用戶偏好
-        if use_postgresql:
-            cursor.execute("""
-                SELECT preference_type, preference_value, confidence_score 
-                FROM user_preferences 
-                WHERE user_id = %s AND confidence_score > 0.3
-                ORDER BY confidence_score DESC
-            """, (user_id,))
-        else:
-            cursor.execute("""
-                SELECT preference_type, preference_value, confidence_score 
-                FROM user_preferences 
-                WHERE user_id = ? AND confidence_score > 0.3
-                ORDER BY confidence_score DESC
-            """, (user_id,))
+        cursor.execute(adapt_sql("""
+            SELECT preference_type, preference_value, confidence_score 
+            FROM user_preferences 
+            WHERE user_id = ? AND confidence_score > 0.3
+            ORDER BY confidence_score DESC
+        """), (user_id,))
         preferences = cursor.fetchall()
 
         # 獲取最近的對話摘要（按類型分組）
-        if use_postgresql:
-            cursor.execute("""
-                SELECT conversation_type, summary, created_at 
-                FROM conversation_summaries
-                WHERE user_id = %s
-                ORDER BY created_at DESC
-                LIMIT 10
-            """, (user_id,))
-        else:
-            cursor.execute("""
-                SELECT conversation_type, summary, created_at 
-                FROM conversation_summaries
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT 10
-            """, (user_id,))
+        cursor.execute(adapt_sql("""
+            SELECT conversation_type, summary, created_at 
+            FROM conversation_summaries
+            WHERE user_id = ?
+            ORDER BY created_at DESC
+            LIMIT 10
+        """), (user_id,))
         summaries = cursor.fetchall()
 
         # 獲取最近的生成記錄
-        if use_postgresql:
-            cursor.execute("""
-                SELECT platform, topic, content, created_at FROM generations
-                WHERE user_id = %s
-                ORDER BY created_at DESC
-                LIMIT 5
-            """, (user_id,))
-        else:
-            cursor.execute("""
-                SELECT platform, topic, content, created_at FROM generations
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT 5
-            """, (user_id,))
+        cursor.execute(adapt_sql("""
+            SELECT platform, topic, content, created_at FROM generations
+            WHERE user_id = ?
+            ORDER BY created_at DESC
+            LIMIT 5
+        """), (user_id,))
         generations = cursor.fetchall()
 
         # 獲取用戶行為統計
-        if use_postgresql:
-            cursor.execute("""
-                SELECT behavior_type, COUNT(*) as count
-                FROM user_behaviors
-                WHERE user_id = %s
-                GROUP BY behavior_type
-                ORDER BY count DESC
-            """, (user_id,))
-        else:
-            cursor.execute("""
-                SELECT behavior_type, COUNT(*) as count
-                FROM user_behaviors
-                WHERE user_id = ?
-                GROUP BY behavior_type
-                ORDER BY count DESC
-            """, (user_id,))
+        cursor.execute(adapt_sql("""
+            SELECT behavior_type, COUNT(*) as count
+            FROM user_behaviors
+            WHERE user_id = ?
+            GROUP BY behavior_type
+            ORDER BY count DESC
+        """), (user_id,))
         behaviors = cursor.fetchall()
 
         conn.close()
@@ -1074,7 +1618,24 @@ def create_app() -> FastAPI:
     db_path = init_database()
     print(f"INFO: Database initialized at: {db_path}")
 
-    app = FastAPI()
+    # orjson 可用時作為預設回應類別，加速大型管理列表與統計的 JSON 序列化
+    app = FastAPI(default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse)
+
+    @app.on_event("startup")
+    async def start_token_flusher():
+        """啟動 token 批次寫入背景任務"""
+        app.state.token_flush_task = asyncio.create_task(token_flush_loop())
+
+    @app.on_event("shutdown")
+    async def shutdown_background_resources():
+        """關閉共用的 httpx.AsyncClient，並寫回尚未寫入的 token"""
+        app.state.token_flush_task.cancel()
+        try:
+            await asyncio.to_thread(flush_token_writes)
+        except Exception as e:
+            print(f"ERROR: token 批次寫入失敗: {e}")
+        if _http_client is not None:
+            await _http_client.aclose()
 
     # CORS for local file or dev servers
     frontend_url = os.getenv("FRONTEND_URL")
@@ -1436,23 +1997,13 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, conversation_type, summary, message_count, created_at FROM conversation_summaries 
-                    WHERE user_id = %s 
-                    ORDER BY created_at DESC 
-                    LIMIT 100
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT id, conversation_type, summary, message_count, created_at FROM conversation_summaries 
-                    WHERE user_id = ? 
-                    ORDER BY created_at DESC 
-                    LIMIT 100
-                """, (user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT id, conversation_type, summary, message_count, created_at FROM conversation_summaries 
+                WHERE user_id = ? 
+                ORDER BY created_at DESC 
+                LIMIT 100
+            """), (user_id,))
             
             conversations = cursor.fetchall()
             
@@ -1491,23 +2042,13 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT platform, topic, content, created_at FROM generations 
-                    WHERE user_id = %s 
-                    ORDER BY created_at DESC 
-                    LIMIT 10
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT platform, topic, content, created_at FROM generations 
-                    WHERE user_id = ? 
-                    ORDER BY created_at DESC 
-                    LIMIT 10
-                """, (user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT platform, topic, content, created_at FROM generations 
+                WHERE user_id = ? 
+                ORDER BY created_at DESC 
+                LIMIT 10
+            """), (user_id,))
             generations = cursor.fetchall()
             
             conn.close()
@@ -1632,19 +2173,14 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
             # 先檢查 user_profiles 是否存在該 user_id，若不存在則自動建立
-            if use_postgresql:
-                cursor.execute("SELECT user_id FROM user_profiles WHERE user_id = %s", (user_id,))
-            else:
-                cursor.execute("SELECT user_id FROM user_profiles WHERE user_id = ?", (user_id,))
+            execute_prepared(cursor, "profile_exists", (user_id,))
             profile_exists = cursor.fetchone()
             
             if not profile_exists:
                 # 自動建立 user_profiles 記錄
-                if use_postgresql:
+                if USE_POSTGRESQL:
                     cursor.execute("""
                         INSERT INTO user_profiles (user_id, created_at)
                         VALUES (%s, CURRENT_TIMESTAMP)
@@ -1658,15 +2194,12 @@ def create_app() -> FastAPI:
                 conn.commit()
             
             # 獲取該用戶的記錄數量來生成編號
-            if use_postgresql:
-                cursor.execute("SELECT COUNT(*) FROM positioning_records WHERE user_id = %s", (user_id,))
-            else:
-                cursor.execute("SELECT COUNT(*) FROM positioning_records WHERE user_id = ?", (user_id,))
+            cursor.execute(adapt_sql("SELECT COUNT(*) FROM positioning_records WHERE user_id = ?"), (user_id,))
             count = cursor.fetchone()[0]
             record_number = f"{count + 1:02d}"
             
             # 插入記錄
-            if use_postgresql:
+            if USE_POSTGRESQL:
                 cursor.execute("""
                     INSERT INTO positioning_records (user_id, record_number, content)
                     VALUES (%s, %s, %s)
@@ -1698,23 +2231,13 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, record_number, content, created_at
-                    FROM positioning_records
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT id, record_number, content, created_at
-                    FROM positioning_records
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                """, (user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT id, record_number, content, created_at
+                FROM positioning_records
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+            """), (user_id,))
             
             records = []
             for row in cursor.fetchall():
@@ -1737,15 +2260,10 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("DELETE FROM positioning_records WHERE id = %s", (record_id,))
-            else:
-                cursor.execute("DELETE FROM positioning_records WHERE id = ?", (record_id,))
+            cursor.execute(adapt_sql("DELETE FROM positioning_records WHERE id = ?"), (record_id,))
             
-            if not use_postgresql:
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
             
@@ -1777,14 +2295,12 @@ def create_app() -> FastAPI:
                 conn = get_db_connection()
                 cursor = conn.cursor()
                 
-                database_url = os.getenv("DATABASE_URL")
-                use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
                 
                 # 提取腳本標題作為預設名稱
                 script_name = script_data.get("title", "未命名腳本")
                 
                 # 插入腳本記錄
-                if use_postgresql:
+                if USE_POSTGRESQL:
                     cursor.execute("""
                         INSERT INTO user_scripts (user_id, script_name, title, content, script_data, platform, topic, profile)
                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
@@ -1846,23 +2362,13 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, script_name, title, content, script_data, platform, topic, profile, created_at, updated_at
-                    FROM user_scripts
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (current_user_id,))
-            else:
-                cursor.execute("""
-                    SELECT id, script_name, title, content, script_data, platform, topic, profile, created_at, updated_at
-                    FROM user_scripts
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                """, (current_user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT id, script_name, title, content, script_data, platform, topic, profile, created_at, updated_at
+                FROM user_scripts
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+            """), (current_user_id,))
             
             scripts = []
             for row in cursor.fetchall():
@@ -1899,21 +2405,13 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    INSERT INTO long_term_memory (user_id, conversation_type, session_id, message_role, message_content, metadata)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (current_user_id, request_body.conversation_type, request_body.session_id, request_body.message_role, request_body.message_content, request_body.metadata))
-            else:
-                cursor.execute("""
-                    INSERT INTO long_term_memory (user_id, conversation_type, session_id, message_role, message_content, metadata)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (current_user_id, request_body.conversation_type, request_body.session_id, request_body.message_role, request_body.message_content, request_body.metadata))
+            cursor.execute(adapt_sql("""
+                INSERT INTO long_term_memory (user_id, conversation_type, session_id, message_role, message_content, metadata)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """), (current_user_id, request_body.conversation_type, request_body.session_id, request_body.message_role, request_body.message_content, request_body.metadata))
             
-            if not use_postgresql:
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
             return {"success": True, "message": "長期記憶已儲存"}
@@ -1935,59 +2433,31 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                if conversation_type and session_id:
-                    cursor.execute("""
-                        SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
-                        FROM long_term_memory
-                        WHERE user_id = %s AND conversation_type = %s AND session_id = %s
-                        ORDER BY created_at DESC
-                        LIMIT %s
-                    """, (current_user_id, conversation_type, session_id, limit))
-                elif conversation_type:
-                    cursor.execute("""
-                        SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
-                        FROM long_term_memory
-                        WHERE user_id = %s AND conversation_type = %s
-                        ORDER BY created_at DESC
-                        LIMIT %s
-                    """, (current_user_id, conversation_type, limit))
-                else:
-                    cursor.execute("""
-                        SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
-                        FROM long_term_memory
-                        WHERE user_id = %s
-                        ORDER BY created_at DESC
-                        LIMIT %s
-                    """, (current_user_id, limit))
+            if conversation_type and session_id:
+                cursor.execute(adapt_sql("""
+                    SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
+                    FROM long_term_memory
+                    WHERE user_id = ? AND conversation_type = ? AND session_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                """), (current_user_id, conversation_type, session_id, limit))
+            elif conversation_type:
+                cursor.execute(adapt_sql("""
+                    SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
+                    FROM long_term_memory
+                    WHERE user_id = ? AND conversation_type = ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                """), (current_user_id, conversation_type, limit))
             else:
-                if conversation_type and session_id:
-                    cursor.execute("""
-                        SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
-                        FROM long_term_memory
-                        WHERE user_id = ? AND conversation_type = ? AND session_id = ?
-                        ORDER BY created_at DESC
-                        LIMIT ?
-                    """, (current_user_id, conversation_type, session_id, limit))
-                elif conversation_type:
-                    cursor.execute("""
-                        SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
-                        FROM long_term_memory
-                        WHERE user_id = ? AND conversation_type = ?
-                        ORDER BY created_at DESC
-                        LIMIT ?
-                    """, (current_user_id, conversation_type, limit))
-                else:
-                    cursor.execute("""
-                        SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
-                        FROM long_term_memory
-                        WHERE user_id = ?
-                        ORDER BY created_at DESC
-                        LIMIT ?
-                    """, (current_user_id, limit))
+                cursor.execute(adapt_sql("""
+                    SELECT id, conversation_type, session_id, message_role, message_content, metadata, created_at
+                    FROM long_term_memory
+                    WHERE user_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                """), (current_user_id, limit))
             
             memories = []
             for row in cursor.fetchall():
@@ -2008,59 +2478,34 @@ def create_app() -> FastAPI:
     
     # 管理員長期記憶API
     @app.get("/api/admin/long-term-memory")
-    async def get_all_long_term_memory(conversation_type: Optional[str] = None, limit: int = 100):
+    def get_all_long_term_memory(conversation_type: Optional[str] = None, limit: int = 100):
         """獲取所有長期記憶記錄（管理員用）"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                if conversation_type:
-                    cursor.execute("""
-                        SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id, 
-                               ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
-                               ua.name, ua.email
-                        FROM long_term_memory ltm
-                        LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
-                        WHERE ltm.conversation_type = %s
-                        ORDER BY ltm.created_at DESC
-                        LIMIT %s
-                    """, (conversation_type, limit))
-                else:
-                    cursor.execute("""
-                        SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id, 
-                               ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
-                               ua.name, ua.email
-                        FROM long_term_memory ltm
-                        LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
-                        ORDER BY ltm.created_at DESC
-                        LIMIT %s
-                    """, (limit,))
+            if conversation_type:
+                cursor.execute(adapt_sql("""
+                    SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id, 
+                           ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
+                           ua.name, ua.email
+                    FROM long_term_memory ltm
+                    LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
+                    WHERE ltm.conversation_type = ?
+                    ORDER BY ltm.created_at DESC
+                    LIMIT ?
+                """), (conversation_type, limit))
             else:
-                if conversation_type:
-                    cursor.execute("""
-                        SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id, 
-                               ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
-                               ua.name, ua.email
-                        FROM long_term_memory ltm
-                        LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
-                        WHERE ltm.conversation_type = ?
-                        ORDER BY ltm.created_at DESC
-                        LIMIT ?
-                    """, (conversation_type, limit))
-                else:
-                    cursor.execute("""
-                        SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id, 
-                               ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
-                               ua.name, ua.email
-                        FROM long_term_memory ltm
-                        LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
-                        ORDER BY ltm.created_at DESC
-                        LIMIT ?
-                    """, (limit,))
+                cursor.execute(adapt_sql("""
+                    SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id, 
+                           ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
+                           ua.name, ua.email
+                    FROM long_term_memory ltm
+                    LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
+                    ORDER BY ltm.created_at DESC
+                    LIMIT ?
+                """), (limit,))
             
             memories = []
             for row in cursor.fetchall():
@@ -2084,38 +2529,23 @@ def create_app() -> FastAPI:
 
     # 取得單筆長期記憶（管理員用）
     @app.get("/api/admin/long-term-memory/{memory_id}")
-    async def get_long_term_memory_by_id(memory_id: int):
+    def get_long_term_memory_by_id(memory_id: int):
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
 
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
 
-            if use_postgresql:
-                cursor.execute(
-                    """
-                    SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id,
-                           ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
-                           ua.name, ua.email
-                    FROM long_term_memory ltm
-                    LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
-                    WHERE ltm.id = %s
-                    """,
-                    (memory_id,)
-                )
-            else:
-                cursor.execute(
-                    """
-                    SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id,
-                           ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
-                           ua.name, ua.email
-                    FROM long_term_memory ltm
-                    LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
-                    WHERE ltm.id = ?
-                    """,
-                    (memory_id,)
-                )
+            cursor.execute(
+                adapt_sql("""
+                SELECT ltm.id, ltm.user_id, ltm.conversation_type, ltm.session_id,
+                       ltm.message_role, ltm.message_content, ltm.metadata, ltm.created_at,
+                       ua.name, ua.email
+                FROM long_term_memory ltm
+                LEFT JOIN user_auth ua ON ltm.user_id = ua.user_id
+                WHERE ltm.id = ?
+                """),
+                (memory_id,)
+            )
 
             row = cursor.fetchone()
             conn.close()
@@ -2139,28 +2569,21 @@ def create_app() -> FastAPI:
 
     # 刪除單筆長期記憶（管理員用）
     @app.delete("/api/admin/long-term-memory/{memory_id}")
-    async def delete_long_term_memory(memory_id: int):
+    def delete_long_term_memory(memory_id: int):
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
 
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
 
             # 檢查存在
-            if use_postgresql:
-                cursor.execute("SELECT id FROM long_term_memory WHERE id = %s", (memory_id,))
-            else:
-                cursor.execute("SELECT id FROM long_term_memory WHERE id = ?", (memory_id,))
+            cursor.execute(adapt_sql("SELECT id FROM long_term_memory WHERE id = ?"), (memory_id,))
             if not cursor.fetchone():
                 conn.close()
                 return JSONResponse({"error": "記錄不存在"}, status_code=404)
 
             # 刪除
-            if use_postgresql:
-                cursor.execute("DELETE FROM long_term_memory WHERE id = %s", (memory_id,))
-            else:
-                cursor.execute("DELETE FROM long_term_memory WHERE id = ?", (memory_id,))
+            cursor.execute(adapt_sql("DELETE FROM long_term_memory WHERE id = ?"), (memory_id,))
+            if not USE_POSTGRESQL:
                 conn.commit()
 
             conn.close()
@@ -2169,16 +2592,14 @@ def create_app() -> FastAPI:
             return JSONResponse({"error": str(e)}, status_code=500)
     
     @app.get("/api/admin/memory-stats")
-    async def get_memory_stats():
+    def get_memory_stats():
         """獲取長期記憶統計（管理員用）"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
+            if USE_POSTGRESQL:
                 # 總記憶數
                 cursor.execute("SELECT COUNT(*) FROM long_term_memory")
                 total_memories = cursor.fetchone()[0]
@@ -2239,41 +2660,29 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
             # 構建查詢條件
-            where_conditions = ["user_id = ?" if not use_postgresql else "user_id = %s"]
+            where_conditions = ["user_id = ?" if not USE_POSTGRESQL else "user_id = %s"]
             params = [current_user_id]
             
             if conversation_type:
-                where_conditions.append("conversation_type = ?" if not use_postgresql else "conversation_type = %s")
+                where_conditions.append("conversation_type = ?" if not USE_POSTGRESQL else "conversation_type = %s")
                 params.append(conversation_type)
             
             if session_id:
-                where_conditions.append("session_id = ?" if not use_postgresql else "session_id = %s")
+                where_conditions.append("session_id = ?" if not USE_POSTGRESQL else "session_id = %s")
                 params.append(session_id)
             
             where_clause = " AND ".join(where_conditions)
             
-            if use_postgresql:
-                cursor.execute(f"""
-                    SELECT id, user_id, conversation_type, session_id, 
-                           message_role, message_content, metadata, created_at
-                    FROM long_term_memory
-                    WHERE {where_clause}
-                    ORDER BY created_at ASC
-                    LIMIT %s
-                """, params + [limit])
-            else:
-                cursor.execute(f"""
-                    SELECT id, user_id, conversation_type, session_id, 
-                           message_role, message_content, metadata, created_at
-                    FROM long_term_memory
-                    WHERE {where_clause}
-                    ORDER BY created_at ASC
-                    LIMIT ?
-                """, params + [limit])
+            cursor.execute(adapt_sql(f"""
+                SELECT id, user_id, conversation_type, session_id, 
+                       message_role, message_content, metadata, created_at
+                FROM long_term_memory
+                WHERE {where_clause}
+                ORDER BY created_at ASC
+                LIMIT ?
+            """), params + [limit])
             
             memories = []
             for row in cursor.fetchall():
@@ -2308,42 +2717,26 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            where_condition = "user_id = ?" if not use_postgresql else "user_id = %s"
+            where_condition = "user_id = ?" if not USE_POSTGRESQL else "user_id = %s"
             params = [current_user_id]
             
             if conversation_type:
-                where_condition += " AND conversation_type = ?" if not use_postgresql else " AND conversation_type = %s"
+                where_condition += " AND conversation_type = ?" if not USE_POSTGRESQL else " AND conversation_type = %s"
                 params.append(conversation_type)
             
-            if use_postgresql:
-                cursor.execute(f"""
-                    SELECT session_id, 
-                           MAX(created_at) as last_time,
-                           COUNT(*) as message_count,
-                           MAX(CASE WHEN message_role = 'user' THEN message_content END) as last_user_message,
-                           MAX(CASE WHEN message_role = 'assistant' THEN message_content END) as last_ai_message
-                    FROM long_term_memory
-                    WHERE {where_condition}
-                    GROUP BY session_id
-                    ORDER BY last_time DESC
-                    LIMIT %s
-                """, params + [limit])
-            else:
-                cursor.execute(f"""
-                    SELECT session_id, 
-                           MAX(created_at) as last_time,
-                           COUNT(*) as message_count,
-                           MAX(CASE WHEN message_role = 'user' THEN message_content END) as last_user_message,
-                           MAX(CASE WHEN message_role = 'assistant' THEN message_content END) as last_ai_message
-                    FROM long_term_memory
-                    WHERE {where_condition}
-                    GROUP BY session_id
-                    ORDER BY last_time DESC
-                    LIMIT ?
-                """, params + [limit])
+            cursor.execute(adapt_sql(f"""
+                SELECT session_id, 
+                       MAX(created_at) as last_time,
+                       COUNT(*) as message_count,
+                       MAX(CASE WHEN message_role = 'user' THEN message_content END) as last_user_message,
+                       MAX(CASE WHEN message_role = 'assistant' THEN message_content END) as last_ai_message
+                FROM long_term_memory
+                WHERE {where_condition}
+                GROUP BY session_id
+                ORDER BY last_time DESC
+                LIMIT ?
+            """), params + [limit])
             
             sessions = []
             for row in cursor.fetchall():
@@ -2376,37 +2769,24 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            # 檢查腳本是否屬於當前用戶
-            if use_postgresql:
-                cursor.execute("SELECT user_id FROM user_scripts WHERE id = %s", (script_id,))
-            else:
-                cursor.execute("SELECT user_id FROM user_scripts WHERE id = ?", (script_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                return JSONResponse({"error": "腳本不存在"}, status_code=404)
+            # 更新腳本名稱（以 user_id 條件一併檢查擁有權）
+            cursor.execute(adapt_sql("""
+                UPDATE user_scripts 
+                SET script_name = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND user_id = ?
+            """), (new_name, script_id, current_user_id))
             
-            if result[0] != current_user_id:
+            if cursor.rowcount == 0:
+                # 沒有更新到任何資料時才區分「不存在」與「無權限」
+                cursor.execute(adapt_sql("SELECT 1 FROM user_scripts WHERE id = ?"), (script_id,))
+                exists = cursor.fetchone()
+                conn.close()
+                if not exists:
+                    return JSONResponse({"error": "腳本不存在"}, status_code=404)
                 return JSONResponse({"error": "無權限修改此腳本"}, status_code=403)
             
-            # 更新腳本名稱
-            if use_postgresql:
-                cursor.execute("""
-                    UPDATE user_scripts 
-                    SET script_name = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                """, (new_name, script_id))
-            else:
-                cursor.execute("""
-                    UPDATE user_scripts 
-                    SET script_name = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """, (new_name, script_id))
-            
-            if not use_postgresql:
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
             
@@ -2424,29 +2804,20 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            # 檢查腳本是否屬於當前用戶
-            if use_postgresql:
-                cursor.execute("SELECT user_id FROM user_scripts WHERE id = %s", (script_id,))
-            else:
-                cursor.execute("SELECT user_id FROM user_scripts WHERE id = ?", (script_id,))
-            result = cursor.fetchone()
             
-            if not result:
-                return JSONResponse({"error": "腳本不存在"}, status_code=404)
+            # 刪除腳本（以 user_id 條件一併檢查擁有權）
+            cursor.execute(adapt_sql("DELETE FROM user_scripts WHERE id = ? AND user_id = ?"), (script_id, current_user_id))
             
-            if result[0] != current_user_id:
+            if cursor.rowcount == 0:
+                # 沒有刪除到任何資料時才區分「不存在」與「無權限」
+                cursor.execute(adapt_sql("SELECT 1 FROM user_scripts WHERE id = ?"), (script_id,))
+                exists = cursor.fetchone()
+                conn.close()
+                if not exists:
+                    return JSONResponse({"error": "腳本不存在"}, status_code=404)
                 return JSONResponse({"error": "無權限刪除此腳本"}, status_code=403)
             
-            # 刪除腳本
-            if use_postgresql:
-                cursor.execute("DELETE FROM user_scripts WHERE id = %s", (script_id,))
-            else:
-                cursor.execute("DELETE FROM user_scripts WHERE id = ?", (script_id,))
-            
-            if not use_postgresql:
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
             
@@ -2461,25 +2832,14 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT behavior_type, COUNT(*) as count, MAX(created_at) as last_activity
-                    FROM user_behaviors 
-                    WHERE user_id = %s 
-                    GROUP BY behavior_type
-                    ORDER BY count DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT behavior_type, COUNT(*) as count, MAX(created_at) as last_activity
-                    FROM user_behaviors 
-                    WHERE user_id = ? 
-                    GROUP BY behavior_type
-                    ORDER BY count DESC
-                """, (user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT behavior_type, COUNT(*) as count, MAX(created_at) as last_activity
+                FROM user_behaviors 
+                WHERE user_id = ? 
+                GROUP BY behavior_type
+                ORDER BY count DESC
+            """), (user_id,))
             behaviors = cursor.fetchall()
             
             conn.close()
@@ -2500,101 +2860,160 @@ def create_app() -> FastAPI:
 
     # ===== 管理員 API（用於後台管理系統） =====
     
-    @app.get("/api/admin/users")
-    async def get_all_users():
-        """獲取所有用戶資料（管理員用）"""
+    def compute_users_version():
+        """計算用戶列表的版本資訊（含全表計數，經統計快取每個 TTL 最多執行一次）"""
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            # 用戶、偏好、對話數與腳本數皆未變動時直接回 304
+            # （對話與腳本另加 MAX(id)，一刪一增總數不變時版本仍會改變）
+            cursor.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM user_auth),
+                    (SELECT MAX(updated_at) FROM user_auth),
+                    (SELECT MAX(updated_at) FROM user_profiles),
+                    (SELECT COUNT(*) FROM conversation_summaries),
+                    (SELECT MAX(id) FROM conversation_summaries),
+                    (SELECT COUNT(*) FROM user_scripts),
+                    (SELECT MAX(id) FROM user_scripts)
+            """)
+            version = tuple(cursor.fetchone())
+            conn.close()
+            return version
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+    
+    def fetch_users_page(page: int, page_size: int, offset: int, total: int):
+        """讀取一頁用戶資料"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            # 獲取所有用戶基本資料（包含訂閱狀態和統計）
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT ua.user_id, ua.google_id, ua.email, ua.name, ua.picture, 
-                           ua.created_at, ua.is_subscribed, up.preferred_platform, up.preferred_style, up.preferred_duration
-                    FROM user_auth ua
-                    LEFT JOIN user_profiles up ON ua.user_id = up.user_id
-                    ORDER BY ua.created_at DESC
-                """)
+            # 建立時間直接由資料庫轉成台灣時區（UTC+8）的 YYYY/MM/DD HH:MM
+            if USE_POSTGRESQL:
+                created_at_expr = "TO_CHAR(ua.created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Taipei', 'YYYY/MM/DD HH24:MI')"
             else:
-                cursor.execute("""
-                    SELECT ua.user_id, ua.google_id, ua.email, ua.name, ua.picture, 
-                           ua.created_at, ua.is_subscribed, up.preferred_platform, up.preferred_style, up.preferred_duration
-                    FROM user_auth ua
-                    LEFT JOIN user_profiles up ON ua.user_id = up.user_id
-                    ORDER BY ua.created_at DESC
-                """)
+                created_at_expr = "strftime('%Y/%m/%d %H:%M', ua.created_at, '+8 hours')"
+            
+            # 獲取用戶基本資料（包含訂閱狀態和統計），欄位別名即回應的 key
+            cursor.execute(adapt_sql(f"""
+                SELECT ua.user_id, ua.google_id, ua.email, ua.name, ua.picture, 
+                       {created_at_expr} AS created_at, ua.is_subscribed,
+                       up.preferred_platform, up.preferred_style, up.preferred_duration,
+                       (SELECT COUNT(*) FROM conversation_summaries cs WHERE cs.user_id = ua.user_id) AS conversation_count,
+                       (SELECT COUNT(*) FROM user_scripts us WHERE us.user_id = ua.user_id) AS script_count
+                FROM user_auth ua
+                LEFT JOIN user_profiles up ON ua.user_id = up.user_id
+                ORDER BY ua.created_at DESC
+                LIMIT ? OFFSET ?
+            """), (page_size, offset))
+            
+            users = rows_to_dicts(cursor)
+            for user in users:
+                # 預設為已訂閱
+                user["is_subscribed"] = bool(user["is_subscribed"]) if user["is_subscribed"] is not None else True
             
-            users = []
-            
-            for row in cursor.fetchall():
-                user_id = row[0]
-                
-                # 獲取對話數
-                if use_postgresql:
-                    cursor.execute("""
-                        SELECT COUNT(*) FROM conversation_summaries WHERE user_id = %s
-                    """, (user_id,))
-                else:
-                    cursor.execute("""
-                        SELECT COUNT(*) FROM conversation_summaries WHERE user_id = ?
-                    """, (user_id,))
-                conversation_count = cursor.fetchone()[0]
-                
-                # 獲取腳本數
-                if use_postgresql:
-                    cursor.execute("""
-                        SELECT COUNT(*) FROM user_scripts WHERE user_id = %s
-                    """, (user_id,))
-                else:
-                    cursor.execute("""
-                        SELECT COUNT(*) FROM user_scripts WHERE user_id = ?
-                    """, (user_id,))
-                script_count = cursor.fetchone()[0]
-                
-                # 格式化日期（台灣時區 UTC+8）
-                created_at = row[5]
-                if created_at:
-                    try:
-                        from datetime import timezone, timedelta
-                        if isinstance(created_at, datetime):
-                            dt = created_at
-                        elif isinstance(created_at, str):
-                            dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                        else:
-                            dt = None
-                        
-                        if dt:
-                            # 轉換為台灣時區 (UTC+8)
-                            taiwan_tz = timezone(timedelta(hours=8))
-                            if dt.tzinfo is None:
-                                dt = dt.replace(tzinfo=timezone.utc)
-                            dt_taiwan = dt.astimezone(taiwan_tz)
-                            created_at = dt_taiwan.strftime('%Y/%m/%d %H:%M')
-                    except Exception as e:
-                        print(f"格式化日期時出錯: {e}")
-                        pass
-                
-                users.append({
-                    "user_id": user_id,
+            conn.close()
+            return {"users": users, "total": total, "page": page, "page_size": page_size}
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+    
+    @app.get("/api/admin/users")
+    async def get_all_users(request: Request, response: Response, page: int = 1, page_size: int = 50):
+        """獲取用戶資料（管理員用，分頁；版本資訊快取 ADMIN_STATS_CACHE_TTL 秒）"""
+        page, page_size, offset = resolve_pagination(page, page_size)
+        version, version_etag = await cached_admin_stats("users_version", compute_users_version)
+        if version_etag is None:
+            return version
+        
+        etag = build_etag("users", page, page_size, version)
+        not_modified = apply_etag(request, response, etag, "private, no-cache")
+        if not_modified:
+            return not_modified
+        return await asyncio.to_thread(fetch_users_page, page, page_size, offset, version[0])
+    
+    @app.get("/api/admin/users/stream")
+    def stream_all_users():
+        """以 NDJSON 串流輸出所有用戶資料（管理員用，每行一位用戶）"""
+        def generate():
+            rows = iter_rows("""
+                SELECT ua.user_id, ua.google_id, ua.email, ua.name, ua.picture, 
+                       ua.created_at, ua.is_subscribed, up.preferred_platform, up.preferred_style, up.preferred_duration,
+                       (SELECT COUNT(*) FROM conversation_summaries cs WHERE cs.user_id = ua.user_id),
+                       (SELECT COUNT(*) FROM user_scripts us WHERE us.user_id = ua.user_id)
+                FROM user_auth ua
+                LEFT JOIN user_profiles up ON ua.user_id = up.user_id
+                ORDER BY ua.created_at DESC
+            """, cursor_name="admin_users_stream")
+            for row in rows:
+                yield json.dumps({
+                    "user_id": row[0],
                     "google_id": row[1],
                     "email": row[2],
                     "name": row[3],
                     "picture": row[4],
-                    "created_at": created_at,
-                    "is_subscribed": bool(row[6]) if row[6] is not None else True,  # 預設為已訂閱
+                    "created_at": row[5],
+                    "is_subscribed": bool(row[6]) if row[6] is not None else True,
                     "preferred_platform": row[7],
                     "preferred_style": row[8],
                     "preferred_duration": row[9],
-                    "conversation_count": conversation_count,
-                    "script_count": script_count
-                })
+                    "conversation_count": row[10],
+                    "script_count": row[11]
+                }, ensure_ascii=False, default=str) + "\n"
+        
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    
+    @app.put("/api/admin/users/subscriptions")
+    async def update_user_subscriptions(request: Request):
+        """批次更新多位用戶的訂閱狀態（管理員用），body 為 [{user_id, is_subscribed}, ...]"""
+        try:
+            data = await request.json()
+            if not isinstance(data, list):
+                return JSONResponse({"error": "請提供 [{user_id, is_subscribed}, ...] 格式的列表"}, status_code=400)
+            
+            updates = [
+                (item["user_id"], 1 if item.get("is_subscribed", 0) else 0)
+                for item in data
+                if isinstance(item, dict) and item.get("user_id")
+            ]
+            if not updates:
+                return JSONResponse({"error": "沒有可更新的用戶"}, status_code=400)
+            
+            def apply_updates():
+                conn = get_db_connection()
+                try:
+                    cursor = conn.cursor()
+                    if USE_POSTGRESQL:
+                        # 單一 UPDATE ... FROM (VALUES ...) 一次更新所有用戶
+                        psycopg2.extras.execute_values(cursor, """
+                            UPDATE user_auth AS ua
+                            SET is_subscribed = v.is_subscribed, updated_at = CURRENT_TIMESTAMP
+                            FROM (VALUES %s) AS v(user_id, is_subscribed)
+                            WHERE ua.user_id = v.user_id
+                        """, [(user_id, is_subscribed) for user_id, is_subscribed in updates])
+                    else:
+                        # SQLite：同一交易內批次執行，只 commit 一次
+                        cursor.executemany("""
+                            UPDATE user_auth 
+                            SET is_subscribed = ?, updated_at = CURRENT_TIMESTAMP
+                            WHERE user_id = ?
+                        """, [(is_subscribed, user_id) for user_id, is_subscribed in updates])
+                        conn.commit()
+                finally:
+                    conn.close()
+            
+            await asyncio.to_thread(apply_updates)
+            for user_id, _ in updates:
+                invalidate_auth_user(user_id)
             
-            conn.close()
-            return {"users": users}
+            return {
+                "success": True,
+                "message": "訂閱狀態已更新",
+                "updated": [
+                    {"user_id": user_id, "is_subscribed": bool(is_subscribed)}
+                    for user_id, is_subscribed in updates
+                ]
+            }
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
@@ -2605,29 +3024,19 @@ def create_app() -> FastAPI:
             data = await request.json()
             is_subscribed = data.get("is_subscribed", 0)
             
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # 更新訂閱狀態
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            if use_postgresql:
-                cursor.execute("""
-                    UPDATE user_auth 
-                    SET is_subscribed = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s
-                """, (1 if is_subscribed else 0, user_id))
-            else:
-                cursor.execute("""
-                    UPDATE user_auth 
-                    SET is_subscribed = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE user_id = ?
-                """, (1 if is_subscribed else 0, user_id))
+            def apply_update():
+                conn = get_db_connection()
+                try:
+                    cursor = conn.cursor()
+                    # 更新訂閱狀態
+                    execute_prepared(cursor, "subscription_update", (1 if is_subscribed else 0, user_id))
+                    if not USE_POSTGRESQL:
+                        conn.commit()
+                finally:
+                    conn.close()
             
-            if not use_postgresql:
-                conn.commit()
-            conn.close()
+            await asyncio.to_thread(apply_update)
+            invalidate_auth_user(user_id)
             
             return {
                 "success": True,
@@ -2642,139 +3051,72 @@ def create_app() -> FastAPI:
     async def get_user_complete_data(user_id: str):
         """獲取指定用戶的完整資料（管理員用）"""
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
             # 用戶基本資料
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT ua.google_id, ua.email, ua.name, ua.picture, ua.created_at,
-                           up.preferred_platform, up.preferred_style, up.preferred_duration, up.content_preferences
-                    FROM user_auth ua
-                    LEFT JOIN user_profiles up ON ua.user_id = up.user_id
-                    WHERE ua.user_id = %s
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT ua.google_id, ua.email, ua.name, ua.picture, ua.created_at,
-                           up.preferred_platform, up.preferred_style, up.preferred_duration, up.content_preferences
-                    FROM user_auth ua
-                    LEFT JOIN user_profiles up ON ua.user_id = up.user_id
-                    WHERE ua.user_id = ?
-                """, (user_id,))
-            
-            user_data = cursor.fetchone()
-            if not user_data:
+            user_rows = await asyncio.to_thread(fetch_all, f"""
+                SELECT ua.google_id, ua.email, ua.name, ua.picture, ua.created_at,
+                       up.preferred_platform, up.preferred_style, up.preferred_duration, up.content_preferences
+                FROM user_auth ua
+                LEFT JOIN user_profiles up ON ua.user_id = up.user_id
+                WHERE ua.user_id = {PH}
+            """, (user_id,))
+            if not user_rows:
                 return JSONResponse({"error": "用戶不存在"}, status_code=404)
-            
-            # 帳號定位記錄
-            if use_postgresql:
-                cursor.execute("""
+            user_data = user_rows[0]
+            
+            # 六個列表查詢彼此獨立，各自取得連線並行執行，總耗時約為最慢的一個查詢
+            (
+                positioning_records,
+                script_records,
+                generation_records,
+                conversation_summaries,
+                user_preferences,
+                user_behaviors,
+            ) = await asyncio.gather(
+                # 帳號定位記錄
+                asyncio.to_thread(fetch_all, f"""
                     SELECT id, record_number, content, created_at
                     FROM positioning_records
-                    WHERE user_id = %s
+                    WHERE user_id = {PH}
                     ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT id, record_number, content, created_at
-                    FROM positioning_records
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            positioning_records = cursor.fetchall()
-            
-            # 腳本記錄
-            if use_postgresql:
-                cursor.execute("""
+                """, (user_id,)),
+                # 腳本記錄
+                asyncio.to_thread(fetch_all, f"""
                     SELECT id, script_name, title, content, script_data, platform, topic, profile, created_at
                     FROM user_scripts
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT id, script_name, title, content, script_data, platform, topic, profile, created_at
-                    FROM user_scripts
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            script_records = cursor.fetchall()
-            
-            # 生成記錄
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, content, platform, topic, created_at
-                    FROM generations
-                    WHERE user_id = %s
+                    WHERE user_id = {PH}
                     ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
+                """, (user_id,)),
+                # 生成記錄
+                asyncio.to_thread(fetch_all, f"""
                     SELECT id, content, platform, topic, created_at
                     FROM generations
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            generation_records = cursor.fetchall()
-            
-            # 對話摘要
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, summary, conversation_type, created_at
-                    FROM conversation_summaries
-                    WHERE user_id = %s
+                    WHERE user_id = {PH}
                     ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
+                """, (user_id,)),
+                # 對話摘要
+                asyncio.to_thread(fetch_all, f"""
                     SELECT id, summary, conversation_type, created_at
                     FROM conversation_summaries
-                    WHERE user_id = ?
+                    WHERE user_id = {PH}
                     ORDER BY created_at DESC
-                """, (user_id,))
-            conversation_summaries = cursor.fetchall()
-            
-            # 用戶偏好
-            if use_postgresql:
-                cursor.execute("""
+                """, (user_id,)),
+                # 用戶偏好
+                asyncio.to_thread(fetch_all, f"""
                     SELECT preference_type, preference_value, confidence_score, created_at
                     FROM user_preferences
-                    WHERE user_id = %s
-                    ORDER BY confidence_score DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT preference_type, preference_value, confidence_score, created_at
-                    FROM user_preferences
-                    WHERE user_id = ?
+                    WHERE user_id = {PH}
                     ORDER BY confidence_score DESC
-                """, (user_id,))
-            user_preferences = cursor.fetchall()
-            
-            # 用戶行為
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT behavior_type, behavior_data, created_at
-                    FROM user_behaviors
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
+                """, (user_id,)),
+                # 用戶行為
+                asyncio.to_thread(fetch_all, f"""
                     SELECT behavior_type, behavior_data, created_at
                     FROM user_behaviors
-                    WHERE user_id = ?
+                    WHERE user_id = {PH}
                     ORDER BY created_at DESC
-                """, (user_id,))
-            user_behaviors = cursor.fetchall()
-            
-            conn.close()
+                """, (user_id,)),
+            )
             
-            return {
+            return fast_json_response({
                 "user_info": {
                     "user_id": user_id,
                     "google_id": user_data[0],
@@ -2785,7 +3127,7 @@ def create_app() -> FastAPI:
                     "preferred_platform": user_data[5],
                     "preferred_style": user_data[6],
                     "preferred_duration": user_data[7],
-                    "content_preferences": json.loads(user_data[8]) if user_data[8] else None
+                    "content_preferences": json_loads(user_data[8]) if user_data[8] else None
                 },
                 "positioning_records": [
                     {
@@ -2801,7 +3143,7 @@ def create_app() -> FastAPI:
                         "script_name": record[1],
                         "title": record[2],
                         "content": record[3],
-                        "script_data": json.loads(record[4]) if record[4] else {},
+                        "script_data": json_loads(record[4]) if record[4] else {},
                         "platform": record[5],
                         "topic": record[6],
                         "profile": record[7],
@@ -2840,78 +3182,40 @@ def create_app() -> FastAPI:
                         "created_at": record[2]
                     } for record in user_behaviors
                 ]
-            }
+            })
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
-    @app.get("/api/admin/statistics")
-    async def get_admin_statistics():
-        """獲取系統統計資料（管理員用）"""
+    def compute_admin_statistics():
+        """計算系統統計資料"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            # 判斷資料庫類型
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            # 用戶總數
-            cursor.execute("SELECT COUNT(*) FROM user_auth")
-            total_users = cursor.fetchone()[0]
-            
-            # 今日新增用戶（兼容 SQLite 和 PostgreSQL）
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT COUNT(*) FROM user_auth 
-                    WHERE created_at::date = CURRENT_DATE
-                """)
+            # 各項計數合併成一次查詢（兼容 SQLite 和 PostgreSQL）
+            if USE_POSTGRESQL:
+                today_filter = "created_at::date = CURRENT_DATE"
+                active_filter = "created_at >= CURRENT_TIMESTAMP - INTERVAL '7 days'"
             else:
-                cursor.execute("""
-                    SELECT COUNT(*) FROM user_auth 
-                    WHERE DATE(created_at) = DATE('now')
-                """)
-            today_users = cursor.fetchone()[0]
-            
-            # 腳本總數
-            cursor.execute("SELECT COUNT(*) FROM user_scripts")
-            total_scripts = cursor.fetchone()[0]
-            
-            # 帳號定位總數
-            cursor.execute("SELECT COUNT(*) FROM positioning_records")
-            total_positioning = cursor.fetchone()[0]
-            
-            # 生成內容總數
-            cursor.execute("SELECT COUNT(*) FROM generations")
-            total_generations = cursor.fetchone()[0]
-            
-            # 對話摘要總數
-            cursor.execute("SELECT COUNT(*) FROM conversation_summaries")
-            total_conversations = cursor.fetchone()[0]
-            
-            # 平台使用統計
-            cursor.execute("""
-                SELECT platform, COUNT(*) as count
-                FROM user_scripts
-                WHERE platform IS NOT NULL
-                GROUP BY platform
-                ORDER BY count DESC
+                today_filter = "DATE(created_at) = DATE('now')"
+                active_filter = "created_at >= datetime('now', '-7 days')"
+            cursor.execute(f"""
+                SELECT
+                    (SELECT COUNT(*) FROM user_auth),
+                    (SELECT COUNT(*) FROM user_auth WHERE {today_filter}),
+                    (SELECT COUNT(*) FROM user_scripts),
+                    (SELECT COUNT(*) FROM positioning_records),
+                    (SELECT COUNT(*) FROM generations),
+                    (SELECT COUNT(*) FROM conversation_summaries),
+                    (SELECT COUNT(DISTINCT user_id) FROM user_scripts WHERE {active_filter})
             """)
-            platform_stats = cursor.fetchall()
+            (total_users, today_users, total_scripts, total_positioning,
+             total_generations, total_conversations, active_users_7d) = cursor.fetchone()
             
-            # 最近活躍用戶（7天內）（兼容 SQLite 和 PostgreSQL）
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT user_id) 
-                    FROM user_scripts 
-                    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '7 days'
-                """)
-            else:
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT user_id) 
-                    FROM user_scripts 
-                    WHERE created_at >= datetime('now', '-7 days')
-                """)
-            active_users_7d = cursor.fetchone()[0]
+            # 平台使用統計（讀每日彙總）
+            refresh_daily_stats_if_stale(cursor)
+            execute_prepared(cursor, "platform_stats")
+            platform_stats = cursor.fetchall()
             
             conn.close()
             
@@ -2931,81 +3235,61 @@ def create_app() -> FastAPI:
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
-    @app.get("/api/admin/mode-statistics")
-    async def get_mode_statistics():
-        """獲取模式使用統計"""
+    @app.get("/api/admin/statistics")
+    async def get_admin_statistics(request: Request, response: Response):
+        """獲取系統統計資料（管理員用，快取 ADMIN_STATS_CACHE_TTL 秒）"""
+        result, etag = await cached_admin_stats("statistics", compute_admin_statistics)
+        if etag is None:
+            return result
+        return apply_etag(request, response, etag, f"private, max-age={ADMIN_STATS_CACHE_TTL}") or result
+    
+    def compute_mode_statistics():
+        """計算模式使用統計"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            # 獲取各模式的對話數
+            # 獲取各模式的對話數（直接在資料庫彙總成三個模式）
             cursor.execute("""
-                SELECT conversation_type, COUNT(*) as count
+                SELECT
+                    COALESCE(SUM(CASE WHEN conversation_type = 'account_positioning' THEN 1 ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN conversation_type IN ('topic_selection', 'script_generation', 'general_consultation') THEN 1 ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN conversation_type = 'ip_planning' THEN 1 ELSE 0 END), 0)
                 FROM conversation_summaries
                 WHERE conversation_type IS NOT NULL
-                GROUP BY conversation_type
             """)
-            conversations = cursor.fetchall()
+            mode1_count, mode2_count, mode3_count = cursor.fetchone()
             
-            # 計算各模式統計
             mode_stats = {
-                "mode1_quick_generate": {"count": 0, "success_rate": 0},
-                "mode2_ai_consultant": {"count": 0, "avg_turns": 0},
-                "mode3_ip_planning": {"count": 0, "profiles_generated": 0}
+                "mode1_quick_generate": {"count": int(mode1_count), "success_rate": 0},
+                "mode2_ai_consultant": {"count": int(mode2_count), "avg_turns": 0},
+                "mode3_ip_planning": {"count": int(mode3_count), "profiles_generated": 0}
             }
             
-            # 根據對話類型分類
-            for conv_type, count in conversations:
-                if conv_type == "account_positioning":
-                    mode_stats["mode1_quick_generate"]["count"] = count
-                elif conv_type in ["topic_selection", "script_generation"]:
-                    mode_stats["mode2_ai_consultant"]["count"] += count
-                elif conv_type == "general_consultation":
-                    mode_stats["mode2_ai_consultant"]["count"] += count
-            
-            # 獲取時間分布
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT DATE_TRUNC('hour', created_at) as hour, COUNT(*) as count
-                    FROM conversation_summaries
-                    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '30 days'
-                    GROUP BY hour
-                    ORDER BY hour
-                """)
+            # 獲取時間分布（直接在資料庫依時段彙總，只回傳一列）
+            if USE_POSTGRESQL:
+                hour_expr = "EXTRACT(HOUR FROM created_at)"
+                since_expr = "CURRENT_TIMESTAMP - INTERVAL '30 days'"
             else:
-                cursor.execute("""
-                    SELECT strftime('%H', created_at) as hour, COUNT(*) as count
-                    FROM conversation_summaries
-                    WHERE created_at >= datetime('now', '-30 days')
-                    GROUP BY hour
-                    ORDER BY hour
-                """)
-            
-            time_stats = {"00:00-06:00": 0, "06:00-12:00": 0, "12:00-18:00": 0, "18:00-24:00": 0}
-            for row in cursor.fetchall():
-                try:
-                    if use_postgresql:
-                        # PostgreSQL 返回 datetime 對象
-                        hour_str = row[0].strftime('%H')
-                    else:
-                        # SQLite 返回字符串 'HH' 格式
-                        hour_str = str(row[0])[:2]
-                    hour = int(hour_str)
-                except:
-                    hour = 0
-                
-                count = row[1]
-                if 0 <= hour < 6:
-                    time_stats["00:00-06:00"] += count
-                elif 6 <= hour < 12:
-                    time_stats["06:00-12:00"] += count
-                elif 12 <= hour < 18:
-                    time_stats["12:00-18:00"] += count
-                else:
-                    time_stats["18:00-24:00"] += count
+                hour_expr = "CAST(strftime('%H', created_at) AS INTEGER)"
+                since_expr = "datetime('now', '-30 days')"
+            cursor.execute(f"""
+                SELECT
+                    COALESCE(SUM(CASE WHEN {hour_expr} < 6 THEN 1 ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN {hour_expr} >= 6 AND {hour_expr} < 12 THEN 1 ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN {hour_expr} >= 12 AND {hour_expr} < 18 THEN 1 ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN {hour_expr} >= 18 THEN 1 ELSE 0 END), 0)
+                FROM conversation_summaries
+                WHERE created_at >= {since_expr}
+            """)
+            buckets = cursor.fetchone()
+            time_stats = {
+                "00:00-06:00": int(buckets[0]),
+                "06:00-12:00": int(buckets[1]),
+                "12:00-18:00": int(buckets[2]),
+                "18:00-24:00": int(buckets[3])
+            }
             
             conn.close()
             
@@ -3016,179 +3300,175 @@ def create_app() -> FastAPI:
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
+    @app.get("/api/admin/mode-statistics")
+    async def get_mode_statistics(request: Request, response: Response):
+        """獲取模式使用統計（快取 ADMIN_STATS_CACHE_TTL 秒）"""
+        result, etag = await cached_admin_stats("mode_statistics", compute_mode_statistics)
+        if etag is None:
+            return result
+        return apply_etag(request, response, etag, f"private, max-age={ADMIN_STATS_CACHE_TTL}") or result
+    
     @app.get("/api/admin/conversations")
-    async def get_all_conversations():
-        """獲取所有對話記錄（管理員用）"""
+    def get_all_conversations(page: int = 1, page_size: int = 100):
+        """獲取對話記錄（管理員用，分頁）"""
         try:
+            page, page_size, offset = resolve_pagination(page, page_size)
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT cs.id, cs.user_id, cs.conversation_type, cs.summary, cs.message_count, cs.created_at, 
-                           ua.name, ua.email
-                    FROM conversation_summaries cs
-                    LEFT JOIN user_auth ua ON cs.user_id = ua.user_id
-                    ORDER BY cs.created_at DESC
-                    LIMIT 100
-                """)
-            else:
-                cursor.execute("""
-                    SELECT cs.id, cs.user_id, cs.conversation_type, cs.summary, cs.message_count, cs.created_at, 
-                           ua.name, ua.email
-                    FROM conversation_summaries cs
-                    LEFT JOIN user_auth ua ON cs.user_id = ua.user_id
-                    ORDER BY cs.created_at DESC
-                    LIMIT 100
-                """)
+            cursor.execute("SELECT COUNT(*) FROM conversation_summaries")
+            total = cursor.fetchone()[0]
             
-            conversations = []
-            conv_type_map = {
-                "account_positioning": "帳號定位",
-                "topic_selection": "選題討論",
-                "script_generation": "腳本生成",
-                "general_consultation": "AI顧問",
-                "ip_planning": "IP人設規劃"
-            }
+            cursor.execute(adapt_sql(f"""
+                SELECT cs.id, cs.user_id, cs.conversation_type, COALESCE(cs.summary, ''),
+                       COALESCE(cs.message_count, 0), cs.created_at,
+                       COALESCE(NULLIF(ua.name, ''), '未知用戶'), COALESCE(ua.email, ''),
+                       {CONVERSATION_MODE_CASE_SQL}
+                FROM conversation_summaries cs
+                LEFT JOIN user_auth ua ON cs.user_id = ua.user_id
+                ORDER BY cs.created_at DESC
+                LIMIT ? OFFSET ?
+            """), (page_size, offset))
             
-            for row in cursor.fetchall():
-                conversations.append({
+            # 直接迭代游標，不先以 fetchall() 建立整份 tuple 列表
+            conversations = [
+                {
                     "id": row[0],
                     "user_id": row[1],
-                    "mode": conv_type_map.get(row[2], row[2]),
+                    "mode": row[8],
                     "conversation_type": row[2],
-                    "summary": row[3] or "",
-                    "message_count": row[4] or 0,
+                    "summary": row[3],
+                    "message_count": row[4],
                     "created_at": row[5],
-                    "user_name": row[6] or "未知用戶",
-                    "user_email": row[7] or ""
-                })
+                    "user_name": row[6],
+                    "user_email": row[7]
+                }
+                for row in cursor
+            ]
             
             conn.close()
             
-            return {"conversations": conversations}
+            return {"conversations": conversations, "total": total, "page": page, "page_size": page_size}
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
     @app.get("/api/admin/generations")
-    async def get_all_generations():
-        """獲取所有生成記錄"""
+    def get_all_generations(page: int = 1, page_size: int = 100):
+        """獲取生成記錄（分頁）"""
         try:
+            page, page_size, offset = resolve_pagination(page, page_size)
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT g.id, g.user_id, g.platform, g.topic, g.content, g.created_at, 
-                           ua.name, ua.email
-                    FROM generations g
-                    LEFT JOIN user_auth ua ON g.user_id = ua.user_id
-                    ORDER BY g.created_at DESC
-                    LIMIT 100
-                """)
-            else:
-                cursor.execute("""
-                    SELECT g.id, g.user_id, g.platform, g.topic, g.content, g.created_at, 
-                           ua.name, ua.email
-                    FROM generations g
-                    LEFT JOIN user_auth ua ON g.user_id = ua.user_id
-                    ORDER BY g.created_at DESC
-                    LIMIT 100
-                """)
-            
-            generations = []
-            for row in cursor.fetchall():
-                generations.append({
+            cursor.execute("SELECT COUNT(*) FROM generations")
+            total = cursor.fetchone()[0]
+            
+            cursor.execute(adapt_sql("""
+                SELECT g.id, g.user_id, COALESCE(NULLIF(g.platform, ''), '未設定'),
+                       COALESCE(NULLIF(g.topic, ''), '未分類'), COALESCE(substr(g.content, 1, 100), ''),
+                       g.created_at, COALESCE(NULLIF(ua.name, ''), '未知用戶'), COALESCE(ua.email, '')
+                FROM generations g
+                LEFT JOIN user_auth ua ON g.user_id = ua.user_id
+                ORDER BY g.created_at DESC
+                LIMIT ? OFFSET ?
+            """), (page_size, offset))
+            
+            # 直接迭代游標，不先以 fetchall() 建立整份 tuple 列表
+            generations = [
+                {
                     "id": row[0],
                     "user_id": row[1],
-                    "user_name": row[6] or "未知用戶",
-                    "user_email": row[7] or "",
-                    "platform": row[2] or "未設定",
-                    "topic": row[3] or "未分類",
+                    "user_name": row[6],
+                    "user_email": row[7],
+                    "platform": row[2],
+                    "topic": row[3],
                     "type": "生成記錄",
-                    "content": row[4][:100] if row[4] else "",
+                    "content": row[4],
                     "created_at": row[5]
-                })
+                }
+                for row in cursor
+            ]
             
             conn.close()
             
-            return {"generations": generations}
+            return {"generations": generations, "total": total, "page": page, "page_size": page_size}
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
     @app.get("/api/admin/scripts")
-    async def get_all_scripts():
-        """獲取所有腳本記錄（管理員用）"""
+    def get_all_scripts(page: int = 1, page_size: int = 100, cursor: Optional[str] = None):
+        """獲取腳本記錄（管理員用，分頁）；帶 cursor（上一頁回傳的 next_cursor）時改用 keyset 分頁"""
         try:
+            page, page_size, offset = resolve_pagination(page, page_size)
+            keyset = None
+            if cursor:
+                keyset = parse_keyset_cursor(cursor)
+                if not keyset:
+                    return JSONResponse({"error": "無效的 cursor"}, status_code=400)
+            
             conn = get_db_connection()
-            cursor = conn.cursor()
+            db_cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
+            db_cursor.execute("SELECT COUNT(*) FROM user_scripts")
+            total = db_cursor.fetchone()[0]
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT us.id, us.user_id, us.script_name, us.title, us.platform, us.topic, 
-                           us.created_at, ua.name, ua.email
-                    FROM user_scripts us
-                    LEFT JOIN user_auth ua ON us.user_id = ua.user_id
-                    ORDER BY us.created_at DESC
-                    LIMIT 100
-                """)
+            # keyset：從上一頁最後一筆 (created_at, id) 之後繼續，不必掃過前面的 OFFSET 筆資料
+            if keyset:
+                where_clause = "WHERE (us.created_at, us.id) < (?, ?)"
+                params = (*keyset, page_size)
             else:
-                cursor.execute("""
-                    SELECT us.id, us.user_id, us.script_name, us.title, us.platform, us.topic, 
-                           us.created_at, ua.name, ua.email
-                    FROM user_scripts us
-                    LEFT JOIN user_auth ua ON us.user_id = ua.user_id
-                    ORDER BY us.created_at DESC
-                    LIMIT 100
-                """)
-            
-            scripts = []
-            for row in cursor.fetchall():
-                scripts.append({
+                where_clause = ""
+                params = (page_size, offset)
+            db_cursor.execute(adapt_sql(f"""
+                SELECT us.id, us.user_id,
+                       COALESCE(NULLIF(us.script_name, ''), NULLIF(us.title, ''), '未命名腳本'),
+                       COALESCE(NULLIF(us.title, ''), NULLIF(us.script_name, ''), '未命名腳本'),
+                       COALESCE(NULLIF(us.platform, ''), '未設定'), COALESCE(NULLIF(us.topic, ''), '未分類'),
+                       us.created_at, COALESCE(NULLIF(ua.name, ''), '未知用戶'), COALESCE(ua.email, '')
+                FROM user_scripts us
+                LEFT JOIN user_auth ua ON us.user_id = ua.user_id
+                {where_clause}
+                ORDER BY us.created_at DESC, us.id DESC
+                LIMIT ?{"" if keyset else " OFFSET ?"}
+            """), params)
+            
+            # 直接迭代游標，不先以 fetchall() 建立整份 tuple 列表
+            scripts = [
+                {
                     "id": row[0],
                     "user_id": row[1],
-                    "name": row[2] or row[3] or "未命名腳本",
-                    "title": row[3] or row[2] or "未命名腳本",
-                    "platform": row[4] or "未設定",
-                    "category": row[5] or "未分類",
-                    "topic": row[5] or "未分類",
+                    "name": row[2],
+                    "title": row[3],
+                    "platform": row[4],
+                    "category": row[5],
+                    "topic": row[5],
                     "created_at": row[6],
-                    "user_name": row[7] or "未知用戶",
-                    "user_email": row[8] or ""
-                })
+                    "user_name": row[7],
+                    "user_email": row[8]
+                }
+                for row in db_cursor
+            ]
             
             conn.close()
             
-            return {"scripts": scripts}
+            next_cursor = None
+            if len(scripts) == page_size:
+                next_cursor = build_keyset_cursor(scripts[-1]["created_at"], scripts[-1]["id"])
+            
+            return {"scripts": scripts, "total": total, "page": page, "page_size": page_size, "next_cursor": next_cursor}
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
-    @app.get("/api/admin/platform-statistics")
-    async def get_platform_statistics():
-        """獲取平台使用統計"""
+    def compute_platform_statistics():
+        """計算平台使用統計"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
+            refresh_daily_stats_if_stale(cursor)
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            cursor.execute("""
-                SELECT platform, COUNT(*) as count
-                FROM user_scripts
-                WHERE platform IS NOT NULL
-                GROUP BY platform
-                ORDER BY count DESC
-            """)
+            execute_prepared(cursor, "platform_stats")
             
             platform_stats = [{"platform": row[0], "count": row[1]} for row in cursor.fetchall()]
             
@@ -3198,76 +3478,69 @@ def create_app() -> FastAPI:
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
-    @app.get("/api/admin/user-activities")
-    async def get_user_activities():
-        """獲取最近用戶活動"""
+    @app.get("/api/admin/platform-statistics")
+    async def get_platform_statistics(request: Request, response: Response):
+        """獲取平台使用統計（快取 ADMIN_STATS_CACHE_TTL 秒）"""
+        result, etag = await cached_admin_stats("platform_statistics", compute_platform_statistics)
+        if etag is None:
+            return result
+        return apply_etag(request, response, etag, f"private, max-age={ADMIN_STATS_CACHE_TTL}") or result
+    
+    def compute_user_activities():
+        """計算最近用戶活動"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            # 獲取最近10個活動
-            activities = []
-            
-            # 最近註冊的用戶
-            cursor.execute("""
-                SELECT user_id, name, created_at
-                FROM user_auth
-                ORDER BY created_at DESC
-                LIMIT 3
-            """)
-            for row in cursor.fetchall():
-                activities.append({
-                    "type": "新用戶註冊",
-                    "user_id": row[0],
-                    "name": row[1] or "未知用戶",
-                    "time": row[2],
-                    "icon": "👤"
-                })
-            
-            # 最近的腳本生成
-            cursor.execute("""
-                SELECT us.user_id, us.title, us.created_at, ua.name
-                FROM user_scripts us
-                LEFT JOIN user_auth ua ON us.user_id = ua.user_id
-                ORDER BY us.created_at DESC
-                LIMIT 3
-            """)
-            for row in cursor.fetchall():
-                activities.append({
-                    "type": "新腳本生成",
-                    "user_id": row[0],
-                    "name": row[3] or "未知用戶",
-                    "title": row[1] or "未命名腳本",
-                    "time": row[2],
-                    "icon": "📝"
-                })
+            # 最近註冊、腳本生成、對話各取 3 筆，一次查詢合併後依時間排序（只走 created_at 索引，不 JOIN）
+            execute_prepared(cursor, "recent_activities")
+            rows = cursor.fetchall()
             
-            # 最近的對話
-            cursor.execute("""
-                SELECT cs.user_id, cs.conversation_type, cs.created_at, ua.name
-                FROM conversation_summaries cs
-                LEFT JOIN user_auth ua ON cs.user_id = ua.user_id
-                ORDER BY cs.created_at DESC
-                LIMIT 3
-            """)
-            for row in cursor.fetchall():
-                mode_map = {
-                    "account_positioning": "帳號定位",
-                    "topic_selection": "選題討論",
-                    "script_generation": "腳本生成",
-                    "general_consultation": "AI顧問對話"
-                }
-                activities.append({
-                    "type": f"{mode_map.get(row[1], '對話')}",
-                    "user_id": row[0],
-                    "name": row[3] or "未知用戶",
-                    "time": row[2],
-                    "icon": "💬"
-                })
+            # 腳本與對話的用戶名稱以一次 IN 查詢補齊
+            names = {row[1]: row[2] for row in rows if row[0] == "user"}
+            missing_ids = list({row[1] for row in rows if row[1] not in names})
+            if missing_ids:
+                placeholders = ", ".join(["?"] * len(missing_ids))
+                cursor.execute(
+                    adapt_sql(f"SELECT user_id, name FROM user_auth WHERE user_id IN ({placeholders})"),
+                    tuple(missing_ids)
+                )
+                names.update(cursor.fetchall())
             
-            # 按時間排序
-            activities.sort(key=lambda x: x['time'], reverse=True)
-            activities = activities[:10]
+            mode_map = {
+                "account_positioning": "帳號定位",
+                "topic_selection": "選題討論",
+                "script_generation": "腳本生成",
+                "general_consultation": "AI顧問對話"
+            }
+            activities = []
+            for kind, user_id, _, detail, created_at in rows:
+                name = names.get(user_id)
+                if kind == "user":
+                    activities.append({
+                        "type": "新用戶註冊",
+                        "user_id": user_id,
+                        "name": name or "未知用戶",
+                        "time": created_at,
+                        "icon": "👤"
+                    })
+                elif kind == "script":
+                    activities.append({
+                        "type": "新腳本生成",
+                        "user_id": user_id,
+                        "name": name or "未知用戶",
+                        "title": detail or "未命名腳本",
+                        "time": created_at,
+                        "icon": "📝"
+                    })
+                else:
+                    activities.append({
+                        "type": f"{mode_map.get(detail, '對話')}",
+                        "user_id": user_id,
+                        "name": name or "未知用戶",
+                        "time": created_at,
+                        "icon": "💬"
+                    })
             
             conn.close()
             
@@ -3275,95 +3548,82 @@ def create_app() -> FastAPI:
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
-    @app.get("/api/admin/analytics-data")
-    async def get_analytics_data():
-        """獲取分析頁面所需的所有數據"""
+    @app.get("/api/admin/user-activities")
+    async def get_user_activities(request: Request, response: Response):
+        """獲取最近用戶活動（快取 ADMIN_STATS_CACHE_TTL 秒）"""
+        result, etag = await cached_admin_stats("user_activities", compute_user_activities)
+        if etag is None:
+            return result
+        return apply_etag(request, response, etag, f"private, max-age={ADMIN_STATS_CACHE_TTL}") or result
+    
+    def compute_analytics_data():
+        """計算分析頁面所需的所有數據"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
-            
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            # 平台使用分布
-            cursor.execute("""
-                SELECT platform, COUNT(*) as count
-                FROM user_scripts
-                WHERE platform IS NOT NULL
-                GROUP BY platform
-                ORDER BY count DESC
-            """)
-            platform_stats = cursor.fetchall()
-            platform_labels = [row[0] for row in platform_stats]
-            platform_data = [row[1] for row in platform_stats]
-            
-            # 時間段使用分析（最近30天）
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT DATE_TRUNC('day', created_at) as date, COUNT(*) as count
-                    FROM user_scripts
-                    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '30 days'
-                    GROUP BY date
-                    ORDER BY date
-                """)
+            refresh_daily_stats_if_stale(cursor)
+            
+            # 平台、星期、主題、週活躍度四組統計以 UNION ALL 一次查詢（皆讀 user_scripts_daily_stats 每日彙總）
+            # 星期以 0=週日 … 6=週六 表示；週以距今天數分組，第 0 組為最近 7 天
+            if USE_POSTGRESQL:
+                weekday_expr = "CAST(EXTRACT(DOW FROM day) AS INTEGER)"
+                week_expr = "(CURRENT_DATE - day) / 7"
+                since_30_days = "CURRENT_DATE - 30"
+                since_28_days = "CURRENT_DATE - 28"
             else:
-                cursor.execute("""
-                    SELECT DATE(created_at) as date, COUNT(*) as count
-                    FROM user_scripts
-                    WHERE created_at >= datetime('now', '-30 days')
-                    GROUP BY date
-                    ORDER BY date
-                """)
-            
-            daily_usage = {}
-            for row in cursor.fetchall():
-                try:
-                    if use_postgresql:
-                        # PostgreSQL 返回 date 對象
-                        day_name = row[0].strftime('%a')
-                    else:
-                        # SQLite 返回 'YYYY-MM-DD' 字符串
-                        from datetime import datetime
-                        date_str = str(row[0])
-                        day_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                        day_name = day_obj.strftime('%a')
-                except:
-                    day_name = 'Mon'
-                
-                daily_usage[day_name] = daily_usage.get(day_name, 0) + row[1]
-            
-            # 內容類型分布（根據 topic 分類）
-            cursor.execute("""
-                SELECT topic, COUNT(*) as count
-                FROM user_scripts
-                WHERE topic IS NOT NULL AND topic != ''
-                GROUP BY topic
-                ORDER BY count DESC
-                LIMIT 5
+                weekday_expr = "CAST(strftime('%w', day) AS INTEGER)"
+                week_expr = "CAST((julianday('now', 'start of day') - julianday(day)) / 7 AS INTEGER)"
+                since_30_days = "DATE('now', '-30 days')"
+                since_28_days = "DATE('now', '-28 days')"
+            cursor.execute(f"""
+                SELECT section, label, value FROM (
+                    SELECT 'platform' AS section, platform AS label, CAST(SUM(script_count) AS INTEGER) AS value
+                    FROM user_scripts_daily_stats
+                    WHERE platform <> ''
+                    GROUP BY platform
+                    UNION ALL
+                    SELECT 'weekday', CAST({weekday_expr} AS TEXT), CAST(SUM(script_count) AS INTEGER)
+                    FROM user_scripts_daily_stats
+                    WHERE day >= {since_30_days}
+                    GROUP BY {weekday_expr}
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT 'topic', topic, CAST(SUM(script_count) AS INTEGER)
+                        FROM user_scripts_daily_stats
+                        WHERE topic <> ''
+                        GROUP BY topic
+                        ORDER BY 3 DESC
+                        LIMIT 5
+                    ) top_topics
+                    UNION ALL
+                    SELECT 'week', CAST({week_expr} AS TEXT), CAST(COUNT(DISTINCT user_id) AS INTEGER)
+                    FROM user_scripts_daily_stats
+                    WHERE day > {since_28_days}
+                    GROUP BY {week_expr}
+                ) analytics
             """)
-            content_types = cursor.fetchall()
-            content_labels = [row[0] for row in content_types]
-            content_data = [row[1] for row in content_types]
-            
-            # 用戶活躍度（最近4週）
-            weekly_activity = []
-            for i in range(4):
-                if use_postgresql:
-                    cursor.execute(f"""
-                        SELECT COUNT(DISTINCT user_id)
-                        FROM user_scripts
-                        WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '{7 * (i + 1)} days'
-                          AND created_at < CURRENT_TIMESTAMP - INTERVAL '{7 * i} days'
-                    """)
-                else:
-                    cursor.execute(f"""
-                        SELECT COUNT(DISTINCT user_id)
-                        FROM user_scripts
-                        WHERE created_at >= datetime('now', '-{7 * (i + 1)} days')
-                          AND created_at < datetime('now', '-{7 * i} days')
-                    """)
-                count = cursor.fetchone()[0]
-                weekly_activity.append(count)
+            
+            platform_stats = []
+            content_types = []
+            weekday_usage = [0] * 7
+            weekly_activity = [0, 0, 0, 0]
+            for section, label, value in cursor.fetchall():
+                if section == "platform":
+                    platform_stats.append((label, value))
+                elif section == "topic":
+                    content_types.append((label, value))
+                elif section == "weekday":
+                    weekday_usage[int(label)] = value
+                elif 0 <= int(label) < 4:
+                    weekly_activity[int(label)] = value
+            
+            # UNION ALL 不保證順序，依數量排序
+            platform_stats.sort(key=lambda item: item[1], reverse=True)
+            content_types.sort(key=lambda item: item[1], reverse=True)
+            platform_labels = [label for label, _ in platform_stats]
+            platform_data = [count for _, count in platform_stats]
+            content_labels = [label for label, _ in content_types]
+            content_data = [count for _, count in content_types]
             
             conn.close()
             
@@ -3374,15 +3634,7 @@ def create_app() -> FastAPI:
                 },
                 "time_usage": {
                     "labels": ['週一', '週二', '週三', '週四', '週五', '週六', '週日'],
-                    "data": [
-                        daily_usage.get('Mon', 0),
-                        daily_usage.get('Tue', 0),
-                        daily_usage.get('Wed', 0),
-                        daily_usage.get('Thu', 0),
-                        daily_usage.get('Fri', 0),
-                        daily_usage.get('Sat', 0),
-                        daily_usage.get('Sun', 0)
-                    ]
+                    "data": weekday_usage[1:] + weekday_usage[:1]
                 },
                 "activity": {
                     "labels": ['第1週', '第2週', '第3週', '第4週'],
@@ -3396,106 +3648,87 @@ def create_app() -> FastAPI:
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
     
+    @app.get("/api/admin/analytics-data")
+    async def get_analytics_data(request: Request, response: Response):
+        """獲取分析頁面所需的所有數據（快取 ADMIN_STATS_CACHE_TTL 秒）"""
+        result, etag = await cached_admin_stats("analytics_data", compute_analytics_data)
+        if etag is None:
+            return result
+        return apply_etag(request, response, etag, f"private, max-age={ADMIN_STATS_CACHE_TTL}") or result
+    
+    @app.post("/api/admin/cache/flush")
+    async def flush_admin_cache():
+        """手動清除管理後台統計與登入用戶快取"""
+        invalidate_admin_stats()
+        invalidate_auth_user()
+        return {"success": True}
+    
+    # CSV 匯出定義：類型 -> (查詢, 建立時間欄位, 標題列)
+    csv_exports = {
+        "users": ("""
+            SELECT user_id, name, email, created_at, is_subscribed
+            FROM user_auth
+        """, "created_at", ['用戶ID', '姓名', 'Email', '註冊時間', '是否訂閱']),
+        "scripts": ("""
+            SELECT us.id, ua.name, us.platform, us.topic, us.title, us.created_at
+            FROM user_scripts us
+            LEFT JOIN user_auth ua ON us.user_id = ua.user_id
+        """, "us.created_at", ['腳本ID', '用戶名稱', '平台', '主題', '標題', '創建時間']),
+        "conversations": ("""
+            SELECT cs.id, ua.name, cs.conversation_type, cs.summary, cs.created_at
+            FROM conversation_summaries cs
+            LEFT JOIN user_auth ua ON cs.user_id = ua.user_id
+        """, "cs.created_at", ['對話ID', '用戶名稱', '對話類型', '摘要', '創建時間']),
+        "generations": ("""
+            SELECT g.id, ua.name, g.platform, g.topic, g.content, g.created_at
+            FROM generations g
+            LEFT JOIN user_auth ua ON g.user_id = ua.user_id
+        """, "g.created_at", ['生成ID', '用戶名稱', '平台', '主題', '內容', '創建時間']),
+    }
+    
     @app.get("/api/admin/export/{export_type}")
-    async def export_csv(export_type: str):
-        """匯出 CSV 檔案"""
+    def export_csv(export_type: str, start_date: Optional[str] = None, end_date: Optional[str] = None):
+        """匯出 CSV 檔案（逐批讀取並串流輸出）；可用 start_date / end_date（YYYY-MM-DD，含當日）限定範圍"""
         import csv
         import io
         
+        if export_type not in csv_exports:
+            return JSONResponse({"error": "無效的匯出類型"}, status_code=400)
+        
+        base_sql, created_column, header = csv_exports[export_type]
+        conditions = []
+        params = []
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # 根據匯出類型選擇不同的數據
-            if export_type == "users":
-                cursor.execute("""
-                    SELECT user_id, name, email, created_at, is_subscribed
-                    FROM user_auth
-                    ORDER BY created_at DESC
-                """)
-                
-                # 創建 CSV
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['用戶ID', '姓名', 'Email', '註冊時間', '是否訂閱'])
-                for row in cursor.fetchall():
-                    writer.writerow(row)
-                output.seek(0)
-                
-                return Response(
-                    content=output.getvalue(),
-                    media_type="text/csv",
-                    headers={"Content-Disposition": "attachment; filename=users.csv"}
-                )
-            
-            elif export_type == "scripts":
-                cursor.execute("""
-                    SELECT us.id, ua.name, us.platform, us.topic, us.title, us.created_at
-                    FROM user_scripts us
-                    LEFT JOIN user_auth ua ON us.user_id = ua.user_id
-                    ORDER BY us.created_at DESC
-                """)
-                
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['腳本ID', '用戶名稱', '平台', '主題', '標題', '創建時間'])
-                for row in cursor.fetchall():
-                    writer.writerow(row)
-                output.seek(0)
-                
-                return Response(
-                    content=output.getvalue(),
-                    media_type="text/csv",
-                    headers={"Content-Disposition": "attachment; filename=scripts.csv"}
-                )
-            
-            elif export_type == "conversations":
-                cursor.execute("""
-                    SELECT cs.id, ua.name, cs.conversation_type, cs.summary, cs.created_at
-                    FROM conversation_summaries cs
-                    LEFT JOIN user_auth ua ON cs.user_id = ua.user_id
-                    ORDER BY cs.created_at DESC
-                """)
-                
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['對話ID', '用戶名稱', '對話類型', '摘要', '創建時間'])
-                for row in cursor.fetchall():
-                    writer.writerow(row)
-                output.seek(0)
-                
-                return Response(
-                    content=output.getvalue(),
-                    media_type="text/csv",
-                    headers={"Content-Disposition": "attachment; filename=conversations.csv"}
-                )
-            
-            elif export_type == "generations":
-                cursor.execute("""
-                    SELECT g.id, ua.name, g.platform, g.topic, g.content, g.created_at
-                    FROM generations g
-                    LEFT JOIN user_auth ua ON g.user_id = ua.user_id
-                    ORDER BY g.created_at DESC
-                """)
-                
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['生成ID', '用戶名稱', '平台', '主題', '內容', '創建時間'])
-                for row in cursor.fetchall():
-                    writer.writerow(row)
-                output.seek(0)
-                
-                return Response(
-                    content=output.getvalue(),
-                    media_type="text/csv",
-                    headers={"Content-Disposition": "attachment; filename=generations.csv"}
-                )
-            
-            else:
-                return JSONResponse({"error": "無效的匯出類型"}, status_code=400)
+            if start_date:
+                conditions.append(f"{created_column} >= ?")
+                params.append(datetime.strptime(start_date, "%Y-%m-%d").strftime("%Y-%m-%d"))
+            if end_date:
+                conditions.append(f"{created_column} < ?")
+                params.append((datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d"))
+        except ValueError:
+            return JSONResponse({"error": "日期格式需為 YYYY-MM-DD"}, status_code=400)
         
-        except Exception as e:
-            return JSONResponse({"error": str(e)}, status_code=500)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = adapt_sql(f"{base_sql} {where_clause} ORDER BY {created_column} DESC")
+        
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(header)
+            for index, row in enumerate(iter_rows(sql, tuple(params), cursor_name=f"export_{export_type}"), 1):
+                writer.writerow(row)
+                # 每 1000 列送出一次，避免整份 CSV 留在記憶體
+                if index % 1000 == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        
+        return StreamingResponse(
+            generate(),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={export_type}.csv"}
+        )
 
     # ===== OAuth 認證功能 =====
     
@@ -3505,18 +3738,16 @@ def create_app() -> FastAPI:
         # 透過查詢參數 fb 覆寫回跳前端（必須在白名單內）
         chosen_frontend = fb if fb in ALLOWED_FRONTENDS else FRONTEND_BASE_URL
         # 以 state 帶回前端 base，callback 取回以決定最終導向
-        from urllib.parse import quote
-        state_val = quote(chosen_frontend)
-        auth_url = (
-            f"https://accounts.google.com/o/oauth2/v2/auth?"
-            f"client_id={GOOGLE_CLIENT_ID}&"
-            f"redirect_uri={GOOGLE_REDIRECT_URI}&"
-            f"response_type=code&"
-            f"scope=openid email profile&"
-            f"access_type=offline&"
-            f"prompt=select_account&"
-            f"state={state_val}"
-        )
+        auth_params = {
+            "client_id": GOOGLE_CLIENT_ID,
+            "redirect_uri": GOOGLE_REDIRECT_URI,
+            "response_type": "code",
+            "scope": "openid email profile",
+            "access_type": "offline",
+            "prompt": "select_account",
+            "state": chosen_frontend,
+        }
+        auth_url = f"https://accounts.google.com/o/oauth2/v2/auth?{urlencode(auth_params, quote_via=quote)}"
         
         # 除錯資訊
         print(f"DEBUG: Generated auth URL: {auth_url}")
@@ -3525,8 +3756,82 @@ def create_app() -> FastAPI:
         
         return {"auth_url": auth_url}
 
+    def save_oauth_user(user_id: str, google_user: GoogleUser, access_token: str, expires_in: int):
+        """保存或更新 OAuth 用戶認證資訊（冪等 upsert，不覆蓋訂閱狀態與建立時間）"""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+
+            if USE_POSTGRESQL:
+                # PostgreSQL 語法
+                expires_at_value = datetime.now() + timedelta(seconds=expires_in)
+
+                cursor.execute("""
+                    INSERT INTO user_auth 
+                    (user_id, google_id, email, name, picture, access_token, expires_at, is_subscribed, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id) 
+                    DO UPDATE SET 
+                        google_id = EXCLUDED.google_id,
+                        email = EXCLUDED.email,
+                        name = EXCLUDED.name,
+                        picture = EXCLUDED.picture,
+                        access_token = EXCLUDED.access_token,
+                        expires_at = EXCLUDED.expires_at,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (
+                    user_id,
+                    google_user.id,
+                    google_user.email,
+                    google_user.name,
+                    google_user.picture,
+                    access_token,
+                    expires_at_value,
+                        0  # 新用戶預設為未訂閱
+                ))
+            else:
+                # SQLite 語法
+                cursor.execute("""
+                    INSERT INTO user_auth 
+                    (user_id, google_id, email, name, picture, access_token, expires_at, is_subscribed, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id) 
+                    DO UPDATE SET 
+                        google_id = excluded.google_id,
+                        email = excluded.email,
+                        name = excluded.name,
+                        picture = excluded.picture,
+                        access_token = excluded.access_token,
+                        expires_at = excluded.expires_at,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (
+                    user_id,
+                    google_user.id,
+                    google_user.email,
+                    google_user.name,
+                    google_user.picture,
+                    access_token,
+                    datetime.now().timestamp() + expires_in,
+                        0  # 新用戶預設為未訂閱
+                ))
+
+            if not USE_POSTGRESQL:
+                conn.commit()
+        finally:
+            conn.close()
+        invalidate_admin_stats()
+        invalidate_auth_user(user_id)
+
+    def persist_oauth_user(user_id: str, google_user: GoogleUser, access_token: str, expires_in: int):
+        """背景任務版本：回應已送出，失敗時只能記錄完整錯誤供追查"""
+        try:
+            save_oauth_user(user_id, google_user, access_token, expires_in)
+        except Exception:
+            print(f"ERROR: 背景保存 OAuth 用戶失敗 user_id={user_id}")
+            traceback.print_exc()
+
     @app.get("/api/auth/google/callback")
-    async def google_callback_get(code: str = None, state: Optional[str] = None):
+    async def google_callback_get(background_tasks: BackgroundTasks, code: str = None, state: Optional[str] = None):
         """處理 Google OAuth 回調（GET 請求 - 來自 Google 重定向）"""
         try:
             # 除錯資訊
@@ -3542,125 +3847,71 @@ def create_app() -> FastAPI:
                 return RedirectResponse(url="https://aivideonew.zeabur.app/?error=missing_code")
             
             # 交換授權碼獲取訪問令牌
-            async with httpx.AsyncClient() as client:
-                token_response = await client.post(
-                    "https://oauth2.googleapis.com/token",
-                    data={
-                        "client_id": GOOGLE_CLIENT_ID,
-                        "client_secret": GOOGLE_CLIENT_SECRET,
-                        "code": code,
-                        "grant_type": "authorization_code",
-                        "redirect_uri": GOOGLE_REDIRECT_URI,
-                    }
-                )
-                
-                if token_response.status_code != 200:
-                    raise HTTPException(status_code=400, detail="Failed to get access token")
-                
-                token_data = token_response.json()
-                access_token = token_data["access_token"]
-                
-                # 獲取用戶資訊
-                google_user = await get_google_user_info(access_token)
-                if not google_user:
-                    raise HTTPException(status_code=400, detail="Failed to get user info")
+            client = get_http_client()
+            token_response = await client.post(
+                "https://oauth2.googleapis.com/token",
+                data={
+                    "client_id": GOOGLE_CLIENT_ID,
+                    "client_secret": GOOGLE_CLIENT_SECRET,
+                    "code": code,
+                    "grant_type": "authorization_code",
+                    "redirect_uri": GOOGLE_REDIRECT_URI,
+                }
+            )
                 
-                # 生成用戶 ID
-                user_id = generate_user_id(google_user.email)
+            if token_response.status_code != 200:
+                raise HTTPException(status_code=400, detail="Failed to get access token")
                 
-                # 保存或更新用戶認證資訊
-                conn = get_db_connection()
-                cursor = conn.cursor()
+            token_data = token_response.json()
+            access_token = token_data["access_token"]
                 
-                database_url = os.getenv("DATABASE_URL")
-                use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
+            # 獲取用戶資訊
+            google_user = await get_google_user_info(access_token)
+            if not google_user:
+                raise HTTPException(status_code=400, detail="Failed to get user info")
                 
-                if use_postgresql:
-                    # PostgreSQL 語法
-                    from datetime import timedelta
-                    expires_at_value = datetime.now() + timedelta(seconds=token_data.get("expires_in", 3600))
-                    
-                    cursor.execute("""
-                        INSERT INTO user_auth 
-                        (user_id, google_id, email, name, picture, access_token, expires_at, is_subscribed, updated_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                        ON CONFLICT (user_id) 
-                        DO UPDATE SET 
-                            google_id = EXCLUDED.google_id,
-                            email = EXCLUDED.email,
-                            name = EXCLUDED.name,
-                            picture = EXCLUDED.picture,
-                            access_token = EXCLUDED.access_token,
-                            expires_at = EXCLUDED.expires_at,
-                            updated_at = CURRENT_TIMESTAMP
-                    """, (
-                        user_id,
-                        google_user.id,
-                        google_user.email,
-                        google_user.name,
-                        google_user.picture,
-                        access_token,
-                        expires_at_value,
-                            0  # 新用戶預設為未訂閱
-                    ))
-                else:
-                    # SQLite 語法
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO user_auth 
-                        (user_id, google_id, email, name, picture, access_token, expires_at, is_subscribed, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                    """, (
-                        user_id,
-                        google_user.id,
-                        google_user.email,
-                        google_user.name,
-                        google_user.picture,
-                        access_token,
-                        datetime.now().timestamp() + token_data.get("expires_in", 3600),
-                            0  # 新用戶預設為未訂閱
-                    ))
+            # 生成用戶 ID
+            user_id = generate_user_id(google_user.email)
                 
-                if not use_postgresql:
-                    conn.commit()
-                conn.close()
+            # 既有用戶的認證資訊改由背景任務更新，不阻塞重定向；
+            # 首次登入的用戶必須先寫入，否則拿到 token 後 /api/auth/me 會找不到用戶
+            expires_in = token_data.get("expires_in", 3600)
+            if user_id in _auth_user_cache or await asyncio.to_thread(auth_user_exists, user_id):
+                background_tasks.add_task(persist_oauth_user, user_id, google_user, access_token, expires_in)
+            else:
+                await asyncio.to_thread(save_oauth_user, user_id, google_user, access_token, expires_in)
                 
-                # 生成應用程式訪問令牌
-                app_access_token = generate_access_token(user_id)
+            # 生成應用程式訪問令牌
+            app_access_token = generate_access_token(user_id)
                 
-                # 使用 URL 編碼確保參數安全
-                from urllib.parse import quote, unquote
-                safe_token = quote(app_access_token)
-                safe_user_id = quote(user_id)
-                safe_email = quote(google_user.email or '')
-                safe_name = quote(google_user.name or '')
-                safe_picture = quote(google_user.picture or '')
-                # 取回 state 中的前端 base（若在白名單內）
-                frontend_base = FRONTEND_BASE_URL
-                try:
-                    if state:
-                        decoded = unquote(state)
-                        if decoded in ALLOWED_FRONTENDS:
-                            frontend_base = decoded
-                except Exception:
-                    pass
-                # Redirect 到前端的 popup-callback.html 頁面
-                # 該頁面會使用 postMessage 傳遞 token 給主視窗並自動關閉
-                callback_url = (
-                    f"{frontend_base}/auth/popup-callback.html"
-                    f"?token={safe_token}"
-                    f"&user_id={safe_user_id}"
-                    f"&email={safe_email}"
-                    f"&name={safe_name}"
-                    f"&picture={safe_picture}"
-                    f"&origin={quote(frontend_base)}"
-                )
+            # 取回 state 中的前端 base（若在白名單內）
+            frontend_base = FRONTEND_BASE_URL
+            try:
+                if state:
+                    decoded = unquote(state)
+                    if decoded in ALLOWED_FRONTENDS:
+                        frontend_base = decoded
+            except Exception:
+                pass
+            # Redirect 到前端的 popup-callback.html 頁面
+            # 該頁面會使用 postMessage 傳遞 token 給主視窗並自動關閉
+            # 使用 urlencode 一次完成所有參數的 URL 編碼
+            callback_params = {
+                "token": app_access_token,
+                "user_id": user_id,
+                "email": google_user.email or '',
+                "name": google_user.name or '',
+                "picture": google_user.picture or '',
+                "origin": frontend_base,
+            }
+            callback_url = f"{frontend_base}/auth/popup-callback.html?{urlencode(callback_params, quote_via=quote)}"
                 
-                print(f"DEBUG: Redirecting to callback URL: {callback_url}")
+            print(f"DEBUG: Redirecting to callback URL: {callback_url}")
                 
-                # 設置適當的 HTTP Header 以支援 popup 通信
-                response = RedirectResponse(url=callback_url)
-                response.headers["Cross-Origin-Opener-Policy"] = "same-origin-allow-popups"
-                return response
+            # 設置適當的 HTTP Header 以支援 popup 通信
+            response = RedirectResponse(url=callback_url)
+            response.headers["Cross-Origin-Opener-Policy"] = "same-origin-allow-popups"
+            return response
                 
         except Exception as e:
             # 處理錯誤訊息以安全地嵌入 JavaScript（先處理再放入 f-string）
@@ -3756,11 +4007,9 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
 
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
 
             # 更新/建立 licenses 記錄，並設為 active
-            if use_postgresql:
+            if USE_POSTGRESQL:
                 try:
                     cursor.execute(
                         """
@@ -3792,41 +4041,28 @@ def create_app() -> FastAPI:
                     print("WARN: update licenses failed:", e)
 
             # 將 user 設為已訂閱
-            if use_postgresql:
-                cursor.execute(
-                    "UPDATE user_auth SET is_subscribed = 1, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s",
-                    (user_id,)
-                )
-            else:
-                cursor.execute(
-                    "UPDATE user_auth SET is_subscribed = 1, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
-                    (user_id,)
-                )
+            cursor.execute(
+                adapt_sql("UPDATE user_auth SET is_subscribed = 1, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?"),
+                (user_id,)
+            )
 
             # 可選：記錄訂單（若有 orders 表）
             try:
-                if use_postgresql:
-                    cursor.execute(
-                        """
-                        INSERT INTO orders (user_id, plan_type, amount, payment_status, paid_at, invoice_number, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                        """,
-                        (user_id, plan, amount, "paid", paid_at, transaction_id)
-                    )
-                else:
-                    cursor.execute(
-                        """
-                        INSERT INTO orders (user_id, plan_type, amount, payment_status, paid_at, invoice_number, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                        """,
-                        (user_id, plan, amount, "paid", paid_at, transaction_id)
-                    )
+                cursor.execute(
+                    adapt_sql("""
+                    INSERT INTO orders (user_id, plan_type, amount, payment_status, paid_at, invoice_number, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    """),
+                    (user_id, plan, amount, "paid", paid_at, transaction_id)
+                )
             except Exception as e:
                 print("WARN: insert orders failed:", e)
 
-            if not use_postgresql:
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
+            invalidate_admin_stats()
+            invalidate_auth_user(user_id)
 
             return {"ok": True, "user_id": user_id, "plan": plan, "expires_at": expires_dt.isoformat()}
         except HTTPException:
@@ -3845,102 +4081,102 @@ def create_app() -> FastAPI:
                 raise HTTPException(status_code=400, detail="Missing authorization code")
             
             # 交換授權碼獲取訪問令牌
-            async with httpx.AsyncClient() as client:
-                token_response = await client.post(
-                    "https://oauth2.googleapis.com/token",
-                    data={
-                        "client_id": GOOGLE_CLIENT_ID,
-                        "client_secret": GOOGLE_CLIENT_SECRET,
-                        "code": code,
-                        "grant_type": "authorization_code",
-                        "redirect_uri": GOOGLE_REDIRECT_URI,
-                    }
-                )
+            client = get_http_client()
+            token_response = await client.post(
+                "https://oauth2.googleapis.com/token",
+                data={
+                    "client_id": GOOGLE_CLIENT_ID,
+                    "client_secret": GOOGLE_CLIENT_SECRET,
+                    "code": code,
+                    "grant_type": "authorization_code",
+                    "redirect_uri": GOOGLE_REDIRECT_URI,
+                }
+            )
                 
-                if token_response.status_code != 200:
-                    raise HTTPException(status_code=400, detail="Failed to get access token")
+            if token_response.status_code != 200:
+                raise HTTPException(status_code=400, detail="Failed to get access token")
                 
-                token_data = token_response.json()
-                access_token = token_data["access_token"]
+            token_data = token_response.json()
+            access_token = token_data["access_token"]
                 
-                # 獲取用戶資訊
-                google_user = await get_google_user_info(access_token)
-                if not google_user:
-                    raise HTTPException(status_code=400, detail="Failed to get user info")
+            # 獲取用戶資訊
+            google_user = await get_google_user_info(access_token)
+            if not google_user:
+                raise HTTPException(status_code=400, detail="Failed to get user info")
                 
-                # 生成用戶 ID
-                user_id = generate_user_id(google_user.email)
+            # 生成用戶 ID
+            user_id = generate_user_id(google_user.email)
                 
-                # 保存或更新用戶認證資訊
-                conn = get_db_connection()
-                cursor = conn.cursor()
+            # 保存或更新用戶認證資訊
+            conn = get_db_connection()
+            cursor = conn.cursor()
                 
-                database_url = os.getenv("DATABASE_URL")
-                use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
                 
-                if use_postgresql:
-                    # PostgreSQL 語法
-                    from datetime import timedelta
-                    expires_at_value = datetime.now() + timedelta(seconds=token_data.get("expires_in", 3600))
+            if USE_POSTGRESQL:
+                # PostgreSQL 語法
+                expires_at_value = datetime.now() + timedelta(seconds=token_data.get("expires_in", 3600))
                     
-                    cursor.execute("""
-                        INSERT INTO user_auth 
-                        (user_id, google_id, email, name, picture, access_token, expires_at, updated_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                        ON CONFLICT (user_id) 
-                        DO UPDATE SET 
-                            google_id = EXCLUDED.google_id,
-                            email = EXCLUDED.email,
-                            name = EXCLUDED.name,
-                            picture = EXCLUDED.picture,
-                            access_token = EXCLUDED.access_token,
-                            expires_at = EXCLUDED.expires_at,
-                            updated_at = CURRENT_TIMESTAMP
-                    """, (
-                        user_id,
-                        google_user.id,
-                        google_user.email,
-                        google_user.name,
-                        google_user.picture,
-                        access_token,
-                        expires_at_value
-                    ))
-                else:
-                    # SQLite 語法
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO user_auth 
-                        (user_id, google_id, email, name, picture, access_token, expires_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                    """, (
-                        user_id,
-                        google_user.id,
-                        google_user.email,
-                        google_user.name,
-                        google_user.picture,
-                        access_token,
-                        datetime.now().timestamp() + token_data.get("expires_in", 3600)
-                    ))
+                cursor.execute("""
+                    INSERT INTO user_auth 
+                    (user_id, google_id, email, name, picture, access_token, expires_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id) 
+                    DO UPDATE SET 
+                        google_id = EXCLUDED.google_id,
+                        email = EXCLUDED.email,
+                        name = EXCLUDED.name,
+                        picture = EXCLUDED.picture,
+                        access_token = EXCLUDED.access_token,
+                        expires_at = EXCLUDED.expires_at,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (
+                    user_id,
+                    google_user.id,
+                    google_user.email,
+                    google_user.name,
+                    google_user.picture,
+                    access_token,
+                    expires_at_value
+                ))
+            else:
+                # SQLite 語法
+                cursor.execute("""
+                    INSERT OR REPLACE INTO user_auth 
+                    (user_id, google_id, email, name, picture, access_token, expires_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """, (
+                    user_id,
+                    google_user.id,
+                    google_user.email,
+                    google_user.name,
+                    google_user.picture,
+                    access_token,
+                    datetime.now().timestamp() + token_data.get("expires_in", 3600)
+                ))
                 
-                if not use_postgresql:
-                    conn.commit()
-                conn.close()
+            if not USE_POSTGRESQL:
+                conn.commit()
+            conn.close()
+            invalidate_admin_stats()
+            invalidate_auth_user(user_id)
                 
-                # 生成應用程式訪問令牌
-                app_access_token = generate_access_token(user_id)
+            # 生成應用程式訪問令牌
+            app_access_token = generate_access_token(user_id)
                 
-                # 返回 JSON 格式（給前端 JavaScript 使用）
-                return AuthToken(
-                    access_token=app_access_token,
-                    expires_in=3600,
-                    user=google_user
-                )
+            # 返回 JSON 格式（給前端 JavaScript 使用）
+            return AuthToken(
+                access_token=app_access_token,
+                expires_in=3600,
+                user=google_user
+            )
                 
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.post("/api/auth/refresh")
-    async def refresh_token(
-        current_user_id: Optional[str] = Depends(get_current_user_for_refresh)
+    def refresh_token(
+        current_user_id: Optional[str] = Depends(get_current_user_for_refresh),
+        credentials: HTTPAuthorizationCredentials = Depends(security)
     ):
         """刷新存取權杖（允許使用過期的 token）"""
         print(f"DEBUG: refresh_token - current_user_id={current_user_id}")
@@ -3949,45 +4185,26 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=401, detail="未授權")
         print(f"DEBUG: refresh_token - 開始處理 refresh，user_id={current_user_id}")
         
+        # 現有 token 仍幾乎是全新的（重複 refresh），直接回傳，不寫入 user_auth
+        current_exp = access_token_expiry(credentials.credentials)
+        if current_exp and datetime.now().timestamp() + ACCESS_TOKEN_TTL - current_exp < TOKEN_REFRESH_SKIP_SECONDS:
+            return {
+                "access_token": credentials.credentials,
+                "expires_at": datetime.fromtimestamp(current_exp).isoformat()
+            }
+        
+        # 未知或已刪除的用戶不可續期：用戶快取仍有效時免查詢，否則以主鍵確認一次
+        entry = _auth_user_cache.get(current_user_id)
+        if not (entry and entry[0] > time.monotonic()) and not auth_user_exists(current_user_id):
+            raise HTTPException(status_code=404, detail="用戶不存在")
+        
         try:
-            # 獲取資料庫連接
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            # 從資料庫獲取用戶的 refresh token（如果需要）
-            # 但實際上我們直接生成新的 access token
-            if use_postgresql:
-                cursor.execute("SELECT user_id FROM user_auth WHERE user_id = %s", (current_user_id,))
-            else:
-                cursor.execute("SELECT user_id FROM user_auth WHERE user_id = ?", (current_user_id,))
-            
-            if not cursor.fetchone():
-                conn.close()
-                raise HTTPException(status_code=404, detail="用戶不存在")
-            
             # 生成新的 access token
             new_access_token = generate_access_token(current_user_id)
-            new_expires_at = datetime.now() + timedelta(hours=1)
-            
-            # 更新資料庫中的 token
-            if use_postgresql:
-                cursor.execute("""
-                    UPDATE user_auth 
-                    SET access_token = %s, expires_at = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s
-                """, (new_access_token, new_expires_at, current_user_id))
-            else:
-                cursor.execute("""
-                    UPDATE user_auth 
-                    SET access_token = ?, expires_at = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE user_id = ?
-                """, (new_access_token, new_expires_at.isoformat(), current_user_id))
-                conn.commit()
+            new_expires_at = datetime.now() + timedelta(seconds=ACCESS_TOKEN_TTL)
             
-            conn.close()
+            # 寫回 user_auth 交由背景任務批次處理（/api/auth/me 的快取不含 token，不需清除）
+            buffer_token_write(current_user_id, new_access_token, new_expires_at)
             
             return {
                 "access_token": new_access_token,
@@ -4001,7 +4218,7 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=500, detail="內部伺服器錯誤")
 
     @app.get("/api/auth/me")
-    async def get_current_user_info(request: Request, current_user_id: Optional[str] = Depends(get_current_user)):
+    def get_current_user_info(request: Request, current_user_id: Optional[str] = Depends(get_current_user)):
         """獲取當前用戶資訊"""
         if not current_user_id:
             # 兼容處理：若依賴鏈沒有取到 credentials，改從 Header 直接解析一次
@@ -4021,25 +4238,16 @@ def create_app() -> FastAPI:
             if not current_user_id:
                 raise HTTPException(status_code=401, detail="Not authenticated")
         
+        entry = _auth_user_cache.get(current_user_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT google_id, email, name, picture, is_subscribed, created_at 
-                    FROM user_auth 
-                    WHERE user_id = %s
-                """, (current_user_id,))
-            else:
-                cursor.execute("""
-                    SELECT google_id, email, name, picture, is_subscribed, created_at 
-                    FROM user_auth 
-                    WHERE user_id = ?
-                """, (current_user_id,))
+            execute_prepared(cursor, "auth_me_lookup", (current_user_id,))
             
             row = cursor.fetchone()
             conn.close()
@@ -4049,7 +4257,6 @@ def create_app() -> FastAPI:
                 created_at = row[5]
                 if created_at:
                     try:
-                        from datetime import timezone, timedelta
                         if isinstance(created_at, datetime):
                             # 如果是 datetime 對象，直接使用
                             dt = created_at
@@ -4061,17 +4268,16 @@ def create_app() -> FastAPI:
                         
                         if dt:
                             # 轉換為台灣時區 (UTC+8)
-                            taiwan_tz = timezone(timedelta(hours=8))
                             if dt.tzinfo is None:
                                 # 如果沒有時區信息，假設是 UTC
                                 dt = dt.replace(tzinfo=timezone.utc)
-                            dt_taiwan = dt.astimezone(taiwan_tz)
+                            dt_taiwan = dt.astimezone(TAIWAN_TZ)
                             created_at = dt_taiwan.strftime('%Y/%m/%d %H:%M')
                     except Exception as e:
                         print(f"格式化日期時出錯: {e}")
                         pass
                 
-                return {
+                user_info = {
                     "user_id": current_user_id,
                     "google_id": row[0],
                     "email": row[1],
@@ -4080,36 +4286,39 @@ def create_app() -> FastAPI:
                     "is_subscribed": bool(row[4]) if row[4] is not None else True,  # 預設為已訂閱
                     "created_at": created_at
                 }
+                _cache_put(_auth_user_cache, current_user_id, (time.monotonic() + AUTH_USER_CACHE_TTL, user_info))
+                return user_info
             else:
                 raise HTTPException(status_code=404, detail="User not found")
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.post("/api/auth/logout")
-    async def logout(current_user_id: Optional[str] = Depends(get_current_user)):
+    def logout(current_user_id: Optional[str] = Depends(get_current_user)):
         """登出用戶"""
         if not current_user_id:
             return {"message": "Already logged out"}
         
+        invalidate_auth_user(current_user_id)
         # 這裡可以添加令牌黑名單邏輯
         return {"message": "Logged out successfully"}
 
     # ===== P0 功能：長期記憶＋個人化 =====
     
     @app.get("/api/profile/{user_id}")
-    async def get_user_profile(user_id: str):
+    def get_user_profile(user_id: str):
         """獲取用戶個人偏好"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("SELECT * FROM user_profiles WHERE user_id = %s", (user_id,))
-            else:
-                cursor.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT user_id, preferred_platform, preferred_style, preferred_duration,
+                       content_preferences, created_at, updated_at
+                FROM user_profiles 
+                WHERE user_id = ?
+            """), (user_id,))
             row = cursor.fetchone()
             conn.close()
             
@@ -4119,7 +4328,7 @@ def create_app() -> FastAPI:
                     "preferred_platform": row[1],
                     "preferred_style": row[2],
                     "preferred_duration": row[3],
-                    "content_preferences": json.loads(row[4]) if row[4] else None,
+                    "content_preferences": json_loads(row[4]) if row[4] else None,
                     "created_at": row[5],
                     "updated_at": row[6]
                 }
@@ -4129,78 +4338,33 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.post("/api/profile")
-    async def create_or_update_profile(profile: UserProfile):
+    def create_or_update_profile(profile: UserProfile):
         """創建或更新用戶個人偏好"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
-            
-            # 檢查是否已存在
-            if use_postgresql:
-                cursor.execute("SELECT user_id FROM user_profiles WHERE user_id = %s", (profile.user_id,))
-            else:
-                cursor.execute("SELECT user_id FROM user_profiles WHERE user_id = ?", (profile.user_id,))
-            exists = cursor.fetchone()
-            
-            if exists:
-                # 更新現有記錄
-                if use_postgresql:
-                    cursor.execute("""
-                        UPDATE user_profiles 
-                        SET preferred_platform = %s, preferred_style = %s, preferred_duration = %s, 
-                            content_preferences = %s, updated_at = CURRENT_TIMESTAMP
-                        WHERE user_id = %s
-                    """, (
-                        profile.preferred_platform,
-                        profile.preferred_style,
-                        profile.preferred_duration,
-                        json.dumps(profile.content_preferences) if profile.content_preferences else None,
-                        profile.user_id
-                    ))
-                else:
-                    cursor.execute("""
-                        UPDATE user_profiles 
-                        SET preferred_platform = ?, preferred_style = ?, preferred_duration = ?, 
-                            content_preferences = ?, updated_at = CURRENT_TIMESTAMP
-                        WHERE user_id = ?
-                    """, (
-                        profile.preferred_platform,
-                        profile.preferred_style,
-                        profile.preferred_duration,
-                        json.dumps(profile.content_preferences) if profile.content_preferences else None,
-                        profile.user_id
-                    ))
-            else:
-                # 創建新記錄
-                if use_postgresql:
-                    cursor.execute("""
-                        INSERT INTO user_profiles 
-                        (user_id, preferred_platform, preferred_style, preferred_duration, content_preferences)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (
-                        profile.user_id,
-                        profile.preferred_platform,
-                        profile.preferred_style,
-                        profile.preferred_duration,
-                        json.dumps(profile.content_preferences) if profile.content_preferences else None
-                    ))
-                else:
-                    cursor.execute("""
-                        INSERT INTO user_profiles 
-                        (user_id, preferred_platform, preferred_style, preferred_duration, content_preferences)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (
-                        profile.user_id,
-                        profile.preferred_platform,
-                        profile.preferred_style,
-                        profile.preferred_duration,
-                        json.dumps(profile.content_preferences) if profile.content_preferences else None
-                    ))
             
-            if not use_postgresql:
+            # 單一 UPSERT：已存在則更新偏好（保留 created_at），不必先查詢是否存在
+            cursor.execute(adapt_sql("""
+                INSERT INTO user_profiles 
+                (user_id, preferred_platform, preferred_style, preferred_duration, content_preferences)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    preferred_platform = EXCLUDED.preferred_platform,
+                    preferred_style = EXCLUDED.preferred_style,
+                    preferred_duration = EXCLUDED.preferred_duration,
+                    content_preferences = EXCLUDED.content_preferences,
+                    updated_at = CURRENT_TIMESTAMP
+            """), (
+                profile.user_id,
+                profile.preferred_platform,
+                profile.preferred_style,
+                profile.preferred_duration,
+                json.dumps(profile.content_preferences) if profile.content_preferences else None
+            ))
+            
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
             return {"message": "Profile saved successfully", "user_id": profile.user_id}
@@ -4208,7 +4372,7 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.post("/api/generations")
-    async def save_generation(generation: Generation):
+    def save_generation(generation: Generation):
         """保存生成內容並檢查去重"""
         try:
             conn = get_db_connection()
@@ -4221,17 +4385,13 @@ def create_app() -> FastAPI:
                 generation.topic
             )
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
             # 檢查是否已存在相同內容
-            if use_postgresql:
-                cursor.execute("SELECT id FROM generations WHERE dedup_hash = %s", (dedup_hash,))
-            else:
-                cursor.execute("SELECT id FROM generations WHERE dedup_hash = ?", (dedup_hash,))
+            execute_prepared(cursor, "generation_dedup_lookup", (dedup_hash,))
             existing = cursor.fetchone()
             
             if existing:
+                conn.close()
                 return {
                     "message": "Similar content already exists",
                     "generation_id": existing[0],
@@ -4239,36 +4399,20 @@ def create_app() -> FastAPI:
                     "is_duplicate": True
                 }
             
-            # 生成新的 ID
-            generation_id = hashlib.md5(f"{generation.user_id}_{datetime.now().isoformat()}".encode()).hexdigest()[:12]
+            # 生成新的 ID（隨機 12 碼十六進位，同一秒內並發請求也不會撞號）
+            generation_id = secrets.token_hex(6)
             
             # 保存新生成內容
-            if use_postgresql:
-                cursor.execute("""
-                    INSERT INTO generations (id, user_id, content, platform, topic, dedup_hash)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    generation_id,
-                    generation.user_id,
-                    generation.content,
-                    generation.platform,
-                    generation.topic,
-                    dedup_hash
-                ))
-            else:
-                cursor.execute("""
-                    INSERT INTO generations (id, user_id, content, platform, topic, dedup_hash)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    generation_id,
-                    generation.user_id,
-                    generation.content,
-                    generation.platform,
-                    generation.topic,
-                    dedup_hash
-                ))
-            
-            if not use_postgresql:
+            execute_prepared(cursor, "generation_insert", (
+                generation_id,
+                generation.user_id,
+                generation.content,
+                generation.platform,
+                generation.topic,
+                dedup_hash
+            ))
+            
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
             
@@ -4282,50 +4426,23 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.get("/api/generations/{user_id}")
-    async def get_user_generations(user_id: str, limit: int = 10):
+    def get_user_generations(user_id: str, limit: int = 10):
         """獲取用戶的生成歷史"""
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, content, platform, topic, created_at 
-                    FROM generations 
-                    WHERE user_id = %s 
-                    ORDER BY created_at DESC 
-                    LIMIT %s
-                """, (user_id, limit))
-            else:
-                cursor.execute("""
-                    SELECT id, content, platform, topic, created_at 
-                    FROM generations 
-                    WHERE user_id = ? 
-                    ORDER BY created_at DESC 
-                    LIMIT ?
-                """, (user_id, limit))
+            execute_prepared(cursor, "user_generations", (user_id, limit))
             
-            rows = cursor.fetchall()
+            generations = rows_to_dicts(cursor)
             conn.close()
             
-            generations = []
-            for row in rows:
-                generations.append({
-                    "id": row[0],
-                    "content": row[1],
-                    "platform": row[2],
-                    "topic": row[3],
-                    "created_at": row[4]
-                })
-            
             return {"generations": generations, "count": len(generations)}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.post("/api/conversation/summary")
-    async def create_conversation_summary(user_id: str, messages: List[ChatMessage]):
+    def create_conversation_summary(user_id: str, messages: List[ChatMessage]):
         """創建對話摘要"""
         try:
             if not os.getenv("GEMINI_API_KEY"):
@@ -4353,29 +4470,29 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
 
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
 
             message_cnt = len(messages)
+            conversation_type = classify_conversation(
+                user_message=messages[-1].content if messages else "", ai_response=summary
+            )
 
-            if use_postgresql:
-                # PostgreSQL upsert：以 (user_id, created_at, summary) 近似去重，避免重複
+            # conversation_summaries 是每次對話一筆的紀錄表（admin 列表、記憶統計皆依此計數），直接 INSERT
+            if USE_POSTGRESQL:
                 cursor.execute("""
                     INSERT INTO conversation_summaries (user_id, summary, conversation_type, created_at, message_count, updated_at)
                     VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                """, (
-                    user_id, summary, classify_conversation(user_message=messages[-1].content if messages else "", ai_response=summary), datetime.now(), message_cnt
-                ))
+                """, (user_id, summary, conversation_type, datetime.now(), message_cnt))
             else:
                 cursor.execute("""
-                    INSERT OR REPLACE INTO conversation_summaries 
-                    (user_id, summary, message_count, updated_at)
-                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                """, (user_id, summary, message_cnt))
+                    INSERT INTO conversation_summaries 
+                    (user_id, summary, conversation_type, message_count, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """, (user_id, summary, conversation_type, message_cnt))
             
-            if not use_postgresql:
+            if not USE_POSTGRESQL:
                 conn.commit()
             conn.close()
+            _summary_absent_cache.pop(user_id, None)
             
             return {
                 "message": "Conversation summary created",
@@ -4386,16 +4503,23 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.get("/api/conversation/summary/{user_id}")
-    async def get_conversation_summary(user_id: str):
+    def get_conversation_summary(user_id: str):
         """獲取用戶的對話摘要"""
+        # 近期已確認查無摘要的用戶直接回應，不取用資料庫連線
+        entry = _summary_absent_cache.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            return {"message": "No conversation summary found", "user_id": user_id}
+        
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
-            cursor.execute("""
+            cursor.execute(adapt_sql("""
                 SELECT summary, message_count, created_at, updated_at 
                 FROM conversation_summaries 
                 WHERE user_id = ?
-            """, (user_id,))
+                ORDER BY created_at DESC
+                LIMIT 1
+            """), (user_id,))
             
             row = cursor.fetchone()
             conn.close()
@@ -4409,6 +4533,7 @@ def create_app() -> FastAPI:
                     "updated_at": row[3]
                 }
             else:
+                _cache_put(_summary_absent_cache, user_id, (time.monotonic() + SUMMARY_ABSENT_CACHE_TTL,))
                 return {"message": "No conversation summary found", "user_id": user_id}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -4416,7 +4541,7 @@ def create_app() -> FastAPI:
     # ============ 帳單資訊相關 API ============
 
     @app.get("/api/user/orders/{user_id}")
-    async def get_user_orders(user_id: str, current_user_id: Optional[str] = Depends(get_current_user)):
+    def get_user_orders(user_id: str, current_user_id: Optional[str] = Depends(get_current_user)):
         """獲取用戶的購買記錄"""
         if current_user_id != user_id:
             return JSONResponse({"error": "無權限訪問此用戶資料"}, status_code=403)
@@ -4425,54 +4550,25 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT id, order_id, plan_type, amount, currency, payment_method, 
-                           payment_status, paid_at, expires_at, invoice_number, 
-                           invoice_type, created_at
-                    FROM orders 
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT id, order_id, plan_type, amount, currency, payment_method, 
-                           payment_status, paid_at, expires_at, invoice_number, 
-                           invoice_type, created_at
-                    FROM orders 
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                """, (user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT id, order_id, plan_type, amount, currency, payment_method, 
+                       payment_status, paid_at, expires_at, invoice_number, 
+                       invoice_type, created_at
+                FROM orders 
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+            """), (user_id,))
             
-            rows = cursor.fetchall()
+            orders = rows_to_dicts(cursor)
             conn.close()
             
-            orders = []
-            for row in rows:
-                orders.append({
-                    "id": row[0],
-                    "order_id": row[1],
-                    "plan_type": row[2],
-                    "amount": row[3],
-                    "currency": row[4],
-                    "payment_method": row[5],
-                    "payment_status": row[6],
-                    "paid_at": row[7],
-                    "expires_at": row[8],
-                    "invoice_number": row[9],
-                    "invoice_type": row[10],
-                    "created_at": row[11]
-                })
-            
             return {"orders": orders}
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
 
     @app.get("/api/user/license/{user_id}")
-    async def get_user_license(user_id: str, current_user_id: Optional[str] = Depends(get_current_user)):
+    def get_user_license(user_id: str, current_user_id: Optional[str] = Depends(get_current_user)):
         """獲取用戶的授權資訊"""
         if current_user_id != user_id:
             return JSONResponse({"error": "無權限訪問此用戶資料"}, status_code=403)
@@ -4481,25 +4577,14 @@ def create_app() -> FastAPI:
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT tier, seats, source, start_at, expires_at, status
-                    FROM licenses 
-                    WHERE user_id = %s AND status = 'active'
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT tier, seats, source, start_at, expires_at, status
-                    FROM licenses 
-                    WHERE user_id = ? AND status = 'active'
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                """, (user_id,))
+            cursor.execute(adapt_sql("""
+                SELECT tier, seats, source, start_at, expires_at, status
+                FROM licenses 
+                WHERE user_id = ? AND status = 'active'
+                ORDER BY created_at DESC
+                LIMIT 1
+            """), (user_id,))
             
             row = cursor.fetchone()
             conn.close()
@@ -4520,59 +4605,43 @@ def create_app() -> FastAPI:
             return JSONResponse({"error": str(e)}, status_code=500)
 
     @app.get("/api/admin/orders")
-    async def get_all_orders():
-        """獲取所有訂單記錄（管理員用）"""
+    def get_all_orders(page_size: int = 100, cursor: Optional[str] = None):
+        """獲取訂單記錄（管理員用）；帶 cursor（上一頁回傳的 next_cursor）時從該筆之後繼續"""
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            _, page_size, _ = resolve_pagination(1, page_size)
+            keyset = None
+            if cursor:
+                keyset = parse_keyset_cursor(cursor)
+                if not keyset:
+                    return JSONResponse({"error": "無效的 cursor"}, status_code=400)
             
-            database_url = os.getenv("DATABASE_URL")
-            use_postgresql = database_url and "postgresql://" in database_url and PSYCOPG2_AVAILABLE
+            conn = get_db_connection()
+            db_cursor = conn.cursor()
+            
+            # keyset：沿 idx_orders_created 索引從上一頁最後一筆之後繼續
+            where_clause = "WHERE (o.created_at, o.id) < (?, ?)" if keyset else ""
+            db_cursor.execute(adapt_sql(f"""
+                SELECT o.id, o.user_id, o.order_id, o.plan_type, o.amount, 
+                       o.currency, o.payment_method, o.payment_status, 
+                       o.paid_at, o.expires_at, o.invoice_number, o.created_at,
+                       COALESCE(NULLIF(ua.name, ''), '未知用戶') AS user_name,
+                       COALESCE(ua.email, '') AS user_email
+                FROM orders o
+                LEFT JOIN user_auth ua ON o.user_id = ua.user_id
+                {where_clause}
+                ORDER BY o.created_at DESC, o.id DESC
+                LIMIT ?
+            """), (*keyset, page_size) if keyset else (page_size,))
+            
+            orders = rows_to_dicts(db_cursor)
             
-            if use_postgresql:
-                cursor.execute("""
-                    SELECT o.id, o.user_id, o.order_id, o.plan_type, o.amount, 
-                           o.currency, o.payment_method, o.payment_status, 
-                           o.paid_at, o.expires_at, o.invoice_number, o.created_at,
-                           ua.name, ua.email
-                    FROM orders o
-                    LEFT JOIN user_auth ua ON o.user_id = ua.user_id
-                    ORDER BY o.created_at DESC
-                    LIMIT 100
-                """)
-            else:
-                cursor.execute("""
-                    SELECT o.id, o.user_id, o.order_id, o.plan_type, o.amount, 
-                           o.currency, o.payment_method, o.payment_status, 
-                           o.paid_at, o.expires_at, o.invoice_number, o.created_at,
-                           ua.name, ua.email
-                    FROM orders o
-                    LEFT JOIN user_auth ua ON o.user_id = ua.user_id
-                    ORDER BY o.created_at DESC
-                    LIMIT 100
-                """)
+            conn.close()
             
-            orders = []
-            for row in cursor.fetchall():
-                orders.append({
-                    "id": row[0],
-                    "user_id": row[1],
-                    "order_id": row[2],
-                    "plan_type": row[3],
-                    "amount": row[4],
-                    "currency": row[5],
-                    "payment_method": row[6],
-                    "payment_status": row[7],
-                    "paid_at": row[8],
-                    "expires_at": row[9],
-                    "invoice_number": row[10],
-                    "created_at": row[11],
-                    "user_name": row[12] or "未知用戶",
-                    "user_email": row[13] or ""
-                })
+            next_cursor = None
+            if len(orders) == page_size:
+                next_cursor = build_keyset_cursor(orders[-1]["created_at"], orders[-1]["id"])
             
-            conn.close()
-            return {"orders": orders}
+            return {"orders": orders, "next_cursor": next_cursor}
         except Exception as e:
             return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -9,14 +9,30 @@ import os
 import json
 import sqlite3
 import asyncio
+import threading
 from datetime import datetime
 from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import google.generativeai as genai
 from knowledge_text_loader import load_knowledge_text, retrieve_context
 
+# orjson 支援（較快的 JSON 序列化，未安裝時退回標準庫 json）
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
+def json_dumps(obj: Any) -> str:
+    """序列化為 JSON 字串（SQLite TEXT 欄位用）"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
 # 環境變數
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
@@ -46,90 +62,129 @@ SYSTEM_PROMPT_TEMPLATE = """你的角色是 AI 短影音顧問。規則：
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
+_model: Optional[genai.GenerativeModel] = None
+
+def get_model() -> genai.GenerativeModel:
+    """取得共用的 GenerativeModel（首次使用時建立，之後重複使用）"""
+    global _model
+    if _model is None:
+        _model = genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
 router = APIRouter()
 
 # ========= 資料庫操作 =========
 
-def get_conn() -> sqlite3.Connection:
-    """取得資料庫連線"""
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+_local = threading.local()
+_indexes_ready = False
 
-def get_session_context(session_id: str) -> Dict[str, Any]:
-    """取得會話上下文"""
-    conn = get_conn()
-    conn.row_factory = sqlite3.Row
+def _ensure_indexes(conn: sqlite3.Connection):
+    """建立最近訊息查詢所需索引（資料表由主系統建立，尚未存在時下次再試）"""
+    global _indexes_ready
+    if _indexes_ready:
+        return
     try:
-        # 取得會話資訊
-        session_row = conn.execute(
-            "SELECT user_id, agent_type, context_summary FROM sessions WHERE session_id = ?",
-            (session_id,)
-        ).fetchone()
-        
-        if not session_row:
-            return {"user_id": None, "agent_type": None, "context_summary": None}
-        
-        # 取得最近 N 筆訊息（控制 token 窗口 ~6k）
-        messages = conn.execute(
-            """SELECT role, content, timestamp FROM messages 
-               WHERE session_id = ? 
-               ORDER BY timestamp DESC 
-               LIMIT 20""",
-            (session_id,)
-        ).fetchall()
-        
-        return {
-            "user_id": session_row["user_id"],
-            "agent_type": session_row["agent_type"],
-            "context_summary": session_row["context_summary"],
-            "messages": [dict(msg) for msg in reversed(messages)]
-        }
-    finally:
-        conn.close()
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_ts ON messages (session_id, timestamp DESC)")
+        _indexes_ready = True
+    except sqlite3.OperationalError as e:
+        print(f"建立 messages 索引失敗: {e}")
+
+def get_conn() -> sqlite3.Connection:
+    """取得資料庫連線（每個執行緒開啟一次後重複使用，WAL 模式讓讀寫互不阻塞）"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.row_factory = sqlite3.Row
+        _ensure_indexes(conn)
+        _local.conn = conn
+    return conn
+
+def get_session_context(session_id: str, msg_limit: int = 10) -> Dict[str, Any]:
+    """取得會話上下文（只取最近 msg_limit 筆訊息）"""
+    conn = get_conn()
+    # 取得會話資訊
+    session_row = conn.execute(
+        "SELECT user_id, agent_type, context_summary FROM sessions WHERE session_id = ?",
+        (session_id,)
+    ).fetchone()
+    
+    if not session_row:
+        return {"user_id": None, "agent_type": None, "context_summary": None}
+    
+    # 取得最近 N 筆訊息（控制 token 窗口 ~6k）
+    messages = conn.execute(
+        """SELECT role, content, timestamp FROM messages 
+           WHERE session_id = ? 
+           ORDER BY timestamp DESC 
+           LIMIT ?""",
+        (session_id, msg_limit)
+    ).fetchall()
+    
+    return {
+        "user_id": session_row["user_id"],
+        "agent_type": session_row["agent_type"],
+        "context_summary": session_row["context_summary"],
+        "messages": [dict(msg) for msg in reversed(messages)]
+    }
 
 def save_message(session_id: str, role: str, content: str, metadata: Dict = None):
     """儲存訊息到資料庫"""
-    conn = get_conn()
-    try:
+    with get_conn() as conn:
         conn.execute(
             "INSERT INTO messages (session_id, role, content, metadata) VALUES (?, ?, ?, ?)",
-            (session_id, role, content, json.dumps(metadata) if metadata else None)
+            (session_id, role, content, json_dumps(metadata) if metadata else None)
         )
-        conn.commit()
-    finally:
-        conn.close()
 
 def update_session_summary(session_id: str, summary: str):
     """更新會話摘要"""
-    conn = get_conn()
-    try:
+    with get_conn() as conn:
         conn.execute(
             "UPDATE sessions SET context_summary = ?, updated_at = CURRENT_TIMESTAMP WHERE session_id = ?",
             (summary, session_id)
         )
-        conn.commit()
-    finally:
-        conn.close()
 
 # ========= 上下文建構 =========
 
-def build_context(session_id: str, user_question: str) -> str:
-    """建構完整的對話上下文"""
+async def save_and_build_context(session_id: str, user_question: str) -> str:
+    """先讀取寫入前的會話上下文，再讓用戶訊息寫入與知識檢索、提示組裝同時進行
+    （皆在執行緒中執行不阻塞事件迴圈；最近對話固定不含本次問題，提示內容不受時序影響）"""
+    context = await asyncio.to_thread(get_session_context, session_id, msg_limit=10)
+    save_task = asyncio.create_task(asyncio.to_thread(save_message, session_id, "user", user_question))
+    try:
+        prompt = await asyncio.to_thread(build_context, session_id, user_question, context)
+    finally:
+        await save_task
+    return prompt
+
+# 保留背景寫入任務的參照，避免尚未完成就被回收
+_pending_writes: set = set()
+
+def save_message_later(session_id: str, role: str, content: str):
+    """不等待寫入完成即返回，避免延遲最後的 [DONE]"""
+    task = asyncio.create_task(asyncio.to_thread(save_message, session_id, role, content))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+def build_context(session_id: str, user_question: str, context: Optional[Dict[str, Any]] = None) -> str:
+    """建構完整的對話上下文（context 可由呼叫端預先讀取傳入）"""
     # 載入知識庫
     load_knowledge_text()
     
     # 取得會話上下文
-    context = get_session_context(session_id)
+    if context is None:
+        context = get_session_context(session_id, msg_limit=10)
     
     # 檢索相關知識片段
     retrieved_context = retrieve_context(user_question, k=5, max_chars=1200)
     
     # 建構最近對話
-    recent_messages = []
-    for msg in context["messages"]:
-        role = "用戶" if msg["role"] == "user" else "助手"
-        recent_messages.append(f"{role}: {msg['content']}")
-    
-    recent_messages_text = "\n".join(recent_messages[-10:])  # 最近10輪對話
+    recent_messages_text = "\n".join(
+        f"{'用戶' if msg['role'] == 'user' else '助手'}: {msg['content']}"
+        for msg in context.get("messages", [])
+    )
     
     # 建構完整提示
     prompt = SYSTEM_PROMPT_TEMPLATE.format(
@@ -143,6 +198,17 @@ def build_context(session_id: str, user_question: str) -> str:
 
 # ========= 串流生成 =========
 
+async def gemini_text_stream(prompt: str):
+    """逐段產生模型輸出的原始文字（SSE / WebSocket 共用）"""
+    model = get_model()
+    
+    # 使用非同步串流，等待下一段輸出時不阻塞事件迴圈
+    response = await model.generate_content_async(prompt, stream=True)
+    
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
 async def generate_stream_response(prompt: str):
     """生成串流回應"""
     if not GEMINI_API_KEY:
@@ -150,20 +216,35 @@ async def generate_stream_response(prompt: str):
         return
     
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        
-        # 使用 generate_content 的 stream 功能
-        response = model.generate_content(prompt, stream=True)
-        
-        for chunk in response:
-            if chunk.text:
-                yield f"data: {chunk.text}\n\n"
+        async for text in gemini_text_stream(prompt):
+            yield f"data: {text}\n\n"
         
         yield "data: [DONE]\n\n"
         
     except Exception as e:
         yield f"data: 錯誤：{str(e)}\n\n"
 
+SSE_PING_INTERVAL = float(os.getenv("SSE_PING_INTERVAL", "15"))
+
+async def sse_with_keepalive(frames, interval: float = SSE_PING_INTERVAL):
+    """在模型長時間沒有輸出時送出 SSE 註解行，避免代理伺服器因閒置而斷線"""
+    it = frames.__aiter__()
+    next_frame = asyncio.ensure_future(it.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_frame}, timeout=interval)
+            if not done:
+                yield ": ping\n\n"
+                continue
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+            next_frame = asyncio.ensure_future(it.__anext__())
+    finally:
+        next_frame.cancel()
+
 async def generate_websocket_response(websocket: WebSocket, prompt: str):
     """生成 WebSocket 回應"""
     if not GEMINI_API_KEY:
@@ -171,12 +252,8 @@ async def generate_websocket_response(websocket: WebSocket, prompt: str):
         return
     
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(prompt, stream=True)
-        
-        for chunk in response:
-            if chunk.text:
-                await websocket.send_text(chunk.text)
+        async for text in gemini_text_stream(prompt):
+            await websocket.send_text(text)
         
         await websocket.send_text("[DONE]")
         
@@ -185,11 +262,14 @@ async def generate_websocket_response(websocket: WebSocket, prompt: str):
 
 # ========= 背景任務 =========
 
-def summarize_conversation(session_id: str, user_question: str, assistant_response: str):
+# 限制同時進行的非串流 Gemini 呼叫數，避免總結等工作擠占即時串流
+_GEMINI_SEM = asyncio.Semaphore(int(os.getenv("GEMINI_CONCURRENCY", "8")))
+
+async def summarize_conversation(session_id: str, user_question: str, assistant_response: str):
     """背景任務：總結對話"""
     try:
         # 取得會話上下文
-        context = get_session_context(session_id)
+        context = await asyncio.to_thread(get_session_context, session_id, 6)
         messages = context["messages"]
         
         # 建構總結提示
@@ -198,7 +278,7 @@ def summarize_conversation(session_id: str, user_question: str, assistant_respon
 歷史摘要：{context['context_summary'] or '無'}
 
 最近對話：
-{chr(10).join([f"{msg['role']}: {msg['content']}" for msg in messages[-6:]])}
+{chr(10).join([f"{msg['role']}: {msg['content']}" for msg in messages])}
 
 最新一輪：
 用戶: {user_question}
@@ -207,35 +287,65 @@ def summarize_conversation(session_id: str, user_question: str, assistant_respon
 請提供簡潔的對話摘要："""
 
         if GEMINI_API_KEY:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            response = model.generate_content(summary_prompt)
+            async with _GEMINI_SEM:
+                response = await get_model().generate_content_async(summary_prompt)
             summary = response.text.strip()[:400]  # 限制長度
             
             # 更新會話摘要
-            update_session_summary(session_id, summary)
+            await asyncio.to_thread(update_session_summary, session_id, summary)
             
     except Exception as e:
         print(f"總結對話時發生錯誤: {e}")
 
-def create_turn_summary(user_question: str, assistant_response: str) -> str:
-    """創建本輪對話摘要（≤120字）"""
-    try:
-        summary_prompt = f"""請為以下對話創建簡短摘要（不超過120字）：
+SUMMARY_QUEUE_MAXSIZE = int(os.getenv("SUMMARY_QUEUE_MAXSIZE", "256"))
 
-用戶: {user_question}
-助手: {assistant_response}
+# 待總結的會話：同一會話只保留最新一輪，worker 取出時才讀取
+_summary_queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=SUMMARY_QUEUE_MAXSIZE)
+_pending_summaries: Dict[str, tuple] = {}
 
-摘要："""
+def enqueue_summary(session_id: str, user_question: str, assistant_response: str):
+    """排入總結佇列；會話已在佇列中時只更新內容，不重複呼叫模型"""
+    if session_id in _pending_summaries:
+        _pending_summaries[session_id] = (user_question, assistant_response)
+        return
+    try:
+        _summary_queue.put_nowait(session_id)
+    except asyncio.QueueFull:
+        print(f"總結佇列已滿，略過會話 {session_id}")
+        return
+    _pending_summaries[session_id] = (user_question, assistant_response)
+
+async def _summary_worker():
+    """單一背景 worker：依序總結佇列中的會話"""
+    while True:
+        session_id = await _summary_queue.get()
+        try:
+            pending = _pending_summaries.pop(session_id, None)
+            if pending:
+                await summarize_conversation(session_id, *pending)
+        except Exception as e:
+            print(f"總結對話時發生錯誤: {e}")
+        finally:
+            _summary_queue.task_done()
+
+@router.on_event("startup")
+async def start_summary_worker():
+    """啟動對話總結背景 worker"""
+    router.summary_task = asyncio.create_task(_summary_worker())
+
+@router.on_event("shutdown")
+async def stop_summary_worker():
+    """停止對話總結背景 worker"""
+    task = getattr(router, "summary_task", None)
+    if task is not None:
+        task.cancel()
 
-        if GEMINI_API_KEY:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            response = model.generate_content(summary_prompt)
-            return response.text.strip()[:120]
-        
-        return f"用戶詢問：{user_question[:50]}..."
-        
-    except Exception as e:
+def create_turn_summary(user_question: str, assistant_response: str) -> str:
+    """創建本輪對話摘要（≤120字），直接取回答開頭，不再額外呼叫模型"""
+    answer = " ".join(assistant_response.split())
+    if not answer:
         return f"用戶詢問：{user_question[:50]}..."
+    return answer[:120]
 
 # ========= API 端點 =========
 
@@ -246,32 +356,37 @@ async def stream_chat(
 ):
     """SSE 串流聊天端點"""
     
-    # 儲存用戶訊息
-    save_message(session_id, "user", q)
-    
-    # 建構上下文
-    prompt = build_context(session_id, q)
+    # 儲存用戶訊息並建構上下文
+    prompt = await save_and_build_context(session_id, q)
     
     # 生成回應
     async def generate():
-        full_response = ""
-        async for chunk in generate_stream_response(prompt):
-            if chunk.startswith("data: ") and not chunk.startswith("data: [DONE]"):
-                content = chunk[6:].strip()
-                if content and not content.startswith("錯誤："):
-                    full_response += content
-            yield chunk
+        if not GEMINI_API_KEY:
+            yield "data: 錯誤：未設定 GEMINI_API_KEY\n\n"
+            return
+        
+        # 直接累積原始文字，不再從 SSE 框架反解析
+        parts: List[str] = []
+        try:
+            async for text in gemini_text_stream(prompt):
+                parts.append(text)
+                yield f"data: {text}\n\n"
+            yield "data: [DONE]\n\n"
+        except Exception as e:
+            yield f"data: 錯誤：{str(e)}\n\n"
         
         # 儲存助手回應
+        full_response = "".join(parts)
         if full_response:
-            save_message(session_id, "assistant", full_response)
+            save_message_later(session_id, "assistant", full_response)
     
     return StreamingResponse(
-        generate(),
+        sse_with_keepalive(generate()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*",
         }
@@ -286,7 +401,7 @@ async def websocket_chat(websocket: WebSocket):
         while True:
             # 接收訊息
             data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = json_loads(data)
             
             session_id = message_data.get("session_id")
             user_question = message_data.get("q")
@@ -295,24 +410,28 @@ async def websocket_chat(websocket: WebSocket):
                 await websocket.send_text("錯誤：缺少必要參數")
                 continue
             
-            # 儲存用戶訊息
-            save_message(session_id, "user", user_question)
-            
-            # 建構上下文
-            prompt = build_context(session_id, user_question)
+            # 儲存用戶訊息並建構上下文
+            prompt = await save_and_build_context(session_id, user_question)
             
             # 生成回應
-            full_response = ""
-            async for chunk in generate_stream_response(prompt):
-                if chunk.startswith("data: ") and not chunk.startswith("data: [DONE]"):
-                    content = chunk[6:].strip()
-                    if content and not content.startswith("錯誤："):
-                        full_response += content
-                        await websocket.send_text(content)
+            if not GEMINI_API_KEY:
+                await websocket.send_text("錯誤：未設定 GEMINI_API_KEY")
+                continue
+            
+            parts: List[str] = []
+            try:
+                async for text in gemini_text_stream(prompt):
+                    parts.append(text)
+                    await websocket.send_text(text)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_text(f"錯誤：{str(e)}")
             
             # 儲存助手回應
+            full_response = "".join(parts)
             if full_response:
-                save_message(session_id, "assistant", full_response)
+                save_message_later(session_id, "assistant", full_response)
             
     except WebSocketDisconnect:
         pass
@@ -329,37 +448,26 @@ class ChatResponse(BaseModel):
     turn_summary: str
 
 @router.post("/api/chat", response_model=ChatResponse)
-async def chat(
-    request: ChatRequest,
-    background_tasks: BackgroundTasks
-):
+async def chat(request: ChatRequest):
     """非串流聊天端點"""
     
-    # 儲存用戶訊息
-    save_message(request.session_id, "user", request.q)
-    
-    # 建構上下文
-    prompt = build_context(request.session_id, request.q)
+    # 儲存用戶訊息並建構上下文
+    prompt = await save_and_build_context(request.session_id, request.q)
     
     # 生成回應
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="未設定 GEMINI_API_KEY")
     
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(prompt)
+        async with _GEMINI_SEM:
+            response = await get_model().generate_content_async(prompt)
         answer = response.text.strip()
         
         # 儲存助手回應
         save_message(request.session_id, "assistant", answer)
         
-        # 背景任務：總結對話
-        background_tasks.add_task(
-            summarize_conversation, 
-            request.session_id, 
-            request.q, 
-            answer
-        )
+        # 排入總結佇列（同一會話只總結最新一輪）
+        enqueue_summary(request.session_id, request.q, answer)
         
         # 創建本輪摘要
         turn_summary = create_turn_summary(request.q, answer)
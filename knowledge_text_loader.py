@@ -3,6 +3,7 @@
 Simple knowledge text loader + retriever
 - Reads from env KNOWLEDGE_TXT_PATH (default: /data/kb.txt)
 - If not found, will try to concatenate /data/kb*.txt and /data/*.txt
+- Caches chunks + index under env KB_INDEX_CACHE_DIR (default: /data/.kb_cache), keyed by text hash
 - Provides:
     load_knowledge_text(force: bool=False) -> str
     retrieve_context(query: str, k: int=3, max_chars: int=1200) -> str
@@ -10,15 +11,19 @@ Designed to be dependency-free (pure Python).
 """
 
 import os
-import glob
+import hashlib
+import json
 import re
 import math
+import heapq
+from array import array
+from collections import Counter
+from functools import lru_cache
 from typing import List, Tuple
 
 _KB_CACHE_TEXT: str = ""
 _KB_CACHE_CHUNKS: List[str] = []
-_KB_CACHE_TFIDF: dict = {}
-_KB_CACHE_DF: dict = {}
+_KB_CACHE_POSTINGS: dict = {}  # token -> (array('i') chunk indices, array('d') tf * idf)
 _KB_CACHE_READY: bool = False
 
 # ---------- File loading ----------
@@ -34,6 +39,18 @@ def _read_file(path: str) -> str:
         except Exception:
             return ""
 
+def _list_txt_files(directory: str, prefix: str = "") -> List[str]:
+    """Sorted paths of visible *.txt files directly under directory."""
+    try:
+        with os.scandir(directory) as it:
+            return sorted(
+                e.path for e in it
+                if e.name.endswith(".txt") and e.name.startswith(prefix)
+                and not e.name.startswith(".") and e.is_file()
+            )
+    except OSError:
+        return []
+
 def _gather_all_text() -> str:
     """Try the env path first; if not found, concatenate candidates under /data."""
     env_path = os.getenv("KNOWLEDGE_TXT_PATH", "/data/kb.txt")
@@ -42,18 +59,19 @@ def _gather_all_text() -> str:
         if t.strip():
             return t
 
+    # prefer kb*.txt first (nested dir, then /data), then the remaining /data/*.txt;
+    # one directory scan per dir, and each file is read once
+    data_txt = _list_txt_files("/data")
+    paths = _list_txt_files("/data/data", prefix="kb")
+    paths += [p for p in data_txt if os.path.basename(p).startswith("kb")]
+    paths += [p for p in data_txt if not os.path.basename(p).startswith("kb")]
+
     buf = []
-    # prefer kb*.txt first, including nested directories
-    for pattern in ("/data/data/kb*.txt", "/data/kb*.txt", "/data/*.txt"):
-        for p in sorted(glob.glob(pattern)):
-            try:
-                # skip obviously non-knowledge files
-                base = os.path.basename(p).lower()
-                if base.endswith(".csv"):
-                    continue
-                buf.append(_read_file(p))
-            except Exception:
-                pass
+    for p in paths:
+        try:
+            buf.append(_read_file(p))
+        except Exception:
+            pass
     return "\n\n".join(x for x in buf if x)
 
 # ---------- Text chunking ----------
@@ -69,7 +87,7 @@ def _chunk_text(t: str, target_size: int = 350, max_size: int = 600) -> List[str
         return []
 
     # first split by “大段落”標記
-    rough = re.split(_SPLIT_RULE, t)
+    rough = _SPLIT_RULE.split(t)
     parts = []
     for seg in rough:
         seg = (seg or "").strip()
@@ -105,68 +123,100 @@ def _chunk_text(t: str, target_size: int = 350, max_size: int = 600) -> List[str
 
 # ---------- Tokenization & TF-IDF ----------
 
-_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
-_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+# english/number words, or single cjk characters — one C-level scan
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[\u4e00-\u9fff]")
 
 def _tokenize(text: str) -> List[str]:
-    text = (text or "").lower()
-    tokens = []
-    # english/number words
-    tokens.extend(_WORD_RE.findall(text))
-    # cjk characters (single char granularity)
-    tokens.extend([ch for ch in text if _CJK_RE.match(ch)])
-    # remove trivial tokens
-    return [t for t in tokens if len(t) >= 1]
+    return _TOKEN_RE.findall((text or "").lower())
 
 def _build_tfidf(chunks: List[str]):
-    global _KB_CACHE_TFIDF, _KB_CACHE_DF
-    _KB_CACHE_TFIDF = {}
-    _KB_CACHE_DF = {}
+    """Build an inverted index so a query only touches chunks containing its tokens."""
+    global _KB_CACHE_POSTINGS
     N = len(chunks) or 1
 
-    # document frequency
-    for idx, c in enumerate(chunks):
-        seen = set(_tokenize(c))
-        for tok in seen:
-            _KB_CACHE_DF[tok] = _KB_CACHE_DF.get(tok, 0) + 1
-
-    # per-chunk tf
-    for idx, c in enumerate(chunks):
-        tf = {}
-        for tok in _tokenize(c):
-            tf[tok] = tf.get(tok, 0) + 1
-        _KB_CACHE_TFIDF[idx] = tf
-
-    # store idf inside DF map (just reuse structure)
-    for tok, df in _KB_CACHE_DF.items():
-        _KB_CACHE_DF[tok] = math.log((1 + N) / (1 + df)) + 1.0
-
-def _score_chunk(idx: int, query_tokens: List[str]) -> float:
-    tf = _KB_CACHE_TFIDF.get(idx, {})
-    score = 0.0
-    for tok in query_tokens:
-        if tok in tf:
-            idf = _KB_CACHE_DF.get(tok, 1.0)
-            score += tf[tok] * idf
-    return score
+    # per-chunk tf (each chunk tokenized once)
+    tfs: List[Counter] = [Counter(_tokenize(c)) for c in chunks]
+
+    # document frequency (each chunk's tf keys are its distinct tokens)
+    df = Counter()
+    for tf in tfs:
+        df.update(tf.keys())
+
+    idf = {tok: math.log((1 + N) / (1 + d)) + 1.0 for tok, d in df.items()}
+    # parallel typed arrays per token: compact and contiguous instead of a list of tuples
+    postings = {}
+    for idx, tf in enumerate(tfs):
+        for tok, count in tf.items():
+            entry = postings.get(tok)
+            if entry is None:
+                entry = postings[tok] = (array("i"), array("d"))
+            entry[0].append(idx)
+            entry[1].append(count * idf[tok])
+    _KB_CACHE_POSTINGS = postings
+
+# ---------- Index cache on disk ----------
+
+_INDEX_CACHE_DIR = os.getenv("KB_INDEX_CACHE_DIR", "/data/.kb_cache")
+_INDEX_CACHE_VERSION = 2  # bump when the postings layout changes
+
+def _index_cache_path(key: str) -> str:
+    return os.path.join(_INDEX_CACHE_DIR, f"{key}.v{_INDEX_CACHE_VERSION}.json")
+
+def _load_index_cache(key: str):
+    """Return (chunks, postings) saved for this exact source text, or None."""
+    try:
+        with open(_index_cache_path(key), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        postings = {
+            tok: (array("i", idxs), array("d", weights))
+            for tok, (idxs, weights) in data["postings"].items()
+        }
+        return data["chunks"], postings
+    except Exception:
+        return None
+
+def _save_index_cache(key: str, chunks: List[str], postings: dict):
+    """Best-effort: a read-only or missing data dir just means rebuilding next start."""
+    try:
+        os.makedirs(_INDEX_CACHE_DIR, exist_ok=True)
+        tmp_path = _index_cache_path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "chunks": chunks,
+                "postings": {tok: [idxs.tolist(), weights.tolist()] for tok, (idxs, weights) in postings.items()},
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, _index_cache_path(key))
+    except Exception:
+        pass
 
 # ---------- Public APIs ----------
 
 def load_knowledge_text(force: bool = False) -> str:
     """Load raw text and build chunk/tfidf cache on first call or when force=True."""
-    global _KB_CACHE_TEXT, _KB_CACHE_CHUNKS, _KB_CACHE_READY
+    global _KB_CACHE_TEXT, _KB_CACHE_CHUNKS, _KB_CACHE_POSTINGS, _KB_CACHE_READY
     if _KB_CACHE_READY and not force:
         return _KB_CACHE_TEXT
 
     text = _gather_all_text()
     _KB_CACHE_TEXT = text
-    _KB_CACHE_CHUNKS = _chunk_text(text)
-    _build_tfidf(_KB_CACHE_CHUNKS)
+    # reuse the chunks/index built for identical text on a previous start
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    cached = _load_index_cache(key)
+    if cached:
+        _KB_CACHE_CHUNKS, _KB_CACHE_POSTINGS = cached
+    else:
+        _KB_CACHE_CHUNKS = _chunk_text(text)
+        _build_tfidf(_KB_CACHE_CHUNKS)
+        _save_index_cache(key, _KB_CACHE_CHUNKS, _KB_CACHE_POSTINGS)
     _KB_CACHE_READY = True
+    # index changed: drop memoized retrieval results
+    retrieve_context.cache_clear()
     return _KB_CACHE_TEXT
 
+@lru_cache(maxsize=1024)
 def retrieve_context(query: str, k: int = 3, max_chars: int = 1200) -> str:
-    """Return top-k relevant chunks (TF-IDF) concatenated, capped by max_chars."""
+    """Return top-k relevant chunks (TF-IDF) concatenated, capped by max_chars.
+    Results are memoized per (query, k, max_chars) until the index is rebuilt."""
     if not _KB_CACHE_READY:
         load_knowledge_text(force=False)
 
@@ -177,17 +227,22 @@ def retrieve_context(query: str, k: int = 3, max_chars: int = 1200) -> str:
     if not q_tokens:
         return ""
 
-    scores: List[Tuple[float, int]] = []
-    for idx in range(len(_KB_CACHE_CHUNKS)):
-        s = _score_chunk(idx, q_tokens)
-        if s > 0:
-            scores.append((s, idx))
+    # accumulate tf-idf only over the postings of the query tokens
+    scores = {}
+    for tok in q_tokens:
+        entry = _KB_CACHE_POSTINGS.get(tok)
+        if entry is None:
+            continue
+        for idx, weight in zip(*entry):
+            scores[idx] = scores.get(idx, 0.0) + weight
 
-    # sort by score desc
-    scores.sort(key=lambda x: x[0], reverse=True)
+    # top-k by score desc (ties keep document order)
+    top: List[Tuple[int, float]] = heapq.nsmallest(
+        max(1, k), scores.items(), key=lambda item: (-item[1], item[0])
+    )
     picked = []
     used = 0
-    for _, idx in scores[: max(1, k)]:
+    for idx, _ in top:
         chunk = _KB_CACHE_CHUNKS[idx]
         if used + len(chunk) + 2 > max_chars:
             remain = max_chars - used
@@ -1,15 +1,27 @@
 import sqlite3
 import json
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional
 
 class MemoryManager:
     def __init__(self, db_path: str = "db.sqlite3"):
         self.db_path = db_path
+        self._local = threading.local()
         self.init_db()
     
+    def _conn(self) -> sqlite3.Connection:
+        """每個執行緒開啟一次連線後重複使用（`with` 區塊只負責提交交易，不會關閉連線）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -19,6 +31,9 @@ class MemoryManager:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages (user_id, created_at DESC)"
+            )
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS summaries (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,16 +42,19 @@ class MemoryManager:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_summaries_user_created ON summaries (user_id, created_at DESC)"
+            )
     
     def add_message(self, user_id: str, role: str, content: str):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             conn.execute(
                 "INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)",
                 (user_id, role, content)
             )
     
     def get_recent_messages(self, user_id: str, limit: int = 20) -> List[Dict]:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.execute(
                 "SELECT role, content FROM messages WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
                 (user_id, limit)
@@ -45,7 +63,7 @@ class MemoryManager:
             return list(reversed(messages))
     
     def get_summary(self, user_id: str) -> Optional[str]:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.execute(
                 "SELECT content FROM summaries WHERE user_id = ? ORDER BY created_at DESC LIMIT 1",
                 (user_id,)
@@ -54,14 +72,14 @@ class MemoryManager:
             return row[0] if row else None
     
     def update_summary(self, user_id: str, content: str):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             conn.execute(
                 "INSERT INTO summaries (user_id, content) VALUES (?, ?)",
                 (user_id, content)
             )
     
     def should_summarize(self, user_id: str) -> bool:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.execute(
                 "SELECT COUNT(*) FROM messages WHERE user_id = ?",
                 (user_id,)
@@ -5,10 +5,14 @@ AI Points Integration - 點數系統整合到主應用
 
 from fastapi import FastAPI
 from points_routes import register_points_routes
-from points_system import points_system
+from points_system import points_system, PointReason
 import asyncio
+import logging
+import time
 from datetime import datetime, timedelta
 
+log = logging.getLogger("points")
+
 def integrate_points_system(app: FastAPI):
     """整合點數系統到主應用"""
     
@@ -19,7 +23,7 @@ def integrate_points_system(app: FastAPI):
     app.add_event_handler("startup", start_points_scheduler)
     app.add_event_handler("shutdown", stop_points_scheduler)
     
-    print("AI Points System integrated successfully")
+    log.info("AI Points System integrated successfully")
 
 # 定時任務相關
 scheduler_task = None
@@ -28,7 +32,7 @@ async def start_points_scheduler():
     """啟動點數系統定時任務"""
     global scheduler_task
     scheduler_task = asyncio.create_task(daily_points_tasks())
-    print("Points system scheduler started")
+    log.info("Points system scheduler started")
 
 async def stop_points_scheduler():
     """停止點數系統定時任務"""
@@ -39,7 +43,13 @@ async def stop_points_scheduler():
             await scheduler_task
         except asyncio.CancelledError:
             pass
-    print("Points system scheduler stopped")
+    log.info("Points system scheduler stopped")
+
+# 上次每日任務執行時間（存於 system_meta，重啟後仍可避免重複執行）
+DAILY_TASKS_META_KEY = "last_daily_points_tasks_at"
+DAILY_TASKS_MIN_INTERVAL = 22 * 3600
+# 長時間等待切成多段，取消與時鐘調整都能較快反應
+SCHEDULER_MAX_SLEEP = 3600
 
 async def daily_points_tasks():
     """每日定時任務"""
@@ -51,26 +61,35 @@ async def daily_points_tasks():
             if next_run <= now:
                 next_run += timedelta(days=1)
             
-            wait_seconds = (next_run - now).total_seconds()
-            await asyncio.sleep(wait_seconds)
+            while True:
+                wait_seconds = (next_run - datetime.now()).total_seconds()
+                if wait_seconds <= 0:
+                    break
+                await asyncio.sleep(min(wait_seconds, SCHEDULER_MAX_SLEEP))
+            
+            # 距上次執行未滿 22 小時（例如重啟後再次到點）則略過
+            last_run = await asyncio.to_thread(points_system.get_meta, DAILY_TASKS_META_KEY)
+            if last_run and time.time() - float(last_run) < DAILY_TASKS_MIN_INTERVAL:
+                continue
             
             # 執行每日任務
             await execute_daily_tasks()
+            await asyncio.to_thread(points_system.set_meta, DAILY_TASKS_META_KEY, str(time.time()))
             
         except asyncio.CancelledError:
             break
         except Exception as e:
-            print(f"Daily points task error: {e}")
+            log.exception("Daily points task error: %s", e)
             # 出錯時等待1小時再重試
             await asyncio.sleep(3600)
 
 async def execute_daily_tasks():
     """執行每日任務"""
     try:
-        print(f"Executing daily points tasks at {datetime.now()}")
+        log.info("Executing daily points tasks at %s", datetime.now())
         
-        # 1. 到期清理
-        points_system.expire_sweep()
+        # 1. 到期清理（在執行緒中執行，不阻塞事件迴圈）
+        await asyncio.to_thread(points_system.expire_sweep)
         
         # 2. 月贈點（如果需要）
         await grant_monthly_points()
@@ -78,10 +97,10 @@ async def execute_daily_tasks():
         # 3. 發送到期提醒（如果需要）
         await send_expiration_notifications()
         
-        print("Daily points tasks completed")
+        log.info("Daily points tasks completed")
         
     except Exception as e:
-        print(f"Error executing daily tasks: {e}")
+        log.exception("Error executing daily tasks: %s", e)
 
 async def grant_monthly_points():
     """發放月贈點"""
@@ -90,7 +109,7 @@ async def grant_monthly_points():
         # 檢查有效訂閱用戶並發放月贈點
         pass
     except Exception as e:
-        print(f"Error granting monthly points: {e}")
+        log.exception("Error granting monthly points: %s", e)
 
 async def send_expiration_notifications():
     """發送到期提醒"""
@@ -99,7 +118,7 @@ async def send_expiration_notifications():
         # 提醒用戶點數即將到期
         pass
     except Exception as e:
-        print(f"Error sending expiration notifications: {e}")
+        log.exception("Error sending expiration notifications: %s", e)
 
 # 中間件：自動扣點
 async def points_middleware(request, call_next):
@@ -112,13 +131,12 @@ async def points_middleware(request, call_next):
     return response
 
 # 工具函數
-def add_points_to_user(user_id: str, points: int, reason: str = "gift"):
+def add_points_to_user(user_id: str, points: int, reason: PointReason = PointReason.GIFT):
     """為用戶添加點數（管理員用）"""
-    from points_system import PointReason
     points_system.add_points(
         user_id=user_id,
         points=points,
-        reason=PointReason(reason),
+        reason=reason,
         ref_id="admin_gift"
     )
 
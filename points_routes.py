@@ -3,20 +3,45 @@ AI Points API Routes - 點數系統API路由
 新增 /points/* 和 /plans/* 命名空間，不影響既有路由
 """
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
+import asyncio
 import json
+import logging
+from itsdangerous import BadSignature
 from points_system import points_system, PointReason
 
+# orjson 支援（較快的 JSON 序列化，未安裝時退回標準庫 json）
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+DefaultResponse = ORJSONResponse if ORJSON_AVAILABLE else JSONResponse
+json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
+# 點數系統共用的 logger（points_integration 亦使用同名 logger）
+# uvicorn 不會替 root logger 設定輸出，因此自行掛上 handler，與 app.py 的 "INFO: ..." 輸出格式一致
+log = logging.getLogger("points")
+if not log.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s: [points] %(message)s"))
+    log.addHandler(_log_handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
 # 創建路由器
-points_router = APIRouter(prefix="/points", tags=["points"])
-plans_router = APIRouter(prefix="/plans", tags=["plans"])
+points_router = APIRouter(prefix="/points", tags=["points"], default_response_class=DefaultResponse)
+plans_router = APIRouter(prefix="/plans", tags=["plans"], default_response_class=DefaultResponse)
 
 # 請求模型
 class AuthorizeRequest(BaseModel):
     module: str  # '定位'|'選題'|'腳本'
-    mode: str    # 'oneclick'|'chat'
+    mode: Literal["oneclick", "chat"]
     count: int
 
 class CheckoutRequest(BaseModel):
@@ -25,7 +50,7 @@ class CheckoutRequest(BaseModel):
 class ConsumeRequest(BaseModel):
     usage_id: str
     module: str
-    mode: str
+    mode: Literal["oneclick", "chat"]
     count: int
     points: int
 
@@ -66,32 +91,87 @@ class CheckoutResponse(BaseModel):
     amount: int
     points: int
 
-# ========== 點數系統路由 ==========
+# ========== 輔助函數 ==========
+
+_session_signer = None
+_session_signer_resolved = False
+
+def _get_session_signer():
+    """取得主應用的 session_signer（只解析一次；主應用未提供時為 None）"""
+    global _session_signer, _session_signer_resolved
+    if not _session_signer_resolved:
+        try:
+            from app import session_signer
+            _session_signer = session_signer
+        except ImportError:
+            _session_signer = None
+        _session_signer_resolved = True
+    return _session_signer
+
+def get_user_id_from_request(req: Request) -> Optional[str]:
+    """從請求中獲取用戶ID（配合現有認證系統）"""
+    # 方法1: 從session cookie
+    session_cookie = req.cookies.get("session")
+    if session_cookie:
+        signer = _get_session_signer()
+        if signer is not None:
+            try:
+                data = signer.loads(session_cookie)
+                # 後端使用 'uid' 作為用戶ID的鍵
+                return data.get("uid")
+            except BadSignature:
+                pass
+    
+    # 方法2: 從Authorization header
+    auth_header = req.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        token = auth_header.split(" ")[1]
+        # 這裡需要根據您的JWT實現解析token
+        pass
+    
+    # 方法3: 從查詢參數（臨時方案）
+    return req.query_params.get("user_id")
 
-@points_router.get("/wallet", response_model=WalletResponse)
-async def get_wallet(req: Request):
-    """獲取錢包資訊"""
-    # 從請求中獲取用戶ID（需要根據您的認證系統調整）
+def get_current_user_id(req: Request) -> str:
+    """FastAPI 依賴：取得登入用戶ID，未登入時直接回 401"""
     user_id = get_user_id_from_request(req)
     if not user_id:
         raise HTTPException(status_code=401, detail="未登入")
-    
+    return user_id
+
+def check_admin_permission(req: Request) -> bool:
+    """檢查管理員權限（配合現有管理員系統）"""
+    import os
+    admin_token = req.headers.get("x-admin-token")
+    expected_token = os.getenv("ADMIN_TOKEN")
+    return admin_token == expected_token
+
+# ========== 點數系統路由 ==========
+
+@points_router.get("/wallet", responses={200: {"model": WalletResponse}})
+def get_wallet(user_id: str = Depends(get_current_user_id)):
+    """獲取錢包資訊（WalletResponse 欄位）"""
     wallet_info = points_system.get_wallet_info(user_id)
-    return WalletResponse(**wallet_info)
+    return DefaultResponse(wallet_info)
 
-@points_router.get("/packs", response_model=List[PackResponse])
-async def get_point_packs():
-    """獲取點數包列表"""
+@points_router.get("/packs", responses={200: {"model": List[PackResponse]}})
+def get_point_packs():
+    """獲取點數包列表（欄位同 PackResponse，直接序列化不經 jsonable_encoder）"""
     packs = points_system.get_point_packs()
-    return [PackResponse(**pack.__dict__) for pack in packs]
+    return DefaultResponse([
+        {
+            "pack_id": pack.pack_id,
+            "name": pack.name,
+            "points": pack.points,
+            "price_ntd": pack.price_ntd,
+            "valid_days": pack.valid_days,
+        }
+        for pack in packs
+    ])
 
-@points_router.post("/authorize", response_model=AuthorizeResponse)
-async def authorize_usage(req: Request, request: AuthorizeRequest):
-    """授權使用（不扣點，只判斷）"""
-    user_id = get_user_id_from_request(req)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="未登入")
-    
+@points_router.post("/authorize", responses={200: {"model": AuthorizeResponse}})
+def authorize_usage(request: AuthorizeRequest, user_id: str = Depends(get_current_user_id)):
+    """授權使用（不扣點，只判斷；AuthorizeResponse 欄位）"""
     result = points_system.authorize_usage(
         user_id=user_id,
         module=request.module,
@@ -99,29 +179,21 @@ async def authorize_usage(req: Request, request: AuthorizeRequest):
         count=request.count
     )
     
-    return AuthorizeResponse(**result)
+    return DefaultResponse(result)
 
-@points_router.post("/checkout", response_model=CheckoutResponse)
-async def create_checkout(req: Request, request: CheckoutRequest):
-    """創建點數包訂單"""
-    user_id = get_user_id_from_request(req)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="未登入")
-    
+@points_router.post("/checkout", responses={200: {"model": CheckoutResponse}})
+def create_checkout(request: CheckoutRequest, user_id: str = Depends(get_current_user_id)):
+    """創建點數包訂單（CheckoutResponse 欄位）"""
     result = points_system.create_checkout(user_id, request.pack_id)
     
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
     
-    return CheckoutResponse(**result)
+    return DefaultResponse(result)
 
 @points_router.post("/consume")
-async def consume_points(req: Request, request: ConsumeRequest):
+def consume_points(request: ConsumeRequest, user_id: str = Depends(get_current_user_id)):
     """實際扣點（在既有流程完成後調用）"""
-    user_id = get_user_id_from_request(req)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="未登入")
-    
     success = points_system.consume_points(
         user_id=user_id,
         module=request.module,
@@ -132,29 +204,27 @@ async def consume_points(req: Request, request: ConsumeRequest):
     if not success:
         raise HTTPException(status_code=400, detail="餘額不足")
     
-    return {"success": True}
+    return DefaultResponse({"success": True})
 
 @points_router.patch("/settings")
-async def update_settings(req: Request, request: SettingsRequest):
+def update_settings(request: SettingsRequest, user_id: str = Depends(get_current_user_id)):
     """更新自動補點設定"""
-    user_id = get_user_id_from_request(req)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="未登入")
-    
     points_system.toggle_auto_topup(
         user_id=user_id,
         enabled=request.auto_topup_enabled,
         pack_id=request.auto_topup_pack_id
     )
     
-    return {"success": True}
+    return DefaultResponse({"success": True})
 
 @points_router.post("/webhooks/payment")
 async def payment_webhook(req: Request):
     """金流回調（需要根據實際金流提供商調整）"""
     try:
         # 這裡需要根據實際金流提供商實現驗簽和冪等性檢查
-        body = await req.json()
+        # 保留原始 bytes，之後驗簽可直接對 raw 計算 HMAC
+        raw = await req.body()
+        body = json_loads(raw)
         
         # 假設金流回調包含 order_id
         order_id = body.get("order_id")
@@ -162,28 +232,40 @@ async def payment_webhook(req: Request):
             raise HTTPException(status_code=400, detail="缺少訂單ID")
         
         # 處理付款
-        success = points_system.process_payment(order_id, "webhook")
+        success = await asyncio.to_thread(points_system.process_payment, order_id, "webhook")
         
         if not success:
             raise HTTPException(status_code=400, detail="處理付款失敗")
         
-        return {"success": True}
+        return DefaultResponse({"success": True})
         
+    except HTTPException:
+        raise
     except Exception as e:
+        log.exception("Payment webhook failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== 方案系統路由 ==========
 
-@plans_router.get("/list", response_model=List[PlanResponse])
-async def get_plans():
-    """獲取訂閱方案列表（只讀）"""
+@plans_router.get("/list", responses={200: {"model": List[PlanResponse]}})
+def get_plans():
+    """獲取訂閱方案列表（只讀，欄位同 PlanResponse）"""
     plans = points_system.get_plans()
-    return [PlanResponse(**plan.__dict__) for plan in plans]
+    return DefaultResponse([
+        {
+            "plan_id": plan.plan_id,
+            "name": plan.name,
+            "monthly_points": plan.monthly_points,
+            "batch_limit": plan.batch_limit,
+            "roles_limit": plan.roles_limit,
+        }
+        for plan in plans
+    ])
 
 # ========== 管理員路由 ==========
 
 @points_router.post("/admin/add-points")
-async def admin_add_points(req: Request, user_id: str, points: int, reason: str = "gift"):
+def admin_add_points(req: Request, user_id: str, points: int, reason: str = "gift"):
     """管理員添加點數"""
     # 這裡需要檢查管理員權限
     if not check_admin_permission(req):
@@ -196,55 +278,32 @@ async def admin_add_points(req: Request, user_id: str, points: int, reason: str
         ref_id="admin_gift"
     )
     
-    return {"success": True}
+    return DefaultResponse({"success": True})
 
 @points_router.post("/admin/expire-sweep")
-async def admin_expire_sweep(req: Request):
+def admin_expire_sweep(req: Request):
     """管理員觸發到期清理"""
     if not check_admin_permission(req):
         raise HTTPException(status_code=403, detail="權限不足")
     
     points_system.expire_sweep()
-    return {"success": True}
+    return DefaultResponse({"success": True})
 
-# ========== 輔助函數 ==========
-
-def get_user_id_from_request(req: Request) -> Optional[str]:
-    """從請求中獲取用戶ID（配合現有認證系統）"""
-    # 方法1: 從session cookie
-    session_cookie = req.cookies.get("session")
-    if session_cookie:
-        try:
-            from app import session_signer
-            data = session_signer.loads(session_cookie)
-            # 後端使用 'uid' 作為用戶ID的鍵
-            return data.get("uid")
-        except:
-            pass
-    
-    # 方法2: 從Authorization header
-    auth_header = req.headers.get("Authorization")
-    if auth_header and auth_header.startswith("Bearer "):
-        token = auth_header.split(" ")[1]
-        # 這裡需要根據您的JWT實現解析token
-        pass
+@points_router.post("/admin/recompute-balance")
+def admin_recompute_balance(req: Request, user_id: str):
+    """管理員由帳本重新計算用戶錢包餘額（修復用）"""
+    if not check_admin_permission(req):
+        raise HTTPException(status_code=403, detail="權限不足")
     
-    # 方法3: 從查詢參數（臨時方案）
-    return req.query_params.get("user_id")
-
-def check_admin_permission(req: Request) -> bool:
-    """檢查管理員權限（配合現有管理員系統）"""
-    import os
-    admin_token = req.headers.get("x-admin-token")
-    expected_token = os.getenv("ADMIN_TOKEN")
-    return admin_token == expected_token
+    balance = points_system.recompute_wallet_balance(user_id)
+    return DefaultResponse({"success": True, "balance": balance})
 
 # ========== 定時任務 ==========
 
 async def daily_tasks():
     """每日定時任務"""
     # 到期清理
-    points_system.expire_sweep()
+    await asyncio.to_thread(points_system.expire_sweep)
     
     # 月贈點（如果需要）
     # await grant_monthly_points()
@@ -4,11 +4,15 @@ AI Points System - 點數訂閱制獨立模組
 """
 
 import sqlite3
+import bisect
 import hashlib
 import json
 import os
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
 from dataclasses import dataclass
 from enum import Enum
 
@@ -21,6 +25,28 @@ POINTS_CONFIG = {
     "CARRYOVER_RATE": 0.3,        # 結轉比例
 }
 
+# 各使用模式每次扣點數
+_COST_PER_UNIT = {
+    "oneclick": POINTS_CONFIG["POINTS_PER_ONE_CLICK"],
+    "chat": POINTS_CONFIG["POINTS_PER_CHAT"],
+}
+
+def _unit_cost(mode: str) -> int:
+    """取得模式的單次扣點數；未知模式直接拒絕，不再默默以聊天計價"""
+    unit = _COST_PER_UNIT.get(mode)
+    if unit is None:
+        raise ValueError(f"未知的使用模式: {mode}")
+    return unit
+
+# 錢包資訊快取（/points/wallet 常被前端輪詢；寫入路徑會主動失效）
+WALLET_CACHE_TTL = float(os.getenv("WALLET_CACHE_TTL", "5"))
+WALLET_CACHE_MAXSIZE = 10000
+
+def _expiry(days: int) -> Tuple[datetime, int]:
+    """回傳 days 天後的到期時間（顯示用 datetime, 比較用 epoch 秒）"""
+    expire_at = datetime.now() + timedelta(days=days)
+    return expire_at, int(expire_at.timestamp())
+
 class PointReason(Enum):
     PURCHASE = "purchase"
     DEDUCT = "deduct"
@@ -35,6 +61,13 @@ class OrderStatus(Enum):
     PAID = "paid"
     FAILED = "failed"
 
+# 寫入帳本/訂單用的字串值（避免在逐筆迴圈中重複查 Enum）
+_PURCHASE = PointReason.PURCHASE.value
+_DEDUCT = PointReason.DEDUCT.value
+_EXPIRE = PointReason.EXPIRE.value
+_ORDER_PENDING = OrderStatus.PENDING.value
+_ORDER_PAID = OrderStatus.PAID.value
+
 @dataclass
 class PointPack:
     pack_id: int
@@ -60,122 +93,201 @@ class PointsSystem:
             # 使用與主應用相同的資料庫
             db_path = os.getenv("DB_PATH", "three_agents_system.db")
         self.db_path = db_path
+        self._local = threading.local()
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self._wallet_cache: Dict[str, Tuple[float, Dict]] = {}  # user_id -> (到期時間, 錢包資訊)
+        self._packs: Optional[List[PointPack]] = None  # 點數包幾乎不變，載入後快取
+        self._pack_points: List[int] = []
+        self._plans: Optional[List[Plan]] = None
         self.init_database()
     
-    def get_conn(self):
-        conn = sqlite3.connect(self.db_path)
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
         conn.row_factory = sqlite3.Row
         return conn
     
+    def get_conn(self) -> sqlite3.Connection:
+        """取得唯讀連線（每個執行緒開啟一次後重複使用；WAL 模式下讀取不會被寫入阻塞）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def write_conn(self):
+        """取得唯一的寫入連線（以鎖序列化所有寫入）；成功時 commit、例外時 rollback"""
+        with self._write_lock:
+            if self._writer_conn is None:
+                self._writer_conn = self._connect()
+                self._writer_conn.execute("PRAGMA wal_autocheckpoint=1000")
+            with self._writer_conn as conn:
+                yield conn
+    
     def init_database(self):
         """初始化點數系統資料表"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        # 點數包表
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS point_packs (
-                pack_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                points INTEGER NOT NULL,
-                price_ntd INTEGER NOT NULL,
-                valid_days INTEGER DEFAULT 180,
-                is_active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # 點數訂單表
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS point_orders (
-                order_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                pack_id INTEGER NOT NULL,
-                price_paid INTEGER NOT NULL,
-                status TEXT DEFAULT 'pending',
-                provider TEXT DEFAULT 'manual',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                paid_at DATETIME,
-                FOREIGN KEY (pack_id) REFERENCES point_packs (pack_id)
-            )
-        """)
-        
-        # 點數錢包表
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS point_wallets (
-                user_id TEXT PRIMARY KEY,
-                balance INTEGER DEFAULT 0,
-                auto_topup_enabled BOOLEAN DEFAULT 0,
-                auto_topup_pack_id INTEGER,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (auto_topup_pack_id) REFERENCES point_packs (pack_id)
-            )
-        """)
-        
-        # 點數帳本表
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS point_ledger (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                delta INTEGER NOT NULL,
-                reason TEXT NOT NULL,
-                ref_id TEXT,
-                expire_at DATETIME,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # 訂閱方案表（只讀查詢來源）
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS plans (
-                plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                monthly_points INTEGER DEFAULT 0,
-                batch_limit INTEGER DEFAULT 10,
-                roles_limit INTEGER DEFAULT 1,
-                is_active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # 訂閱記錄表（只讀查詢來源）
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                plan_id INTEGER NOT NULL,
-                user_id TEXT NOT NULL,
-                renew_at DATETIME,
-                status TEXT DEFAULT 'active',
-                metadata TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (plan_id, user_id),
-                FOREIGN KEY (plan_id) REFERENCES plans (plan_id)
-            )
-        """)
-        
-        # 免費額度使用記錄
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS free_quota_usage (
-                user_id TEXT NOT NULL,
-                module TEXT NOT NULL,
-                usage_date DATE NOT NULL,
-                count INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, module, usage_date)
-            )
-        """)
-        
-        # 建立索引
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_expire ON point_ledger(user_id, expire_at)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_reason ON point_ledger(user_id, reason)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_status ON point_orders(user_id, status)")
-        
-        # 插入預設點數包
-        self._insert_default_packs(cur)
-        
-        # 插入預設方案
-        self._insert_default_plans(cur)
-        
-        conn.commit()
-        conn.close()
+        with self.write_conn() as conn:
+            cur = conn.cursor()
+
+            # 點數包表
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS point_packs (
+                    pack_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    points INTEGER NOT NULL,
+                    price_ntd INTEGER NOT NULL,
+                    valid_days INTEGER DEFAULT 180,
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 點數訂單表
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS point_orders (
+                    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    pack_id INTEGER NOT NULL,
+                    price_paid INTEGER NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    provider TEXT DEFAULT 'manual',
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    paid_at DATETIME,
+                    FOREIGN KEY (pack_id) REFERENCES point_packs (pack_id)
+                )
+            """)
+
+            # 點數錢包表
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS point_wallets (
+                    user_id TEXT PRIMARY KEY,
+                    balance INTEGER DEFAULT 0,
+                    auto_topup_enabled BOOLEAN DEFAULT 0,
+                    auto_topup_pack_id INTEGER,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (auto_topup_pack_id) REFERENCES point_packs (pack_id)
+                )
+            """)
+
+            # 點數帳本表
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS point_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    delta INTEGER NOT NULL,
+                    reason TEXT NOT NULL,
+                    ref_id TEXT,
+                    expire_at DATETIME,
+                    expire_ts INTEGER,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 訂閱方案表（只讀查詢來源）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS plans (
+                    plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    monthly_points INTEGER DEFAULT 0,
+                    batch_limit INTEGER DEFAULT 10,
+                    roles_limit INTEGER DEFAULT 1,
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 訂閱記錄表（只讀查詢來源）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    plan_id INTEGER NOT NULL,
+                    user_id TEXT NOT NULL,
+                    renew_at DATETIME,
+                    status TEXT DEFAULT 'active',
+                    metadata TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (plan_id, user_id),
+                    FOREIGN KEY (plan_id) REFERENCES plans (plan_id)
+                )
+            """)
+
+            # 免費額度使用記錄
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS free_quota_usage (
+                    user_id TEXT NOT NULL,
+                    module TEXT NOT NULL,
+                    usage_date DATE NOT NULL,
+                    count INTEGER DEFAULT 0,
+                    PRIMARY KEY (user_id, module, usage_date)
+                )
+            """)
+
+            # 系統狀態（例如每日排程上次執行時間）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS system_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 舊資料庫遷移：到期時間改以整數 epoch 秒比較（expire_at 保留供人工查閱）
+            ledger_columns = {row["name"] for row in cur.execute("PRAGMA table_info(point_ledger)")}
+            if "expire_ts" not in ledger_columns:
+                cur.execute("ALTER TABLE point_ledger ADD COLUMN expire_ts INTEGER")
+                # expire_at 是本地時間的 naive datetime，以 'utc' 修飾轉換，與新資料的 datetime.timestamp() 同基準
+                cur.execute("""
+                    UPDATE point_ledger SET expire_ts = CAST(strftime('%s', expire_at, 'utc') AS INTEGER)
+                    WHERE expire_at IS NOT NULL
+                """)
+                # 舊版錢包餘額不含已到期點數，與增量更新的基準（所有未清理的正數分錄）不同：
+                # 已有到期分錄的舊正數分錄（舊版清理未歸零）先歸零，再由帳本重算所有錢包一次
+                cur.execute("""
+                    UPDATE point_ledger SET delta = 0
+                    WHERE delta > 0 AND EXISTS (
+                        SELECT 1 FROM point_ledger e
+                        WHERE e.user_id = point_ledger.user_id AND e.reason = ?
+                          AND e.ref_id = CAST(point_ledger.id AS TEXT)
+                    )
+                """, (_EXPIRE,))
+                cur.execute("""
+                    UPDATE point_wallets SET
+                        balance = COALESCE((
+                            SELECT SUM(l.delta) FROM point_ledger l
+                            WHERE l.user_id = point_wallets.user_id AND l.delta > 0
+                        ), 0),
+                        updated_at = CURRENT_TIMESTAMP
+                """)
+                cur.execute("""
+                    INSERT INTO point_wallets (user_id, balance)
+                    SELECT user_id, SUM(delta) FROM point_ledger
+                    WHERE delta > 0 AND user_id NOT IN (SELECT user_id FROM point_wallets)
+                    GROUP BY user_id
+                """)
+                cur.execute("DROP INDEX IF EXISTS idx_ledger_user_expire")
+                cur.execute("DROP INDEX IF EXISTS idx_ledger_user_positive")
+                cur.execute("DROP INDEX IF EXISTS idx_ledger_expire_positive")
+
+            # 建立索引
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_expire ON point_ledger(user_id, expire_ts)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_reason ON point_ledger(user_id, reason)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_status ON point_orders(user_id, status)")
+            # 部分索引：扣點（最早到期優先）與到期清理只看仍有餘額的正數分錄
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_positive ON point_ledger(user_id, expire_ts) WHERE delta > 0")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_expire_positive ON point_ledger(expire_ts) WHERE delta > 0")
+
+            # 插入預設點數包
+            self._insert_default_packs(cur)
+
+            # 插入預設方案
+            self._insert_default_plans(cur)
+
+            # 讓查詢規劃器取得新索引的統計資訊（只分析需要的資料表）
+            cur.execute("PRAGMA optimize")
     
     def _insert_default_packs(self, cur):
         """插入預設點數包"""
@@ -205,87 +317,125 @@ class PointsSystem:
                 VALUES (?, ?, ?, ?)
             """, (name, monthly_points, batch_limit, roles_limit))
     
+    def invalidate_wallet(self, user_id: Optional[str] = None):
+        """清除錢包快取；未指定 user_id 時全部清除（需在交易提交後呼叫）"""
+        if user_id is None:
+            self._wallet_cache.clear()
+        else:
+            self._wallet_cache.pop(user_id, None)
+    
     def get_wallet_info(self, user_id: str) -> Dict:
-        """獲取錢包資訊"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        # 獲取餘額
-        wallet = cur.execute(
-            "SELECT balance, auto_topup_enabled FROM point_wallets WHERE user_id = ?",
-            (user_id,)
-        ).fetchone()
-        
-        if not wallet:
-            # 初始化錢包
-            cur.execute(
-                "INSERT INTO point_wallets (user_id, balance) VALUES (?, 0)",
+        """獲取錢包資訊（短暫快取）"""
+        cached = self._wallet_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return dict(cached[1])
+        
+        wallet_info = self._load_wallet_info(user_id)
+        cache = self._wallet_cache
+        if len(cache) >= WALLET_CACHE_MAXSIZE:
+            now = time.monotonic()
+            for stale_key in [k for k, v in cache.items() if v[0] <= now]:
+                cache.pop(stale_key, None)
+            if len(cache) >= WALLET_CACHE_MAXSIZE:
+                cache.pop(next(iter(cache)), None)
+        cache[user_id] = (time.monotonic() + WALLET_CACHE_TTL, wallet_info)
+        return dict(wallet_info)
+    
+    def _load_wallet_info(self, user_id: str) -> Dict:
+        """從資料庫讀取錢包資訊（新用戶不建立錢包，首次入帳時由 upsert 建立）"""
+        with self.get_conn() as conn:
+            cur = conn.cursor()
+
+            # 獲取餘額
+            wallet = cur.execute(
+                "SELECT balance, auto_topup_enabled FROM point_wallets WHERE user_id = ?",
                 (user_id,)
-            )
-            balance = 0
-            auto_topup_enabled = False
-        else:
+            ).fetchone()
+
+            if not wallet:
+                return {"balance": 0, "auto_topup_enabled": False, "expiring_soon": 0}
+
             balance = wallet["balance"]
-            auto_topup_enabled = wallet["auto_topup_enabled"]
-        
-        # 獲取即將到期的點數
-        expiring_soon = cur.execute("""
-            SELECT SUM(delta) as expiring_points
-            FROM point_ledger 
-            WHERE user_id = ? AND delta > 0 AND expire_at BETWEEN ? AND ?
-        """, (user_id, datetime.now(), datetime.now() + timedelta(days=7))).fetchone()
-        
-        conn.close()
-        
-        return {
-            "balance": balance,
-            "auto_topup_enabled": auto_topup_enabled,
-            "expiring_soon": expiring_soon["expiring_points"] or 0
-        }
+            auto_topup_enabled = bool(wallet["auto_topup_enabled"])
+
+            # 餘額為 0 時不可能有未用完的正數分錄，免查到期點數
+            if balance <= 0:
+                return {"balance": balance, "auto_topup_enabled": auto_topup_enabled, "expiring_soon": 0}
+
+            # 已到期但尚未被每日清理的點數（仍計在錢包內，需扣除）與 7 天內即將到期的點數一次查回
+            now_ts = int(time.time())
+            points = cur.execute("""
+                SELECT
+                    SUM(CASE WHEN expire_ts <= ? THEN delta END) as overdue_points,
+                    SUM(CASE WHEN expire_ts > ? THEN delta END) as expiring_points
+                FROM point_ledger 
+                WHERE user_id = ? AND delta > 0 AND expire_ts <= ?
+            """, (now_ts, now_ts, user_id, now_ts + 7 * 86400)).fetchone()
+
+            return {
+                "balance": balance - (points["overdue_points"] or 0),
+                "auto_topup_enabled": auto_topup_enabled,
+                "expiring_soon": points["expiring_points"] or 0
+            }
     
     def get_point_packs(self) -> List[PointPack]:
-        """獲取可用的點數包"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        packs = cur.execute(
-            "SELECT * FROM point_packs WHERE is_active = 1 ORDER BY points ASC"
-        ).fetchall()
-        
-        conn.close()
-        
-        return [PointPack(**dict(pack)) for pack in packs]
+        """獲取可用的點數包（記憶體快取）"""
+        return list(self._active_packs())
     
     def get_plans(self) -> List[Plan]:
-        """獲取訂閱方案（只讀）"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        plans = cur.execute(
-            "SELECT * FROM plans WHERE is_active = 1 ORDER BY monthly_points ASC"
-        ).fetchall()
-        
-        conn.close()
-        
-        return [Plan(**dict(plan)) for plan in plans]
+        """獲取訂閱方案（只讀，首次使用時載入後快取）"""
+        if self._plans is None:
+            with self.get_conn() as conn:
+                rows = conn.execute("""
+                    SELECT plan_id, name, monthly_points, batch_limit, roles_limit, is_active
+                    FROM plans WHERE is_active = 1 ORDER BY monthly_points ASC
+                """).fetchall()
+            self._plans = [Plan(**dict(row)) for row in rows]
+        return list(self._plans)
+    
+    def invalidate_catalog(self):
+        """點數包或方案資料異動後清除快取"""
+        self._packs = None
+        self._plans = None
+    
+    def _active_packs(self) -> List[PointPack]:
+        """啟用中的點數包（依點數排序，首次使用時載入後快取）"""
+        if self._packs is None:
+            with self.get_conn() as conn:
+                rows = conn.execute("""
+                    SELECT pack_id, name, points, price_ntd, valid_days, is_active
+                    FROM point_packs WHERE is_active = 1 ORDER BY points ASC, pack_id ASC
+                """).fetchall()
+            packs = [PointPack(**dict(row)) for row in rows]
+            self._pack_points = [pack.points for pack in packs]
+            self._packs = packs
+        return self._packs
     
     def authorize_usage(self, user_id: str, module: str, mode: str, count: int) -> Dict:
         """授權使用（不扣點，只判斷）"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
+        unit_cost = _unit_cost(mode)
+
+        # 免費額度、訂閱批次上限、錢包餘額（含尚未清理的到期點數）一次查回
+        now = datetime.now()
+        today = now.date()
+        with self.get_conn() as conn:
+            row = conn.execute("""
+                SELECT
+                    (SELECT count FROM free_quota_usage
+                     WHERE user_id = ? AND module = ? AND usage_date = ?) AS free_used,
+                    (SELECT p.batch_limit FROM subscriptions s
+                     JOIN plans p ON s.plan_id = p.plan_id
+                     WHERE s.user_id = ? AND s.status = 'active' LIMIT 1) AS batch_limit,
+                    (SELECT balance FROM point_wallets WHERE user_id = ?) AS balance,
+                    (SELECT SUM(delta) FROM point_ledger
+                     WHERE user_id = ? AND delta > 0 AND expire_ts <= ?) AS overdue
+            """, (user_id, module, today, user_id, user_id, user_id, int(now.timestamp()))).fetchone()
+
         # 1. 檢查免費額度
-        today = datetime.now().date()
-        free_usage = cur.execute("""
-            SELECT count FROM free_quota_usage 
-            WHERE user_id = ? AND module = ? AND usage_date = ?
-        """, (user_id, module, today)).fetchone()
-        
-        used_free = free_usage["count"] if free_usage else 0
+        used_free = row["free_used"] or 0
         remaining_free = max(0, POINTS_CONFIG["FREE_QUOTA_PER_MODULE"] - used_free)
-        
+
         if remaining_free >= count:
-            conn.close()
             return {
                 "authorized": True,
                 "cost": 0,
@@ -293,23 +443,12 @@ class PointsSystem:
                 "needTopup": False,
                 "suggestPackIds": []
             }
-        
+
         # 2. 計算需要扣的點數
-        if mode == "oneclick":
-            points_needed = POINTS_CONFIG["POINTS_PER_ONE_CLICK"] * count
-        else:  # chat
-            points_needed = POINTS_CONFIG["POINTS_PER_CHAT"] * count
-        
+        points_needed = unit_cost * count
+
         # 3. 檢查訂閱方案限制
-        subscription = cur.execute("""
-            SELECT s.*, p.batch_limit, p.roles_limit
-            FROM subscriptions s
-            JOIN plans p ON s.plan_id = p.plan_id
-            WHERE s.user_id = ? AND s.status = 'active'
-        """, (user_id,)).fetchone()
-        
-        if subscription and count > subscription["batch_limit"]:
-            conn.close()
+        if row["batch_limit"] is not None and count > row["batch_limit"]:
             return {
                 "authorized": False,
                 "cost": points_needed,
@@ -317,17 +456,11 @@ class PointsSystem:
                 "needTopup": False,
                 "suggestPackIds": []
             }
-        
-        # 4. 檢查點數餘額
-        wallet = cur.execute(
-            "SELECT balance FROM point_wallets WHERE user_id = ?",
-            (user_id,)
-        ).fetchone()
-        
-        balance = wallet["balance"] if wallet else 0
-        
+
+        # 4. 檢查點數餘額（已到期但尚未被每日清理的點數不可使用）
+        balance = (row["balance"] or 0) - (row["overdue"] or 0)
+
         if balance >= points_needed:
-            conn.close()
             return {
                 "authorized": True,
                 "cost": points_needed,
@@ -335,243 +468,307 @@ class PointsSystem:
                 "needTopup": False,
                 "suggestPackIds": []
             }
-        
-        # 5. 需要補點
-        suggest_packs = cur.execute("""
-            SELECT pack_id FROM point_packs 
-            WHERE is_active = 1 AND points >= ? 
-            ORDER BY points ASC LIMIT 3
-        """, (points_needed,)).fetchall()
-        
-        conn.close()
-        
+
+        # 5. 需要補點：從快取的點數包中取點數足夠的前 3 個
+        packs = self._active_packs()
+        start = bisect.bisect_left(self._pack_points, points_needed)
+
         return {
             "authorized": False,
             "cost": points_needed,
             "reason": "INSUFFICIENT_POINTS",
             "needTopup": True,
-            "suggestPackIds": [pack["pack_id"] for pack in suggest_packs]
+            "suggestPackIds": [pack.pack_id for pack in packs[start:start + 3]]
         }
     
     def create_checkout(self, user_id: str, pack_id: int) -> Dict:
         """創建點數包訂單"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        # 獲取點數包資訊
-        pack = cur.execute(
-            "SELECT * FROM point_packs WHERE pack_id = ? AND is_active = 1",
-            (pack_id,)
-        ).fetchone()
-        
-        if not pack:
-            conn.close()
-            return {"error": "點數包不存在"}
-        
-        # 創建訂單
-        order_id = cur.execute("""
-            INSERT INTO point_orders (user_id, pack_id, price_paid, status)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, pack_id, pack["price_ntd"], OrderStatus.PENDING.value)).lastrowid
-        
-        conn.commit()
-        conn.close()
-        
-        return {
-            "order_id": order_id,
-            "checkout_url": f"/points/checkout/{order_id}",
-            "amount": pack["price_ntd"],
-            "points": pack["points"]
-        }
+        with self.write_conn() as conn:
+            cur = conn.cursor()
+
+            # 獲取點數包資訊
+            pack = cur.execute(
+                "SELECT * FROM point_packs WHERE pack_id = ? AND is_active = 1",
+                (pack_id,)
+            ).fetchone()
+
+            if not pack:
+                return {"error": "點數包不存在"}
+
+            # 創建訂單
+            order_id = cur.execute("""
+                INSERT INTO point_orders (user_id, pack_id, price_paid, status)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, pack_id, pack["price_ntd"], _ORDER_PENDING)).lastrowid
+
+            return {
+                "order_id": order_id,
+                "checkout_url": f"/points/checkout/{order_id}",
+                "amount": pack["price_ntd"],
+                "points": pack["points"]
+            }
     
     def process_payment(self, order_id: int, provider: str = "manual") -> bool:
         """處理付款成功（金流回調）"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        # 獲取訂單資訊
-        order = cur.execute("""
-            SELECT o.*, p.points, p.valid_days
-            FROM point_orders o
-            JOIN point_packs p ON o.pack_id = p.pack_id
-            WHERE o.order_id = ? AND o.status = 'pending'
-        """, (order_id,)).fetchone()
-        
-        if not order:
-            conn.close()
-            return False
-        
-        # 更新訂單狀態
-        cur.execute("""
-            UPDATE point_orders 
-            SET status = ?, provider = ?, paid_at = CURRENT_TIMESTAMP
-            WHERE order_id = ?
-        """, (OrderStatus.PAID.value, provider, order_id))
-        
-        # 添加點數到帳本
-        expire_at = datetime.now() + timedelta(days=order["valid_days"])
-        cur.execute("""
-            INSERT INTO point_ledger (user_id, delta, reason, ref_id, expire_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (order["user_id"], order["points"], PointReason.PURCHASE.value, str(order_id), expire_at))
-        
-        # 更新錢包餘額
-        self._update_wallet_balance(cur, order["user_id"])
-        
-        conn.commit()
-        conn.close()
+        with self.write_conn() as conn:
+            cur = conn.cursor()
+            # 開頭即取得寫鎖：重複回調會排隊，第二次讀到的訂單已非 pending，不會重複入帳
+            cur.execute("BEGIN IMMEDIATE")
+
+            # 獲取訂單資訊
+            order = cur.execute("""
+                SELECT o.*, p.points, p.valid_days
+                FROM point_orders o
+                JOIN point_packs p ON o.pack_id = p.pack_id
+                WHERE o.order_id = ? AND o.status = 'pending'
+            """, (order_id,)).fetchone()
+
+            if not order:
+                return False
+
+            # 更新訂單狀態
+            cur.execute("""
+                UPDATE point_orders 
+                SET status = ?, provider = ?, paid_at = CURRENT_TIMESTAMP
+                WHERE order_id = ?
+            """, (_ORDER_PAID, provider, order_id))
+
+            # 添加點數到帳本
+            expire_at, expire_ts = _expiry(order["valid_days"])
+            cur.execute("""
+                INSERT INTO point_ledger (user_id, delta, reason, ref_id, expire_at, expire_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (order["user_id"], order["points"], _PURCHASE, str(order_id), expire_at, expire_ts))
+
+            # 更新錢包餘額
+            self._apply_wallet_delta(cur, order["user_id"], order["points"])
+
+        self.invalidate_wallet(order["user_id"])
         return True
     
     def consume_points(self, user_id: str, module: str, mode: str, count: int) -> bool:
         """實際扣點（在既有流程完成後調用）"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        # 1. 先使用免費額度
-        today = datetime.now().date()
-        free_usage = cur.execute("""
-            SELECT count FROM free_quota_usage 
-            WHERE user_id = ? AND module = ? AND usage_date = ?
-        """, (user_id, module, today)).fetchone()
-        
-        used_free = free_usage["count"] if free_usage else 0
-        remaining_free = max(0, POINTS_CONFIG["FREE_QUOTA_PER_MODULE"] - used_free)
-        
-        if remaining_free > 0:
-            # 更新免費額度使用記錄
-            free_count = min(remaining_free, count)
-            cur.execute("""
-                INSERT OR REPLACE INTO free_quota_usage (user_id, module, usage_date, count)
+        unit_cost = _unit_cost(mode)
+
+        with self.write_conn() as conn:
+            cur = conn.cursor()
+            # 開頭即取得寫鎖，避免同一用戶併發扣點時讀到相同餘額，也免去讀鎖升級寫鎖時的 SQLITE_BUSY
+            cur.execute("BEGIN IMMEDIATE")
+
+            # 1. 先使用免費額度：累加本日使用次數並取回累加後的值
+            # （count 記錄本日總使用次數，超過免費額度的部分以點數支付）
+            now = datetime.now()
+            today = now.date()
+            used_total = cur.execute("""
+                INSERT INTO free_quota_usage (user_id, module, usage_date, count)
                 VALUES (?, ?, ?, ?)
-            """, (user_id, module, today, used_free + free_count))
-            
+                ON CONFLICT(user_id, module, usage_date) DO UPDATE SET count = count + excluded.count
+                RETURNING count
+            """, (user_id, module, today, count)).fetchone()["count"]
+
+            used_before = used_total - count
+            free_count = min(count, max(0, POINTS_CONFIG["FREE_QUOTA_PER_MODULE"] - used_before))
             count -= free_count
             if count == 0:
-                conn.commit()
-                conn.close()
                 return True
-        
-        # 2. 計算需要扣的點數
-        if mode == "oneclick":
-            points_needed = POINTS_CONFIG["POINTS_PER_ONE_CLICK"] * count
-        else:  # chat
-            points_needed = POINTS_CONFIG["POINTS_PER_CHAT"] * count
-        
-        # 3. 扣點
-        success = self._deduct_points(cur, user_id, points_needed)
-        
+
+            # 2. 計算需要扣的點數
+            points_needed = unit_cost * count
+
+            # 3. 扣點
+            success = self._deduct_points(cur, user_id, points_needed, int(now.timestamp()))
+
+            if not success:
+                # 餘額不足：撤銷本次已寫入的免費額度與扣點分錄
+                conn.rollback()
+
         if success:
-            conn.commit()
-        
-        conn.close()
+            self.invalidate_wallet(user_id)
         return success
     
-    def _deduct_points(self, cur, user_id: str, points_needed: int) -> bool:
+    def _deduct_points(self, cur, user_id: str, points_needed: int, now_ts: int) -> bool:
         """扣點邏輯（最早到期優先）"""
         # 獲取可用的正數分錄（按到期時間排序）
         available_ledgers = cur.execute("""
             SELECT id, delta FROM point_ledger 
-            WHERE user_id = ? AND delta > 0 AND expire_at > CURRENT_TIMESTAMP
-            ORDER BY expire_at ASC
-        """, (user_id,)).fetchall()
+            WHERE user_id = ? AND delta > 0 AND expire_ts > ?
+            ORDER BY expire_ts ASC
+        """, (user_id, now_ts)).fetchall()
         
         remaining = points_needed
+        deduct_rows = []
+        update_rows = []
         
         for ledger in available_ledgers:
             if remaining <= 0:
                 break
             
             deduct_amount = min(remaining, ledger["delta"])
-            
-            # 添加負數分錄
-            cur.execute("""
-                INSERT INTO point_ledger (user_id, delta, reason, ref_id)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, -deduct_amount, PointReason.DEDUCT.value, str(ledger["id"])))
-            
-            # 更新原分錄
-            cur.execute("""
-                UPDATE point_ledger 
-                SET delta = delta - ? 
-                WHERE id = ?
-            """, (deduct_amount, ledger["id"]))
-            
+            deduct_rows.append((user_id, -deduct_amount, _DEDUCT, str(ledger["id"])))
+            update_rows.append((deduct_amount, ledger["id"]))
             remaining -= deduct_amount
         
         if remaining > 0:
             return False  # 餘額不足
         
+        # 添加負數分錄
+        cur.executemany("""
+            INSERT INTO point_ledger (user_id, delta, reason, ref_id)
+            VALUES (?, ?, ?, ?)
+        """, deduct_rows)
+        
+        # 更新原分錄
+        cur.executemany("""
+            UPDATE point_ledger 
+            SET delta = delta - ? 
+            WHERE id = ?
+        """, update_rows)
+        
         # 更新錢包餘額
-        self._update_wallet_balance(cur, user_id)
+        self._apply_wallet_delta(cur, user_id, -points_needed)
         return True
     
-    def _update_wallet_balance(self, cur, user_id: str):
-        """更新錢包餘額"""
-        # 計算當前餘額
-        balance = cur.execute("""
-            SELECT COALESCE(SUM(delta), 0) as balance
+    def _apply_wallet_delta(self, cur, user_id: str, delta: int):
+        """依本次寫入帳本的增減量更新錢包餘額（不重新掃描帳本）
+
+        錢包餘額 = 尚未清理的正數分錄剩餘點數總和；已到期的點數在 expire_sweep 清理時才扣除，
+        期間讀取可用餘額需再扣掉已到期的部分（見 _load_wallet_info / authorize_usage）
+        """
+        cur.execute("""
+            INSERT INTO point_wallets (user_id, balance, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                balance = balance + excluded.balance,
+                updated_at = CURRENT_TIMESTAMP
+        """, (user_id, delta))
+    
+    def _recompute_wallet_balance(self, cur, user_id: str):
+        """由帳本重新計算錢包餘額，回傳目前可用餘額（僅供修復使用）"""
+        # 錢包存放所有尚未清理的正數分錄（含已到期者，由 expire_sweep 扣除），與增量更新同基準
+        row = cur.execute("""
+            SELECT
+                COALESCE(SUM(delta), 0) as balance,
+                COALESCE(SUM(CASE WHEN expire_ts <= ? THEN delta END), 0) as overdue
             FROM point_ledger 
-            WHERE user_id = ? AND expire_at > CURRENT_TIMESTAMP
-        """, (user_id,)).fetchone()["balance"]
+            WHERE user_id = ? AND delta > 0
+        """, (int(time.time()), user_id)).fetchone()
+        balance = row["balance"]
         
-        # 更新錢包
+        # 更新錢包（保留自動補點設定）
         cur.execute("""
-            INSERT OR REPLACE INTO point_wallets (user_id, balance, updated_at)
+            INSERT INTO point_wallets (user_id, balance, updated_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                balance = excluded.balance,
+                updated_at = CURRENT_TIMESTAMP
         """, (user_id, balance))
+        return balance - row["overdue"]
+    
+    def recompute_wallet_balance(self, user_id: str) -> int:
+        """管理員修復：由帳本重新計算並寫回錢包餘額"""
+        with self.write_conn() as conn:
+            balance = self._recompute_wallet_balance(conn.cursor(), user_id)
+        
+        self.invalidate_wallet(user_id)
+        return balance
     
     def add_points(self, user_id: str, points: int, reason: PointReason, ref_id: str = None, expire_days: int = 180):
         """添加點數"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        expire_at = datetime.now() + timedelta(days=expire_days)
-        
-        cur.execute("""
-            INSERT INTO point_ledger (user_id, delta, reason, ref_id, expire_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, points, reason.value, ref_id, expire_at))
-        
-        self._update_wallet_balance(cur, user_id)
-        conn.commit()
-        conn.close()
+        with self.write_conn() as conn:
+            cur = conn.cursor()
+
+            expire_at, expire_ts = _expiry(expire_days)
+
+            cur.execute("""
+                INSERT INTO point_ledger (user_id, delta, reason, ref_id, expire_at, expire_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, points, reason.value, ref_id, expire_at, expire_ts))
+
+            self._apply_wallet_delta(cur, user_id, points)
+
+        self.invalidate_wallet(user_id)
     
     def expire_sweep(self):
-        """到期清理（每日排程）"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        # 處理到期的點數
-        expired_ledgers = cur.execute("""
-            SELECT id, user_id, delta FROM point_ledger 
-            WHERE delta > 0 AND expire_at <= CURRENT_TIMESTAMP
-        """).fetchall()
-        
-        for ledger in expired_ledgers:
-            # 添加到期分錄
-            cur.execute("""
+        """到期清理（每日排程）：以整批 SQL 在同一交易內完成"""
+        with self.write_conn() as conn:
+            cur = conn.cursor()
+            # 先取得寫鎖，避免清理期間有扣點寫入同一批分錄
+            cur.execute("BEGIN IMMEDIATE")
+
+            # 固定本次清理的截止時間，三個語句看到同一批到期分錄
+            cutoff = int(time.time())
+
+            # 已有到期分錄的舊資料（舊版清理未將原分錄歸零）不可再扣一次
+            not_recorded = """
+                NOT EXISTS (
+                    SELECT 1 FROM point_ledger e
+                    WHERE e.user_id = l.user_id AND e.reason = ? AND e.ref_id = CAST(l.id AS TEXT)
+                )
+            """
+
+            # 1. 依用戶一次扣除到期點數（須在寫入到期分錄之前計算）
+            cur.execute(f"""
+                UPDATE point_wallets
+                SET balance = balance - (
+                        SELECT SUM(l.delta) FROM point_ledger l
+                        WHERE l.user_id = point_wallets.user_id AND l.delta > 0 AND l.expire_ts <= ?
+                          AND {not_recorded}
+                    ),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE user_id IN (
+                    SELECT l.user_id FROM point_ledger l
+                    WHERE l.delta > 0 AND l.expire_ts <= ? AND {not_recorded}
+                )
+            """, (cutoff, _EXPIRE, cutoff, _EXPIRE))
+
+            # 2. 為每筆尚未到期處理的正數分錄添加到期分錄
+            expired_count = cur.execute(f"""
                 INSERT INTO point_ledger (user_id, delta, reason, ref_id)
-                VALUES (?, ?, ?, ?)
-            """, (ledger["user_id"], -ledger["delta"], PointReason.EXPIRE.value, str(ledger["id"])))
-            
-            # 更新錢包餘額
-            self._update_wallet_balance(cur, ledger["user_id"])
-        
-        conn.commit()
-        conn.close()
+                SELECT l.user_id, -l.delta, ?, CAST(l.id AS TEXT)
+                FROM point_ledger l
+                WHERE l.delta > 0 AND l.expire_ts <= ? AND {not_recorded}
+            """, (_EXPIRE, cutoff, _EXPIRE)).rowcount
+
+            # 3. 原分錄歸零（同扣點做法），避免下次清理重複到期。
+            #    此時所有到期正數分錄都已有到期分錄，舊資料一併歸零，不影響餘額
+            cur.execute(
+                "UPDATE point_ledger SET delta = 0 WHERE delta > 0 AND expire_ts <= ?",
+                (cutoff,)
+            )
+
+        if expired_count > 0:
+            self.invalidate_wallet()
+    
+    def get_meta(self, key: str) -> Optional[str]:
+        """讀取系統狀態值"""
+        with self.get_conn() as conn:
+            row = conn.execute("SELECT value FROM system_meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+    
+    def set_meta(self, key: str, value: str):
+        """寫入系統狀態值"""
+        with self.write_conn() as conn:
+            conn.execute("""
+                INSERT INTO system_meta (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+            """, (key, value))
     
     def toggle_auto_topup(self, user_id: str, enabled: bool, pack_id: int = None):
         """切換自動補點"""
-        conn = self.get_conn()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            INSERT OR REPLACE INTO point_wallets (user_id, auto_topup_enabled, auto_topup_pack_id)
-            VALUES (?, ?, ?)
-        """, (user_id, enabled, pack_id))
-        
-        conn.commit()
-        conn.close()
+        with self.write_conn() as conn:
+            cur = conn.cursor()
 
+            # 只更新設定欄位，不覆蓋既有餘額
+            cur.execute("""
+                INSERT INTO point_wallets (user_id, auto_topup_enabled, auto_topup_pack_id)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    auto_topup_enabled = excluded.auto_topup_enabled,
+                    auto_topup_pack_id = excluded.auto_topup_pack_id,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (user_id, enabled, pack_id))
+
+        self.invalidate_wallet(user_id)
+    
 # 全域實例
 points_system = PointsSystem()
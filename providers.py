@@ -1,80 +1,48 @@
 from typing import Generator, Dict, Any
+from functools import lru_cache
 import json
 import time
 
-class LLMProvider:
-    def __init__(self, provider_type: str = "local"):
-        self.provider_type = provider_type
-    
-    def stream_response(self, messages: list, **kwargs) -> Generator[Dict[str, Any], None, None]:
-        """串流回應"""
-        if self.provider_type == "local":
-            yield from self._local_stream(messages, **kwargs)
-        elif self.provider_type == "openai":
-            yield from self._openai_stream(messages, **kwargs)
-        elif self.provider_type == "gemini":
-            yield from self._gemini_stream(messages, **kwargs)
-        else:
-            raise ValueError(f"不支援的provider: {self.provider_type}")
-    
-    def _local_stream(self, messages: list, **kwargs) -> Generator[Dict[str, Any], None, None]:
-        """本地假模型串流"""
-        # 模擬完整回應
-        full_response = self._generate_local_response(messages, **kwargs)
-        
-        # 逐token輸出 - 智能加速
-        tokens = list(full_response)
-        for i, token in enumerate(tokens):
-            yield {
-                "type": "content",
-                "token": token
-            }
-            
-            # 智能延遲：開頭慢一點，中間快，結尾稍慢
-            if i < 10:  # 前10個字符稍慢，讓用戶看到開始
-                time.sleep(0.01)
-            elif i < len(tokens) - 10:  # 中間部分最快
-                time.sleep(0.003)
-            else:  # 結尾稍慢，讓用戶看到完成
-                time.sleep(0.008)
-        
-        yield {"type": "done"}
-    
-    def _generate_local_response(self, messages: list, **kwargs) -> str:
-        """生成本地回應"""
-        # 從kwargs獲取參數
-        agent = kwargs.get('agent', 'script_generation')
-        topic = kwargs.get('topic', '')
-        template = kwargs.get('template', 'A')
-        platform = kwargs.get('platform', 'Reels')
-        duration = kwargs.get('duration', '30')
-        
-        # 根據模板生成腳本
-        if agent == "script_generation":
-            return self._generate_script(topic, template, platform, duration)
-        else:
-            return f"這是{agent}的回應，主題：{topic}"
+# 本地假模型每批輸出的字元數
+LOCAL_STREAM_BATCH_CHARS = 8
+
+# 本地回應參數預設值
+_GEN_DEFAULTS = {
+    "agent": "script_generation",
+    "topic": "",
+    "template": "A",
+    "platform": "Reels",
+    "duration": "30",
+}
+
+# 腳本模板與平台說明（固定內容，模組載入時建立一次）
+_TEMPLATES = {
+    "A": "標準行銷三段式（Hook → Value → CTA）",
+    "B": "問題 → 解決 → 證明（Problem → Solution → Proof）",
+    "C": "Before → After → 秘密揭露",
+    "D": "教學知識型（迷思 → 原理 → 要點 → 行動）",
+    "E": "故事敘事型（起 → 承 → 轉 → 合）"
+}
+
+_PLATFORMS = {
+    "Reels": "自然、生活化、強情緒；30s內最穩",
+    "TikTok": "節奏更快、梗感強；字卡與反差戲劇化",
+    "小紅書": "審美/文案同理心；畫面乾淨、字幕精修",
+    "YouTube Shorts": "高品質內容，適合教學和深度內容"
+}
+
+@lru_cache(maxsize=256)
+def _render_script(topic: str, template: str, platform: str, duration: str) -> str:
+    """渲染腳本（純函式，相同參數直接取快取）"""
+    template_desc = _TEMPLATES.get(template, _TEMPLATES["A"])
+    platform_desc = _PLATFORMS.get(platform, _PLATFORMS["Reels"])
+    # 時長只解析一次；Value 段結束秒數全文共用
+    d = int(duration)
+    v_end = d * 0.8
     
-    def _generate_script(self, topic: str, template: str, platform: str, duration: str) -> str:
-        """生成腳本"""
-        templates = {
-            "A": "標準行銷三段式（Hook → Value → CTA）",
-            "B": "問題 → 解決 → 證明（Problem → Solution → Proof）",
-            "C": "Before → After → 秘密揭露",
-            "D": "教學知識型（迷思 → 原理 → 要點 → 行動）",
-            "E": "故事敘事型（起 → 承 → 轉 → 合）"
-        }
-        
-        platforms = {
-            "Reels": "自然、生活化、強情緒；30s內最穩",
-            "TikTok": "節奏更快、梗感強；字卡與反差戲劇化",
-            "小紅書": "審美/文案同理心；畫面乾淨、字幕精修",
-            "YouTube Shorts": "高品質內容，適合教學和深度內容"
-        }
-        
-        script = f"""# {topic} - {templates[template]} 腳本
+    script = f"""# {topic} - {template_desc} 腳本
 
-**平台：** {platforms[platform]}
+**平台：** {platform_desc}
 **時長：** {duration}秒
 
 ## 腳本結構
@@ -84,13 +52,13 @@ class LLMProvider:
 - 直擊痛點，吸睛開場
 - 使用問句或反差手法
 
-### Value (5-{int(duration)*0.8}秒)
+### Value (5-{v_end}秒)
 核心價值內容：
 1. 機制原理說明
 2. 具體步驟方法  
 3. 真實見證效果
 
-### CTA ({int(duration)*0.8}-{duration}秒)
+### CTA ({v_end}-{duration}秒)
 「記得關注收藏，獲取更多{topic}技巧」
 - 明確行動指引
 - 關注、留言或購買連結
@@ -106,13 +74,71 @@ class LLMProvider:
 {{
   "segments": [
     {{"type": "hook", "start_sec": 0, "end_sec": 5, "camera": "CU", "dialog": "你知道為什麼{topic}總是沒效果嗎？", "visual": "大字卡+表情特寫"}},
-    {{"type": "value", "start_sec": 5, "end_sec": {int(duration)*0.8}, "camera": "MS", "dialog": "核心內容講解", "visual": "產品展示+字幕"}},
-    {{"type": "cta", "start_sec": {int(duration)*0.8}, "end_sec": {duration}, "camera": "WS", "dialog": "記得關注收藏", "visual": "品牌logo"}}
+    {{"type": "value", "start_sec": 5, "end_sec": {v_end}, "camera": "MS", "dialog": "核心內容講解", "visual": "產品展示+字幕"}},
+    {{"type": "cta", "start_sec": {v_end}, "end_sec": {d}, "camera": "WS", "dialog": "記得關注收藏", "visual": "品牌logo"}}
   ]
 }}
 ```"""
+    
+    return script
+
+class LLMProvider:
+    def __init__(self, provider_type: str = "local"):
+        self.provider_type = provider_type
+        self._dispatch = {
+            "local": self._local_stream,
+            "openai": self._openai_stream,
+            "gemini": self._gemini_stream,
+        }
+    
+    def stream_response(self, messages: list, **kwargs) -> Generator[Dict[str, Any], None, None]:
+        """串流回應"""
+        handler = self._dispatch.get(self.provider_type)
+        if handler is None:
+            raise ValueError(f"不支援的provider: {self.provider_type}")
+        yield from handler(messages, **kwargs)
+    
+    def _local_stream(self, messages: list, **kwargs) -> Generator[Dict[str, Any], None, None]:
+        """本地假模型串流"""
+        # 模擬完整回應
+        full_response = self._generate_local_response(messages, **kwargs)
+        
+        # 智能延遲：開頭慢一點，中間快，結尾稍慢（預先切段，迴圈內不再判斷位置）
+        n = len(full_response)
+        tail_start = max(10, n - 10)
+        segments = (
+            (full_response[:10], 0.01),               # 前10個字符稍慢，讓用戶看到開始
+            (full_response[10:tail_start], 0.003),    # 中間部分最快
+            (full_response[tail_start:], 0.008),      # 結尾稍慢，讓用戶看到完成
+        )
+        
+        # 分批輸出 - 每批一次 sleep，節奏與逐字輸出相同
+        for text, per_char in segments:
+            for start in range(0, len(text), LOCAL_STREAM_BATCH_CHARS):
+                chunk = text[start:start + LOCAL_STREAM_BATCH_CHARS]
+                yield {
+                    "type": "content",
+                    "token": chunk
+                }
+                time.sleep(per_char * len(chunk))
         
-        return script
+        yield {"type": "done"}
+    
+    def _generate_local_response(self, messages: list, **kwargs) -> str:
+        """生成本地回應"""
+        # 以預設值合併kwargs取得參數
+        params = {**_GEN_DEFAULTS, **kwargs}
+        agent = params["agent"]
+        
+        # 根據模板生成腳本
+        if agent == "script_generation":
+            return self._generate_script(params["topic"], params["template"], params["platform"], params["duration"])
+        else:
+            return f"這是{agent}的回應，主題：{params['topic']}"
+    
+    def _generate_script(self, topic: str, template: str, platform: str, duration: str) -> str:
+        """生成腳本"""
+        return _render_script(topic, template, platform, duration)
     
     def _openai_stream(self, messages: list, **kwargs) -> Generator[Dict[str, Any], None, None]:
         """OpenAI串流（預留）"""
@@ -1,37 +1,77 @@
 import os
 import re
-from typing import List, Dict
+import logging
+import heapq
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
 from knowledge_loader import KnowledgeLoader
 
+_WORD_RE = re.compile(r'\w+')
+
+logger = logging.getLogger(__name__)
+
 class RAGRetriever:
     def __init__(self):
         self.knowledge_loader = KnowledgeLoader()
+        # agent -> (行內容, 各行詞數, 倒排索引 詞 -> 含該詞的行號)，知識庫只切行與分詞一次
+        self._index_cache: Dict[str, Tuple[List[str], List[int], Dict[str, List[int]]]] = {}
+    
+    def _index(self, agent: str) -> Optional[Tuple[List[str], List[int], Dict[str, List[int]]]]:
+        """取得 agent 知識庫的倒排索引（首次載入後快取）"""
+        cached = self._index_cache.get(agent)
+        if cached is not None:
+            return cached
+        
+        knowledge = self.knowledge_loader.load_knowledge(agent)
+        if not knowledge:
+            return None
+        
+        lines: List[str] = []
+        sizes: List[int] = []
+        postings: Dict[str, List[int]] = {}
+        for raw in knowledge.split('\n'):
+            # 空行與分隔線（= / - 開頭）在建索引時就濾掉，查詢時不再判斷
+            line = raw.strip()
+            if not line or raw.startswith(('=', '-')):
+                continue
+            words = frozenset(_WORD_RE.findall(line.lower()))
+            line_id = len(lines)
+            lines.append(line)
+            sizes.append(len(words))
+            for word in words:
+                postings.setdefault(word, []).append(line_id)
+        
+        index = (lines, sizes, postings)
+        self._index_cache[agent] = index
+        return index
     
     def retrieve(self, agent: str, query: str, top_k: int = 3) -> List[str]:
         """檢索相關知識片段"""
         try:
-            knowledge = self.knowledge_loader.load_knowledge(agent)
-            if not knowledge:
+            index = self._index(agent)
+            if not index:
                 return []
+            lines, sizes, postings = index
             
-            # 簡單的關鍵詞匹配檢索
-            query_words = set(re.findall(r'\w+', query.lower()))
-            lines = knowledge.split('\n')
+            # 關鍵詞 Jaccard 相似度 |Q∩L| / |Q∪L|（依長度正規化，長行不再佔優勢）
+            query_words = frozenset(_WORD_RE.findall(query.lower()))
+            if not query_words:
+                return []
+            query_size = len(query_words)
             
-            scored_lines = []
-            for line in lines:
-                if not line.strip() or line.startswith('=') or line.startswith('-'):
-                    continue
-                
-                line_words = set(re.findall(r'\w+', line.lower()))
-                score = len(query_words.intersection(line_words))
-                if score > 0:
-                    scored_lines.append((score, line.strip()))
+            # 只走訪含查詢詞的行：倒排串列合併即得各行交集大小
+            common = Counter()
+            for word in query_words:
+                common.update(postings.get(word, ()))
             
-            # 按分數排序並返回前top_k個
-            scored_lines.sort(key=lambda x: x[0], reverse=True)
-            return [line for _, line in scored_lines[:top_k]]
+            # 取分數最高的 top_k 個（同分保持原順序，不需整批排序）
+            top = heapq.nlargest(
+                top_k,
+                common.items(),
+                key=lambda item: (item[1] / (query_size + sizes[item[0]] - item[1]), -item[0])
+            )
+            return [lines[line_id] for line_id, _ in top]
         
-        except Exception as e:
-            print(f"RAG檢索錯誤: {e}")
+        except Exception:
+            logger.exception("RAG檢索錯誤")
             return []